@@ -2496,6 +2496,26 @@ class ChurnRoom:
         cleanup_output_capture()
         exit(0)
     
+    @staticmethod
+    def _resolve_retractions(lines):
+        """Drop chat.log retraction records and the entries they retract.
+
+        The logger takes entries back by appending
+        {"type": "retraction", "retracts": <seq>} instead of rewriting the file.
+        """
+        parsed = []
+        retracted = set()
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except (ValueError, TypeError):
+                continue
+            if entry.get('type') == 'retraction':
+                retracted.add(entry.get('retracts'))
+            else:
+                parsed.append((line, entry.get('seq')))
+        return [line for line, seq in parsed if seq is None or seq not in retracted]
+
     def handle_chat_update(self):
         """Process new chat log entries."""
         # Prevent simultaneous processing of the same file change
@@ -2523,6 +2543,7 @@ class ChurnRoom:
             
             with open(self.chat_log_path, 'r', encoding='utf-8') as f:
                 lines = f.readlines()
+            lines = self._resolve_retractions(lines)
             
             processed_commands = set()
             
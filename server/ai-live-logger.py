@@ -1,19 +1,218 @@
 # ai-chat-live-logger.py — local sink with CORS + preflight for ChatGPT and Claude
 from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn, json
+import uvicorn, asyncio, json, logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
+from log_writer import LogWriter
+from tombstones import compact_lines, is_retraction, make_retraction, resolve_lines
+from noise_filter import match_noise_rule
+from logsetup import LOGGER_NAME, configure_logging
+from coalesce import StreamCoalescer
+from convo_index import ConvoIndex
+from dedup_index import DedupIndex, ts_epoch
+from near_dup import NearDupIndex, Sketch, normalize
+from idempotency import SeenIds, message_key
+from feed import Feed
+from recent_ring import RecentRing
+from metrics import Registry
+from storage import open_store
+from search_index import SearchIndex
+from records import Record, encode, parse
+from codec import Message, decode_batch, decode_message, loads
+from workers import WorkerPool
+import checkpoint
 
 ROOT   = Path(__file__).parent
 LOG    = ROOT / "chat.log"         # filtered conversation content
 VERBOSE_LOG = ROOT / "chatverbose.log"  # unfiltered everything
-RECENT = ROOT / "recent.ndjson"    # last 2 messages (ndjson)
+RECENT = ROOT / "recent.ndjson"    # optional file mirror of the last 2 messages (ndjson)
+DIAGNOSTIC_LOG = ROOT / "diagnostic.ndjson"
+ANALYTICS_LOG  = ROOT / "analytics.ndjson"
+CHECKPOINT     = ROOT / "state.ckpt"     # snapshot of in-memory state for fast restarts (None = off)
+SEEN_IDS       = ROOT / "seen-ids.bloom" # Bloom filter bits of the seen-id set, kept with CHECKPOINT
+STORAGE_BACKEND = "ndjson"               # long-term store of every chat.log record: "ndjson", "sqlite" or None
+HISTORY_DIR    = ROOT / "history"        # ...segment directory of the ndjson backend
+HISTORY_DB     = ROOT / "history.sqlite3"  # ...database file of the sqlite backend
+SEARCH_DIR     = ROOT / "search"         # full-text index behind GET /search (None = off)
+SEARCH_FLUSH_DOCS = 10_000   # messages buffered in memory before the index writes a segment
 MAX_LINES = 100
+SEGMENT_MAX_BYTES = 8 << 20  # history: roll the active segment over at this size...
+SEGMENT_MAX_AGE   = 86400    # ...or this many seconds after its first record
+SEGMENT_KEEP_SEALED = 2      # newest sealed segments left uncompressed
+SEGMENT_CODEC     = "gzip"   # "gzip", or "zstd" if the zstandard package is installed
 RECENT_N  = 2
+RECENT_CAPACITY = 200        # messages kept in memory for GET /recent
+RECENT_MIRROR_INTERVAL = 1.0 # seconds between lazy refreshes of recent.ndjson (None = no file)
+RECENT_WAIT_MAX = 60         # longest GET /recent long-poll, seconds
+DEDUP_WINDOW = 50      # chat.log entries the duplicate rules look back over
+DEDUP_TTL    = 3600    # ...and how many seconds they stay in the index
+NEAR_DUP_DISTANCE = 6  # SimHash bits (of 64) two texts may differ by and count as near-identical (None = off)
+NEAR_DUP_SIMILARITY = 0.95  # ...and the share of word bigrams they must have in common
+NEAR_DUP_WINDOW   = 10 # seconds a near-duplicate is blocked for (historical ones equal after normalize(): always)
+SEEN_IDS_CAPACITY = 200_000  # ids per Bloom generation (two are kept)
+SEEN_IDS_ERROR    = 1e-6     # false-positive rate for ids older than the exact set
+SEEN_IDS_RECENT   = 10_000   # most recent ids remembered exactly
+CHECKPOINT_INTERVAL = 30     # seconds between checkpoints
+WRITE_QUEUE_MAX = 10000     # records waiting for the writer thread before handlers wait
+FSYNC_MODE      = "interval"  # "none", "interval" or "always" (see LogWriter)
+FSYNC_INTERVAL  = 1.0
+COMPACT_AFTER   = 32        # retractions appended to chat.log before it is compacted
+HOLDBACK_SECONDS = 1.5      # quiet time before a streamed assistant reply goes to chat.log (0 = off)
+FEED_HISTORY    = 1000      # chat.log records kept for /feed resume
+FEED_QUEUE      = 256       # records a /feed subscriber may fall behind before it is dropped
+FEED_KEEPALIVE  = 15        # seconds between keep-alive comments on an idle /feed
+HOST, PORT      = "127.0.0.1", 8788
+WORKERS         = 1           # HTTP processes sharing PORT; more than 1 runs the multi-process mode of workers.py (Linux/macOS)
+LOG_LEVEL       = "WARNING"   # console: "INFO" for one line per message, "DEBUG" for every decision
+DEBUG_JSONL     = None        # e.g. ROOT / "server-debug.jsonl" for a structured diagnostic sink
+DEBUG_JSONL_LEVEL = "DEBUG"
 
-app = FastAPI()
+log = logging.getLogger(LOGGER_NAME)
+
+# Counters and histograms for GET /metrics; plain in-process bookkeeping
+metrics = Registry()
+request_seconds = metrics.histogram("ailogger_request_seconds", "Time to handle an ingest request", ("endpoint",))
+messages_total  = metrics.counter("ailogger_messages_total", "Messages by ingest outcome", ("status",))
+dedup_decisions = metrics.counter("ailogger_dedup_decisions_total",
+                                  "Messages blocked, marked or retracted by a duplicate rule", ("rule",))
+noise_hits      = metrics.counter("ailogger_noise_filter_hits_total", "Messages caught by a noise-filter rule", ("rule",))
+signal_noise    = metrics.counter("ailogger_signal_noise_total", "Messages the extension flagged as signal noise")
+
+# Every log file is owned by one writer thread; handlers only enqueue
+worker_pool = None   # WorkerPool in front of this process when WORKERS > 1
+
+writer = LogWriter(max_queue=WRITE_QUEUE_MAX, fsync_mode=FSYNC_MODE,
+                   fsync_interval=FSYNC_INTERVAL, compact_after=COMPACT_AFTER)
+convo_index = ConvoIndex()   # convo id -> offsets of its entries in chat.log
+
+# State saved by the last run (see save_checkpoint), or None to rebuild it
+_checkpoint_meta, _checkpoint = None, None
+if CHECKPOINT:
+    try:
+        _checkpoint_meta, _checkpoint = checkpoint.load(CHECKPOINT)
+        if _checkpoint_meta.get("backend") != STORAGE_BACKEND:
+            _checkpoint_meta, _checkpoint = None, None   # positions refer to another store
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.error("CHECKPOINT LOAD ERROR: %s", e)
+
+if STORAGE_BACKEND == "ndjson":
+    history = open_store("ndjson", HISTORY_DIR, max_bytes=SEGMENT_MAX_BYTES, max_age=SEGMENT_MAX_AGE,
+                         keep_sealed=SEGMENT_KEEP_SEALED, codec=SEGMENT_CODEC,
+                         index_state=json.loads(_checkpoint["history"]) if _checkpoint and "history" in _checkpoint
+                                     else None)
+elif STORAGE_BACKEND:
+    history = open_store(STORAGE_BACKEND, HISTORY_DB)
+else:
+    history = None
+search_index = SearchIndex(SEARCH_DIR, SEARCH_FLUSH_DOCS) if SEARCH_DIR else None
+if search_index and history:
+    search_index.catch_up(history)   # messages not yet written to a segment at the last exit
+writer.log(LOG, MAX_LINES, compact=compact_lines, indexer=convo_index, archive=[history, search_index])
+for _path, _max_lines in ((VERBOSE_LOG, MAX_LINES),
+                          (DIAGNOSTIC_LOG, 1000), (ANALYTICS_LOG, 2000)):
+    writer.log(_path, _max_lines)
+
+def _max_seq(lines) -> int:
+    seq = 0
+    for line in lines:
+        try:
+            seq = max(seq, int(loads(line).get("seq") or 0))
+        except Exception:
+            continue
+    return seq
+
+# Server-assigned sequence number; chat.log entries are referred to by it
+_last_seq = max(_max_seq(writer.log(LOG).lines()), _max_seq(writer.log(VERBOSE_LOG).lines()),
+                (_checkpoint_meta or {}).get("seq") or 0)
+
+def next_seq() -> int:
+    global _last_seq
+    _last_seq += 1
+    return _last_seq
+
+# Client message ids (with their text, see message_key) already taken in; a repeat is a retransmission
+# (the filter bits live in SEEN_IDS; the checkpoint only says how to read them)
+_seen_path = SEEN_IDS if CHECKPOINT else None
+try:
+    seen_ids = SeenIds(_seen_path, SEEN_IDS_CAPACITY, SEEN_IDS_ERROR, SEEN_IDS_RECENT,
+                       state=_checkpoint.get("seen_ids") if _checkpoint else None)
+except ValueError as e:
+    log.error("SEEN IDS RESTORE ERROR: %s", e)
+    seen_ids = SeenIds(_seen_path, SEEN_IDS_CAPACITY, SEEN_IDS_ERROR, SEEN_IDS_RECENT)
+# Cheap, and covers ids that arrived after the state was saved
+for _line in writer.log(VERBOSE_LOG).lines() + writer.log(LOG).lines():
+    try:
+        _record = loads(_line)
+    except Exception:
+        continue
+    if _record.get("id"):
+        _key = message_key(_record["id"], _record.get("content"))
+        if _key not in seen_ids:
+            seen_ids.add(_key)
+
+# Latest messages (everything that reaches chatverbose.log), served from memory
+recent_ring = RecentRing(RECENT_CAPACITY)
+_recent_seed = []
+for _line in writer.log(VERBOSE_LOG).lines()[-RECENT_CAPACITY:]:
+    try:
+        _recent_seed.append(loads(_line))
+    except Exception:
+        continue
+if history and len(_recent_seed) < RECENT_CAPACITY:
+    # chatverbose.log keeps fewer lines than the ring holds; older accepted
+    # messages come from the long-term store
+    _first_seq = min((r.get("seq") or 0 for r in _recent_seed), default=None)
+    _older = [r for r in history.tail(RECENT_CAPACITY)
+              if _first_seq is None or (r.get("seq") or 0) < _first_seq]
+    _recent_seed = _older[len(_older) - (RECENT_CAPACITY - len(_recent_seed)):] + _recent_seed
+recent_ring.seed(_recent_seed)
+_recent_mirrored = recent_ring.version
+
+async def mirror_recent():
+    """Bring recent.ndjson up to date if the ring changed since the last write"""
+    global _recent_mirrored
+    if recent_ring.version != _recent_mirrored:
+        _recent_mirrored = recent_ring.version
+        await asyncio.to_thread(recent_ring.write_mirror, RECENT, recent_ring.latest(RECENT_N))
+
+async def mirror_recent_periodically():
+    while True:
+        await asyncio.sleep(RECENT_MIRROR_INTERVAL)
+        try:
+            await mirror_recent()
+        except Exception as e:
+            log.error("RECENT MIRROR ERROR: %s", e)
+
+@asynccontextmanager
+async def lifespan(app):
+    log_listener = configure_logging(LOG_LEVEL, DEBUG_JSONL, DEBUG_JSONL_LEVEL)
+    writer.start()
+    if worker_pool:
+        await worker_pool.start()
+    tasks = []
+    if CHECKPOINT:
+        tasks.append(asyncio.create_task(save_checkpoint_periodically()))
+    if RECENT_MIRROR_INTERVAL:
+        tasks.append(asyncio.create_task(mirror_recent_periodically()))
+    yield
+    for task in tasks:
+        task.cancel()
+    if worker_pool:
+        await worker_pool.stop()   # every forwarded message has been through ingest() after this
+    await coalescer.flush_all()
+    writer.stop()  # drains whatever is still queued
+    if CHECKPOINT:
+        await save_checkpoint()
+    if RECENT_MIRROR_INTERVAL:
+        await mirror_recent()
+    log_listener.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow ChatGPT domains to call us from the browser
 app.add_middleware(
@@ -23,113 +222,149 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def append_rolling(path: Path, item: dict, max_lines: int):
-    lines = []
-    if path.exists():
-        lines = [ln for ln in path.read_text(encoding="utf-8").splitlines() if ln.strip()]
-    lines.append(json.dumps(item, ensure_ascii=False))
-    if len(lines) > max_lines:
-        lines = lines[-max_lines:]
-    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+async def append_rolling(path: Path, item: dict):
+    """Queue item for the writer thread; returns once it is enqueued"""
+    await writer.append(path, item)
+
+# Everything that reaches chat.log is also published to /feed subscribers
+feed = Feed(FEED_HISTORY, FEED_QUEUE)
+
+# Read from the components at scrape time, so ingest pays nothing for them
+metrics.collected("ailogger_bytes_written_total", "Bytes appended per log file",
+                  writer.bytes_written, ("file",), kind="counter")
+metrics.collected("ailogger_queue_depth", "Records waiting in each queue",
+                  lambda: {"writer": writer.depth(), "holdback": coalescer.depth(),
+                           "feed_max": feed.stats()["max_queue_depth"]}, ("queue",))
+
+async def retract(entry, reason: str, sink=writer):
+    """Take a chat.log entry back: append a tombstone and forget it for dedup"""
+    dedup_index.remove(entry)
+    if entry.held:
+        coalescer.drop(entry)   # still in the hold-back: nothing to take back out of chat.log
+        return
+    if entry.seq is None:
+        # Entry written before seq numbers existed: fall back to a rewrite
+        def is_entry(log_line, ts=entry.ts, content=entry.content):
+            try:
+                log_item = parse(log_line)
+                return log_item["ts"] == ts and log_item["content"] == content
+            except:
+                return False  # Keep malformed lines
+        await sink.call(LOG, "remove", is_entry)
+        return
+    ts = datetime.now().isoformat(timespec="seconds")
+    tombstone = make_retraction(next_seq(), entry.seq, reason, ts)
+    await sink.retract(LOG, tombstone)
+    feed.publish(tombstone)
+
+# Resident view of the chat.log tail shared by every duplicate rule
+def new_dedup_index() -> DedupIndex:
+    near = (NearDupIndex(NEAR_DUP_DISTANCE, min_similarity=NEAR_DUP_SIMILARITY)
+            if NEAR_DUP_DISTANCE is not None else None)
+    return DedupIndex(ttl=DEDUP_TTL, max_entries=DEDUP_WINDOW, near=near)
+
+dedup_index = new_dedup_index()
+
+def replay_since_checkpoint(position: str) -> int:
+    """Apply what reached the history store after the checkpoint was taken"""
+    global _last_seq
+    # Messages committed but not yet written when the checkpoint was taken
+    # are in both the snapshot and the replay
+    known = {entry.seq for entry in dedup_index.tail(len(dedup_index))}
+    replayed = 0
+    for record in history.records_after(position):
+        _last_seq = max(_last_seq, record.get("seq") or 0)
+        replayed += 1
+        if is_retraction(record):
+            dedup_index.remove_seq(record.get("retracts"))
+        elif record.get("seq") not in known:
+            dedup_index.seed([record])
+            if record.get("id"):
+                key = message_key(record["id"], record.get("content"))
+                if key not in seen_ids:
+                    seen_ids.add(key)
+    return replayed
+
+_restored = False
+if _checkpoint:
+    try:
+        dedup_index.restore(json.loads(_checkpoint["dedup"]))
+        if history and _checkpoint_meta.get("position") is not None:
+            replay_since_checkpoint(_checkpoint_meta["position"])
+        _restored = True
+    except Exception as e:
+        log.error("CHECKPOINT RESTORE ERROR: %s", e)
+        dedup_index = new_dedup_index()
+if not _restored:
+    dedup_index.seed((history.tail(DEDUP_WINDOW) if history else None) or
+                     resolve_lines(writer.log(LOG).lines()))
+_checkpoint = None   # the sections can be large; nothing else reads them
+
+async def save_checkpoint():
+    """Snapshot seq, seen ids, the dedup window and the history indexes to CHECKPOINT.
+
+    Taken on the event loop, so the parts agree with each other; the
+    history position is where the next start replays from.
+    """
+    meta = {"seq": _last_seq, "backend": STORAGE_BACKEND,
+            "position": history.position() if history else None}
+    # seen_ids' filters are flushed to their own file first; the section is their header.
+    # Message text may hold lone surrogates; json.loads() reads surrogatepass back
+    sections = {"seen_ids": seen_ids.snapshot(),
+                "dedup": json.dumps(dedup_index.snapshot(), ensure_ascii=False).encode("utf-8", "surrogatepass")}
+    state = history.index_state() if history else None
+    if state is not None:
+        sections["history"] = json.dumps(state).encode("utf-8")
+    await asyncio.to_thread(seen_ids.flush)
+    await asyncio.to_thread(checkpoint.save, CHECKPOINT, meta, sections)
+
+async def save_checkpoint_periodically():
+    last = None
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        if (_last_seq, seen_ids.dirty) == (last, False):
+            continue
+        last = _last_seq
+        try:
+            await save_checkpoint()
+        except Exception as e:
+            log.error("CHECKPOINT SAVE ERROR: %s", e)
+
+async def commit_to_log(item: dict, sink=writer, sketch: Sketch = None):
+    """Write an accepted message to chat.log and make it visible to dedup"""
+    await sink.append(LOG, item)
+    dedup_index.add(item, sketch=sketch)
+    feed.publish(item)
+
+async def commit_held(item: Record, entry, sink=writer):
+    """Write a streamed reply from the hold-back to chat.log.
+
+    Its seq is taken now, so chat.log stays in seq order with the messages
+    written while it was held; the chatverbose.log record keeps the seq it
+    was received with. The dedup entry added when it was held gets the new one.
+    """
+    item = Record(item, raw=dict(item.raw))
+    item["seq"] = entry.seq = next_seq()
+    entry.held = False
+    await sink.append(LOG, item)
+    feed.publish(item)
+
+def forget_held(item: Record, entry):
+    """A held snapshot replaced by a longer one"""
+    dedup_index.remove(entry)
+
+# Streaming assistant snapshots wait here until they stop growing
+coalescer = StreamCoalescer(HOLDBACK_SECONDS, commit_held, forget_held)
 
 def is_noise_content(content: str, platform: str, urls: list = None) -> bool:
     """Filter out UI noise, navigation elements, CSS, and other non-conversational content"""
-    content_lower = content.lower().strip()
-    urls = urls or []
-    
-    try:
-        print(f"FILTER DEBUG: checking content='{content[:50]}...' len={len(content)}")
-    except UnicodeEncodeError:
-        print(f"FILTER DEBUG: checking content=[Unicode content] len={len(content)}")
-    
-    # Empty or very short content
-    if len(content) < 3:
-        return True
-    
-    # CSS/Styling content
-    if any(css_pattern in content for css_pattern in [
-        "@keyframes", "position: fixed", "z-index:", "rgba(", "transform:", 
-        "animation:", "box-shadow:", "border-radius:", "opacity:", "background:",
-        ".intercom-", "px;", "rem;", "vh;", "vw;", "%;"
-    ]):
-        return True
-    
-    # Claude greeting patterns - but allow Sonnet 4 greetings (check metadata)
-    greeting_patterns = [
-        "hi, i'm claude", "hello, i'm claude", "i'm claude", "how can i help you today",
-        "what can i help you with today", "how may i assist you today", "hi there! how can i help"
-    ]
-
-    if any(greeting_pattern in content_lower for greeting_pattern in greeting_patterns):
-        # Check if this is from Sonnet 4 - if so, allow it
-        if hasattr(urls, '__iter__') and any('sonnet' in str(url).lower() for url in urls):
-            print(f"FILTER DEBUG: allowing Sonnet 4 greeting: {content[:50]}...")
-            return False
-
-        print(f"FILTER DEBUG: blocking Claude greeting: {content[:50]}...")
-        return True
-
-    # Common UI navigation elements - be more specific to avoid false positives
-    ui_noise_exact = [
-        "all chats", "new chat", "retry", "share", "delete",
-        "claude can make mistakes", "please double-check responses",
-        "pending context request", "artifacts", "projects", "claude code",
-        "starred", "chats projects artifacts", "recents",
-        # Claude UI specific elements
-        "test message confirmation share", "test message confirmation",
-        "retry", "share", "confirmation", "message confirmation"
-    ]
-    
-    # UI patterns that can appear anywhere in content
-    ui_noise_patterns = [
-        "chats projects artifacts", "claude can make mistakes",
-        # Button and UI element patterns
-        "retry", "confirmation share", "message confirmation"
-    ]
-    
-    if content_lower in ui_noise_exact or any(pattern in content_lower for pattern in ui_noise_patterns):
-        return True
-    
-    # Chat title patterns with URLs (these are likely chat sidebar titles)
-    has_chat_url = any("claude.ai/chat/" in url for url in urls)
-    if has_chat_url and len(content.split()) <= 6:
-        return True
-    
-    # Fragment patterns (single words that are clearly UI fragments)
-    # But exclude valid short responses like "okay27"
-    single_word_ui = ["research", "sonnet", "writing", "method", "analysis", "review", "request"]
-    if (len(content.split()) == 1 and content_lower in single_word_ui):
-        return True
-        
-    # Allow valid short responses that match okay pattern
-    import re
-    if re.match(r'^okay\d+$', content_lower):
-        print(f"FILTER DEBUG: allowing okay response: {content}")
-        return False
-    
-    # Specific chat title patterns that repeat as noise
-    chat_title_patterns = ["research sonnet 4", "j james", "j test"]
-    if any(pattern in content_lower for pattern in chat_title_patterns):
-        return True
-    
-    # Claude UI specific patterns (button text combinations)
-    claude_ui_patterns = [
-        r".*\s+retry$",        # anything ending with " Retry" (with space)
-        r".*\s+share$",        # anything ending with " Share" (with space)  
-        r"test\s+message\s+confirmation.*"  # test message confirmation variations
-    ]
-    
-    import re
-    for pattern in claude_ui_patterns:
-        if re.match(pattern, content_lower):
-            return True
-    
-    # Allow testmessage and okay responses - these are valid test content
-    if content_lower.startswith('testmessage') or re.match(r'^okay\d+$', content_lower):
-        print(f"FILTER DEBUG: allowing test content: {content}")
-        return False  # Don't filter test messages
-    
-    return False
+    log.debug("FILTER DEBUG: checking content='%s...' len=%s", content[:50], len(content))
+
+    rule = match_noise_rule(content, platform, urls)
+    if rule:
+        noise_hits.inc(rule=rule)
+        log.debug("FILTER DEBUG: blocked by rule '%s'", rule)
+    return rule is not None
 
 @app.options("/log")
 async def preflight():
@@ -137,6 +372,7 @@ async def preflight():
     return Response(status_code=204)
 
 @app.get("/log")
+@request_seconds.time(endpoint="GET /log")
 async def log_via_get(request: Request):
     """Handle GET requests for CORS bypass via Image or JSONP"""
     params = dict(request.query_params)
@@ -144,7 +380,10 @@ async def log_via_get(request: Request):
     # Extract data from query parameters
     item = {
         "ts": datetime.now().isoformat(timespec="seconds"),
+        "seq": next_seq(),
+        "id": params.get("id"),
         "platform": params.get("platform", "claude"),
+        "convo": params.get("convo"),
         "role": params.get("role", "user"),
         "content": params.get("text", ""),
         "urls": [],
@@ -155,14 +394,22 @@ async def log_via_get(request: Request):
         }
     }
     
-    # Process the message same as POST
-    if item["content"]:
-        print(f"CORS BYPASS: {item['platform']}-{item['role']} via {item['metadata']['method']}: '{item['content'][:30]}...'")
-        
-        # Apply same filtering logic as POST /log
-        append_rolling(VERBOSE_LOG, item, MAX_LINES)
-        append_rolling(RECENT, item, RECENT_N)
-        append_rolling(LOG, item, MAX_LINES)  # For now, log everything from CORS bypass
+    # The id is recorded once the message is written, so a failed request can be retried
+    key = message_key(item["id"], item["content"]) if item["id"] else None
+    if key is not None and key in seen_ids:
+        log.debug("RETRANSMISSION BLOCKED: id %s already received", item["id"])
+        dedup_decisions.inc(rule="retransmission")
+    else:
+        # Process the message same as POST
+        if item["content"]:
+            log.debug("CORS BYPASS: %s-%s via %s: '%s...'", item['platform'], item['role'], item['metadata']['method'], item['content'][:30])
+
+            # Apply same filtering logic as POST /log
+            await append_rolling(VERBOSE_LOG, item)
+            recent_ring.push(item)
+            await commit_to_log(item)  # For now, log everything from CORS bypass
+        if key is not None:
+            seen_ids.add(key)
     
     # Handle JSONP callback
     callback = params.get("callback")
@@ -173,340 +420,395 @@ async def log_via_get(request: Request):
         # Regular response for image bypass
         return PlainTextResponse("ok")
 
-@app.post("/log")
-async def log_msg(req: Request):
-    data = await req.json()
-    item = {
+# Statuses reported by ingest() (and per item by POST /log/batch)
+ACCEPTED, DUPLICATE, FILTERED = "accepted", "duplicate", "filtered"
+
+# message key -> set once the ingest() running for that message has finished
+_ingesting = {}
+
+async def ingest(message: Message, sink=writer, keys: set = None) -> str:
+    """Run one decoded message (see codec.Message) through dedup and filtering and queue its writes.
+
+    Shared by POST /log and POST /log/batch. Writes go to `sink`: the writer
+    itself, or a LogBatch that commits a whole request at once. Any raw
+    member text the decoder kept (message.raw) is written exactly as the
+    client sent it, never re-encoded. Returns ACCEPTED (the message is in
+    chat.log or held for it), DUPLICATE or FILTERED (only in
+    chatverbose.log, if at all).
+
+    A client id taken in before with the same text is a retransmission
+    (DUPLICATE). The id is recorded in seen_ids only once the message has a
+    verdict, so the retry of a message whose ingest raised is taken in again;
+    with `keys` it is added there instead, for the batch to record once
+    its writes are committed.
+    """
+    key = message_key(message.id, message.text) if message.id else None
+    if key is None:
+        return await judge(message, sink)
+    while key in _ingesting:
+        await _ingesting[key].wait()   # the same message, in another request
+    if key in seen_ids or (keys and key in keys):
+        log.debug("RETRANSMISSION BLOCKED: %s-%s id %s already received", message.platform, message.role, message.id)
+        dedup_decisions.inc(rule="retransmission")
+        return DUPLICATE
+    done = _ingesting[key] = asyncio.Event()
+    try:
+        status = await judge(message, sink)
+    finally:
+        del _ingesting[key]
+        done.set()
+    if keys is None:
+        seen_ids.add(key)
+    else:
+        keys.add(key)
+    return status
+
+async def judge(message: Message, sink=writer) -> str:
+    """ingest() for a message that is not a retransmission"""
+    item = Record({
         "ts": datetime.now().isoformat(timespec="seconds"),
-        "platform": data.get("platform", "unknown"),
-        "role": data.get("role", "assistant"),
-        "content": data.get("text", ""),
-        "urls": data.get("urls", []),
-        "metadata": data.get("metadata", {}),
-    }
-    
-    # Check for recent duplicates (within last 5 seconds)
-    if LOG.exists():
-        recent_lines = []
-        try:
-            lines = LOG.read_text(encoding="utf-8").splitlines()
-            # Check last 50 entries for duplicates (increased from 5 to catch longer-term repeats)
-            for line in lines[-50:]:
-                if line.strip():
-                    recent_item = json.loads(line)
-                    recent_lines.append(recent_item)
-        except:
-            pass
-        
-        # Check if this is a duplicate of recent content with stricter rules
-        current_time = datetime.fromisoformat(item["ts"])
-        for recent in recent_lines:
-            try:
-                recent_time = datetime.fromisoformat(recent["ts"])
-                time_diff = (current_time - recent_time).total_seconds()
-                
-                # Much stricter duplicate detection for assistant messages
-                duplicate_window = 2 if item["role"] == "assistant" else 5  # 2 seconds for assistant, 5 for user
-                
-                # If same content within time window, skip
-                if (time_diff <= duplicate_window and 
-                    recent["role"] == item["role"] and 
-                    recent["content"] == item["content"] and
-                    recent.get("platform") == item.get("platform")):
-                    print(f"DUPLICATE BLOCKED: {item['platform']}-{item['role']} '{item['content'][:30]}...' (same as {time_diff:.1f}s ago)")
-                    return PlainTextResponse("ok")
-                    
-                # Additional check: block identical assistant responses within 30 seconds
-                if (item["role"] == "assistant" and 
-                    recent["role"] == "assistant" and
-                    recent["content"] == item["content"] and
-                    time_diff <= 30):
-                    print(f"DUPLICATE ASSISTANT BLOCKED: '{item['content'][:30]}...' (repeat within {time_diff:.1f}s)")
-                    return PlainTextResponse("ok")
-                    
-            except:
-                continue
-        
-        # J-PREFIX DEDUPLICATION: Block messages with J-prefix if we expect a clean version
-        # This fixes the dual-logger issue where we get "Jtestmessage110" followed by "testmessage110"
-        if (item["content"].startswith('J') and 
-            item["role"] == "user" and
-            len(item["content"]) > 10):  # Only check longer messages to avoid blocking single "J"
-            
-            # Check if this looks like a J-prefixed duplicate (starts with J + testmessage pattern)
-            clean_content = item["content"][1:]  # Remove the J
-            if "testmessage" in clean_content or "respond" in clean_content:
-                print(f"J-PREFIX BLOCKED: Blocking J-prefixed message '{item['content'][:30]}...' - expecting clean version")
-                return PlainTextResponse("ok")
-        
-        # CLEAN VERSION DEDUPLICATION: If clean version comes after J-prefix, remove the J-prefixed entry
-        if recent_lines and item["role"] == "user":
-            last_recent = recent_lines[-1]
-            try:
-                # Check if last message is same role, platform, and content with J prefix
-                if (last_recent["role"] == item["role"] and 
-                    last_recent.get("platform") == item.get("platform") and
-                    last_recent["content"].startswith('J') and
-                    last_recent["content"][1:] == item["content"]):
-                    
-                    print(f"CLEAN VERSION RECEIVED: Replacing J-prefixed '{last_recent['content'][:30]}...' with clean '{item['content'][:30]}...'")
-                    
-                    # Remove the J-prefixed entry from the end of the log file
-                    if LOG.exists():
-                        try:
-                            lines = LOG.read_text(encoding="utf-8").splitlines()
-                            if lines:
-                                # Remove last line (the J-prefixed duplicate)
-                                lines = lines[:-1]
-                                LOG.write_text('\n'.join(lines) + '\n' if lines else '', encoding="utf-8")
-                                print(f"REMOVED J-PREFIX ENTRY: '{last_recent['content'][:30]}...'")
-                        except Exception as e:
-                            print(f"ERROR removing J-prefix duplicate: {e}")
-                            
-            except Exception as e:
-                print(f"ERROR in clean version deduplication: {e}")
-        
-        # ENHANCED: Check for long-term duplicates in entire recent history (stronger duplicate detection)
-        # This catches historical retransmissions while allowing legitimate repeats
-        duplicate_content_map = {}
-        for recent in recent_lines:
-            try:
-                # Build map of ALL message content (both user and assistant) for duplicate detection
-                if recent.get("platform") == item.get("platform"):
-                    content = recent["content"]
-                    role = recent["role"]
-                    key = f"{role}:{content}"  # Include role to separate user/assistant namespaces
-                    if key not in duplicate_content_map:
-                        duplicate_content_map[key] = recent
-            except Exception as e:
-                print(f"ENHANCED DEBUG: Error processing recent item: {e}")
-                continue
-        
-        print(f"ENHANCED DEBUG: Checking {len(recent_lines)} recent entries for duplicates of '{item.get('content', '')[:30]}...'")
-        print(f"ENHANCED DEBUG: Found {len(duplicate_content_map)} unique messages in history")
+        "seq": None,    # assigned once the message is accepted, so seqs follow log order
+        "id": message.id,
+        "platform": message.platform,
+        "convo": message.convo,
+        "role": message.role,
+        "content": message.text,
+        "urls": message.urls,
+        "metadata": message.metadata,
+    }, raw=message.raw)
+
+    # All duplicate rules below read the resident index of recent chat.log
+    # entries instead of re-reading and re-parsing the file
+    current_time = ts_epoch(item["ts"])
+    dedup_index.expire(current_time)
+    platform = item.get("platform", "unknown")
+    content = item.get("content", "")
+
+    # Check for recent duplicates (2 seconds for assistant, 5 for user)
+    duplicate_window = 2 if item["role"] == "assistant" else 5
+    same_content = dedup_index.find(item["role"], content, platform)
+    if same_content:
+        time_diff = current_time - same_content[-1].epoch
+        if time_diff <= duplicate_window:
+            log.debug("DUPLICATE BLOCKED: %s-%s '%s...' (same as %.1fs ago)", item['platform'], item['role'], item['content'][:30], time_diff)
+            dedup_decisions.inc(rule="duplicate")
+            return DUPLICATE
+
+    # Additional check: block identical assistant responses within 30 seconds (any platform)
+    if item["role"] == "assistant":
+        for recent in dedup_index.find("assistant", content):
+            time_diff = current_time - recent.epoch
+            if time_diff <= 30:
+                log.debug("DUPLICATE ASSISTANT BLOCKED: '%s...' (repeat within %.1fs)", item['content'][:30], time_diff)
+                dedup_decisions.inc(rule="duplicate_assistant")
+                return DUPLICATE
+
+    # NEAR-DUPLICATE: same text up to case, whitespace, trailing button labels
+    # ("Retry", "Share") or a few changed words, found through the SimHash
+    # index instead of comparing against every recent entry. A snapshot that
+    # extends an earlier one is streaming growth, left to the prefix filter.
+    # Past NEAR_DUP_WINDOW only a historical re-scrape of the same normalized
+    # text is blocked; an edited message sent again later is new.
+    # The sketch (normalized text and SimHash) is made once per message, by
+    # the ingest worker if one forwarded it, and serves both this lookup and
+    # indexing the message once it is accepted
+    is_historical = message.signal.is_historical
+    sketch = message.sketch
+    if sketch is None and dedup_index.near:
+        sketch = Sketch(content)
+    for near in dedup_index.find_near(item["role"], content, platform, sketch):
+        if near.content == content:
+            continue  # exact repeats are judged by the rules around this one
+        time_diff = current_time - near.epoch
+        normalized, near_normalized = sketch.text, normalize(near.content)
+        is_growth = len(normalized) > len(near_normalized) and normalized.startswith(near_normalized)
+        if (time_diff <= NEAR_DUP_WINDOW or (is_historical and normalized == near_normalized)) and not is_growth:
+            log.debug("NEAR DUPLICATE BLOCKED: %s-%s '%s...' (near-identical to '%s...' from %.1fs ago)", platform, item['role'], content[:30], near.content[:30], time_diff)
+            dedup_decisions.inc(rule="near_duplicate")
+            return DUPLICATE
+
+    # J-PREFIX DEDUPLICATION: Block messages with J-prefix if we expect a clean version
+    # This fixes the dual-logger issue where we get "Jtestmessage110" followed by "testmessage110"
+    if (item["content"].startswith('J') and 
+        item["role"] == "user" and
+        len(item["content"]) > 10):  # Only check longer messages to avoid blocking single "J"
         
-        # Check if we've seen this exact content from this role before
-        current_key = f"{item['role']}:{item['content']}"
-        if (current_key in duplicate_content_map and
-            duplicate_content_map[current_key]["ts"] != item["ts"]):
-            
-            first_occurrence = duplicate_content_map[current_key]
-            first_occurrence_time = datetime.fromisoformat(first_occurrence["ts"])
-            current_time = datetime.fromisoformat(item["ts"])
-            time_since_first = (current_time - first_occurrence_time).total_seconds()
-            
-            # Check if this message is marked as historical
-            is_historical = item.get("metadata", {}).get("signalProcessing", {}).get("isHistorical", False)
-            first_was_historical = first_occurrence.get("metadata", {}).get("signalProcessing", {}).get("isHistorical", False)
+        # Check if this looks like a J-prefixed duplicate (starts with J + testmessage pattern)
+        clean_content = item["content"][1:]  # Remove the J
+        if "testmessage" in clean_content or "respond" in clean_content:
+            log.debug("J-PREFIX BLOCKED: Blocking J-prefixed message '%s...' - expecting clean version", item['content'][:30])
+            dedup_decisions.inc(rule="j_prefix")
+            return DUPLICATE
+    
+    # CLEAN VERSION DEDUPLICATION: If clean version comes after J-prefix, remove the J-prefixed entry
+    last_recent = dedup_index.last()
+    if last_recent and item["role"] == "user":
+        # Check if last message is same role, platform, and content with J prefix
+        if (last_recent.role == item["role"] and 
+            last_recent.platform == platform and
+            last_recent.content.startswith('J') and
+            last_recent.content[1:] == content):
             
-            # ENHANCED LOGIC: Handle historical vs non-historical duplicates differently
-            if is_historical:
-                # Historical messages are always blocked if duplicated
-                print(f"ENHANCED DUPLICATE BLOCKED: '{item['content'][:30]}...' (historical retransmission, first seen at {first_occurrence['ts']}, {time_since_first:.1f}s ago)")
-                return PlainTextResponse("ok")
-            elif not is_historical and time_since_first < 10:
-                # Non-historical duplicates within 10 seconds are blocked (too fast to be legitimate)
-                print(f"ENHANCED DUPLICATE BLOCKED: '{item['content'][:30]}...' (duplicate within {time_since_first:.1f}s, too fast to be legitimate)")
-                return PlainTextResponse("ok")
-            elif not is_historical and time_since_first >= 10:
-                # Non-historical duplicates after 10+ seconds are legitimate repeats (allow)
-                print(f"LEGITIMATE REPEAT ALLOWED: '{item['content'][:30]}...' (non-historical repeat after {time_since_first:.1f}s)")
-            else:
-                # For assistant messages, check for conversational echoes
-                if item["role"] == "assistant":
-                    # Check if this might be a legitimate assistant echo of a recent user message
-                    is_legitimate_echo = False
-                    for recent in recent_lines[-10:]:  # Check last 10 messages for user echo
-                        try:
-                            if (recent["role"] == "user" and 
-                                recent.get("platform") == item.get("platform")):
-                                recent_time = datetime.fromisoformat(recent["ts"])
-                                time_since_user = (current_time - recent_time).total_seconds()
-                                
-                                # If user said something similar within last 30 seconds, this might be an echo
-                                if (time_since_user <= 30 and 
-                                    (recent["content"] == item["content"] or 
-                                     recent["content"].lower() in item["content"].lower())):
-                                    is_legitimate_echo = True
-                                    print(f"ECHO ALLOWED: Assistant echoing recent user message '{item['content'][:30]}...' from {time_since_user:.1f}s ago")
-                                    break
-                        except:
-                            continue
-                    
-                    # Block non-historical assistant duplicates that aren't legitimate echoes and are old
-                    if not is_legitimate_echo and time_since_first > 60:
-                        print(f"ENHANCED DUPLICATE BLOCKED: '{item['content'][:30]}...' (first seen at {first_occurrence['ts']}, {time_since_first:.1f}s ago, not an echo)")
-                        return PlainTextResponse("ok")
-                    elif not is_legitimate_echo:
-                        print(f"RECENT REPEAT ALLOWED: '{item['content'][:30]}...' (first seen {time_since_first:.1f}s ago)")
+            log.debug("CLEAN VERSION RECEIVED: Replacing J-prefixed '%s...' with clean '%s...'", last_recent.content[:30], content[:30])
+            dedup_decisions.inc(rule="clean_version")
             
-        # Also allow legitimate assistant echo pattern within 30 seconds of user message with similar content
-        elif item["role"] == "assistant":
-            for recent in recent_lines[-5:]:  # Check last 5 messages for immediate echo pattern
-                try:
-                    if (recent["role"] == "user" and 
-                        recent.get("platform") == item.get("platform")):
-                        recent_time = datetime.fromisoformat(recent["ts"])
-                        current_time = datetime.fromisoformat(item["ts"])
-                        time_since_user = (current_time - recent_time).total_seconds()
+            # Retract the J-prefixed entry (tombstone appended to chat.log)
+            await retract(last_recent, "j_prefix", sink)
+            log.debug("REMOVED J-PREFIX ENTRY: '%s...'", last_recent.content[:30])
+    
+    # ENHANCED: Check for long-term duplicates in entire recent history (stronger duplicate detection)
+    # This catches historical retransmissions while allowing legitimate repeats
+    log.debug("ENHANCED DEBUG: Checking %s recent entries for duplicates of '%s...'", len(dedup_index), content[:30])
+    
+    # Check if we've seen this exact content from this role before
+    first_occurrence = same_content[0] if same_content else None
+    if first_occurrence and first_occurrence.ts != item["ts"]:
+        time_since_first = current_time - first_occurrence.epoch
+        
+        # ENHANCED LOGIC: Handle historical vs non-historical duplicates differently
+        if is_historical:
+            # Historical messages are always blocked if duplicated
+            log.debug("ENHANCED DUPLICATE BLOCKED: '%s...' (historical retransmission, first seen at %s, %.1fs ago)", item['content'][:30], first_occurrence.ts, time_since_first)
+            dedup_decisions.inc(rule="enhanced_duplicate")
+            return DUPLICATE
+        elif not is_historical and time_since_first < 10:
+            # Non-historical duplicates within 10 seconds are blocked (too fast to be legitimate)
+            log.debug("ENHANCED DUPLICATE BLOCKED: '%s...' (duplicate within %.1fs, too fast to be legitimate)", item['content'][:30], time_since_first)
+            dedup_decisions.inc(rule="enhanced_duplicate")
+            return DUPLICATE
+        elif not is_historical and time_since_first >= 10:
+            # Non-historical duplicates after 10+ seconds are legitimate repeats (allow)
+            log.debug("LEGITIMATE REPEAT ALLOWED: '%s...' (non-historical repeat after %.1fs)", item['content'][:30], time_since_first)
+        else:
+            # For assistant messages, check for conversational echoes
+            if item["role"] == "assistant":
+                # Check if this might be a legitimate assistant echo of a recent user message
+                is_legitimate_echo = False
+                folded = content.casefold()  # once; user entries are folded at ingest
+                for recent in dedup_index.tail(10):  # Check last 10 messages for user echo
+                    if recent.role == "user" and recent.platform == platform:
+                        time_since_user = current_time - recent.epoch
                         
-                        # Check if this is an exact user input echo (Claude UI pattern)
-                        if (time_since_user <= 10 and 
-                            recent["content"].strip() == item["content"].strip()):
-                            print(f"USER INPUT ECHO DETECTED: Assistant exactly echoing user input '{item['content'][:30]}...' from {time_since_user:.1f}s ago - MARKING AS NOISE")
-                            # Mark as signal noise to filter from chat.log
-                            item["metadata"]["isSignalNoise"] = True
-                            item["metadata"]["signalProcessingFilter"] = ["user_input_echo"]
-                            break
-                        # If user said something similar (but not exact) within last 30 seconds, allow as conversational echo
-                        elif (time_since_user <= 30 and 
-                            recent["content"].lower() in item["content"].lower()):
-                            print(f"CONVERSATIONAL ECHO ALLOWED: Assistant echoing user '{item['content'][:30]}...' from {time_since_user:.1f}s ago")
+                        # If user said something similar within last 30 seconds, this might be an echo
+                        if (time_since_user <= 30 and 
+                            (recent.content == content or 
+                             recent.folded in folded)):
+                            is_legitimate_echo = True
+                            log.debug("ECHO ALLOWED: Assistant echoing recent user message '%s...' from %.1fs ago", item['content'][:30], time_since_user)
                             break
-                except:
-                    continue
+                
+                # Block non-historical assistant duplicates that aren't legitimate echoes and are old
+                if not is_legitimate_echo and time_since_first > 60:
+                    log.debug("ENHANCED DUPLICATE BLOCKED: '%s...' (first seen at %s, %.1fs ago, not an echo)", item['content'][:30], first_occurrence.ts, time_since_first)
+                    dedup_decisions.inc(rule="enhanced_duplicate")
+                    return DUPLICATE
+                elif not is_legitimate_echo:
+                    log.debug("RECENT REPEAT ALLOWED: '%s...' (first seen %.1fs ago)", item['content'][:30], time_since_first)
+        
+    # Also allow legitimate assistant echo pattern within 30 seconds of user message with similar content
+    elif item["role"] == "assistant":
+        folded = content.casefold()  # once; user entries are folded at ingest
+        for recent in dedup_index.tail(5):  # Check last 5 messages for immediate echo pattern
+            if recent.role == "user" and recent.platform == platform:
+                time_since_user = current_time - recent.epoch
+                
+                # Check if this is an exact user input echo (Claude UI pattern)
+                if (time_since_user <= 10 and 
+                    recent.content.strip() == content.strip()):
+                    log.debug("USER INPUT ECHO DETECTED: Assistant exactly echoing user input '%s...' from %.1fs ago - MARKING AS NOISE", item['content'][:30], time_since_user)
+                    dedup_decisions.inc(rule="user_input_echo")
+                    # Mark as signal noise to filter from chat.log
+                    message.is_signal_noise, message.signal_filters = True, ["user_input_echo"]
+                    item["metadata"] = dict(item["metadata"], isSignalNoise=True,
+                                            signalProcessingFilter=message.signal_filters)
+                    break
+                # If user said something similar (but not exact) within last 30 seconds, allow as conversational echo
+                elif (time_since_user <= 30 and 
+                    recent.folded in folded):
+                    log.debug("CONVERSATIONAL ECHO ALLOWED: Assistant echoing user '%s...' from %.1fs ago", item['content'][:30], time_since_user)
+                    break
     
     # Check for streaming prefix captures that should be removed
-    platform = item.get("platform", "unknown")
-    content = item.get("content", "")
-    urls = item.get("urls", [])
-    metadata = item.get("metadata", {})
+    urls = message.urls
 
     # Prefix filtering: remove premature captures within 5-second window
-    if item["role"] == "assistant" and LOG.exists():
+    if item["role"] == "assistant":
         try:
-            lines = LOG.read_text(encoding="utf-8").splitlines()
-            current_time = datetime.fromisoformat(item["ts"])
-
             # Look for recent assistant messages from same platform/conversation that might be prefixes
-            for line in lines[-20:]:  # Check last 20 entries
-                if line.strip():
-                    recent_item = json.loads(line)
-                    if (recent_item["role"] == "assistant" and
-                        recent_item.get("platform") == platform):
-
-                        recent_time = datetime.fromisoformat(recent_item["ts"])
-                        time_diff = (current_time - recent_time).total_seconds()
-
-                        # Check within 5-second window for prefix relationships
-                        if 0 < time_diff <= 5:
-                            recent_content = recent_item["content"]
-
-                            # If current content is longer and recent is a prefix, remove the recent one
-                            if (len(content) > len(recent_content) and
-                                content.startswith(recent_content) and
-                                len(recent_content) >= 3):  # Don't remove very short content
-
-                                print(f"PREFIX FILTER: Removing premature capture '{recent_content}' (prefix of '{content}')")
-
-                                # Remove the prefix entry from the log file
-                                updated_lines = []
-                                for log_line in lines:
-                                    if log_line.strip():
-                                        try:
-                                            log_item = json.loads(log_line)
-                                            # Skip the line that matches the prefix we want to remove
-                                            if not (log_item["ts"] == recent_item["ts"] and
-                                                   log_item["content"] == recent_content):
-                                                updated_lines.append(log_line)
-                                        except:
-                                            updated_lines.append(log_line)  # Keep malformed lines
-
-                                # Write back the filtered log
-                                if updated_lines:
-                                    LOG.write_text("\n".join(updated_lines) + "\n", encoding="utf-8")
-                                else:
-                                    LOG.write_text("", encoding="utf-8")
-
-                                break  # Only remove one prefix per new message
-        except Exception as e:
-            print(f"PREFIX FILTER ERROR: {e}")
+            for recent in dedup_index.tail(20):  # Check last 20 entries
+                if recent.role == "assistant" and recent.platform == platform:
+                    time_diff = current_time - recent.epoch
 
-    # Check for Claude name-prefixed user input echoes (e.g. "Jtestmessage" echoing "testmessage")
-    if item["role"] == "assistant" and platform == "claude" and LOG.exists():
-        try:
-            lines = LOG.read_text(encoding="utf-8").splitlines()
-            current_time = datetime.fromisoformat(item["ts"])
+                    # Check within 5-second window for prefix relationships
+                    if 0 < time_diff <= 5:
+                        recent_content = recent.content
 
-            # Look for recent user messages that this might be echoing
-            for line in lines[-10:]:  # Check last 10 entries
-                if line.strip():
-                    recent_item = json.loads(line)
-                    if (recent_item["role"] == "user" and
-                        recent_item.get("platform") == "claude"):
+                        # If current content is longer and recent is a prefix, remove the recent one
+                        if (len(content) > len(recent_content) and
+                            content.startswith(recent_content) and
+                            len(recent_content) >= 3):  # Don't remove very short content
 
-                        recent_time = datetime.fromisoformat(recent_item["ts"])
-                        time_diff = (current_time - recent_time).total_seconds()
+                            log.debug("PREFIX FILTER: Removing premature capture '%s' (prefix of '%s')", recent_content, content)
+                            dedup_decisions.inc(rule="prefix_filter")
 
-                        # Check within 30 seconds for name-prefixed echo (include same timestamp)
-                        if 0 <= time_diff <= 30:
-                            user_content = recent_item["content"]
+                            # Retract the prefix entry (tombstone appended to chat.log)
+                            await retract(recent, "prefix_filter", sink)
 
-                            # Check if assistant content is user content with single char prefix
-                            if (len(content) == len(user_content) + 1 and
-                                content[1:] == user_content and
-                                len(user_content) >= 10):  # Only for substantial content
+                            break  # Only remove one prefix per new message
+        except Exception as e:
+            log.error("PREFIX FILTER ERROR: %s", e)
 
-                                print(f"NAME PREFIX ECHO BLOCKED: Assistant echoing user input '{user_content}' with prefix '{content[0]}'")
-                                return PlainTextResponse("ok")
+    # Check for Claude name-prefixed user input echoes (e.g. "Jtestmessage" echoing "testmessage")
+    if item["role"] == "assistant" and platform == "claude":
+        # Look for recent user messages that this might be echoing
+        for recent in dedup_index.tail(10):  # Check last 10 entries
+            if recent.role == "user" and recent.platform == "claude":
+                time_diff = current_time - recent.epoch
 
-        except Exception as e:
-            print(f"NAME PREFIX FILTER ERROR: {e}")
+                # Check within 30 seconds for name-prefixed echo (include same timestamp)
+                if 0 <= time_diff <= 30:
+                    user_content = recent.content
+
+                    # Check if assistant content is user content with single char prefix
+                    if (len(content) == len(user_content) + 1 and
+                        content[1:] == user_content and
+                        len(user_content) >= 10):  # Only for substantial content
+
+                        log.debug("NAME PREFIX ECHO BLOCKED: Assistant echoing user input '%s' with prefix '%s'", user_content, content[0])
+                        dedup_decisions.inc(rule="name_prefix_echo")
+                        return FILTERED
 
     # Check if content should be filtered
     
     # Check for signal processing filter decision
-    signal_processing = metadata.get("signalProcessing", {})
-    is_signal_noise = signal_processing.get("filtered", False) or metadata.get("isSignalNoise", False)
-    signal_filters = signal_processing.get("filteredBy", []) or metadata.get("signalProcessingFilter", [])
+    signal = message.signal
+    is_signal_noise = signal.filtered or message.is_signal_noise
+    signal_filters = signal.filtered_by or message.signal_filters
     
-    print(f"SIGNAL DEBUG: metadata.signalProcessing={signal_processing}")
-    print(f"SIGNAL DEBUG: filtered={signal_processing.get('filtered', 'missing')}, is_signal_noise={is_signal_noise}")
+    log.debug("SIGNAL DEBUG: metadata.signalProcessing filtered=%s filteredBy=%s historical=%s", signal.filtered, signal.filtered_by, signal.is_historical)
+    log.debug("SIGNAL DEBUG: filtered=%s, is_signal_noise=%s", signal.filtered, is_signal_noise)
     
-    print(f"BEFORE FILTER: calling is_noise_content for content length {len(content)}")
+    log.debug("BEFORE FILTER: calling is_noise_content for content length %s", len(content))
     is_content_noise = is_noise_content(content, platform, urls)
     
     # Combine content noise and signal processing noise
     is_noise = is_content_noise or is_signal_noise
     
-    print(f"AFTER FILTER: content_noise={is_content_noise}, signal_noise={is_signal_noise}, final_noise={is_noise}")
+    log.debug("AFTER FILTER: content_noise=%s, signal_noise=%s, final_noise=%s", is_content_noise, is_signal_noise, is_noise)
     
     if is_signal_noise:
-        print(f"SIGNAL PROCESSING FILTER: '{content[:30]}...' blocked by {signal_filters}")
+        signal_noise.inc()
+        log.debug("SIGNAL PROCESSING FILTER: '%s...' blocked by %s", content[:30], signal_filters)
     
     # Debug logging
     if len(content) > 100:
-        print(f"DEBUG: long content ({len(content)} chars): {content[:50]}... -> is_noise={is_noise}")
+        log.debug("DEBUG: long content (%s chars): %s... -> is_noise=%s", len(content), content[:50], is_noise)
     if urls:
-        print(f"DEBUG: content with URLs: '{content[:30]}...' urls={urls} -> is_noise={is_noise}")
+        log.debug("DEBUG: content with URLs: '%s...' urls=%s -> is_noise=%s", content[:30], urls, is_noise)
     
     # Always log to verbose log (everything)
-    append_rolling(VERBOSE_LOG, item, MAX_LINES)
-    append_rolling(RECENT, item, RECENT_N)
+    item["seq"] = next_seq()
+    await sink.append(VERBOSE_LOG, item)
+    recent_ring.push(item)
     
     # Only log to filtered log if not noise (content noise OR signal noise)
+    held = False
     if not is_noise:
-        append_rolling(LOG, item, MAX_LINES)
+        if item["role"] == "assistant" and HOLDBACK_SECONDS > 0:
+            # Only the final snapshot of a streamed reply reaches chat.log; while
+            # it is held the duplicate and echo rules see it like a written entry
+            entry = dedup_index.add(item, sketch=sketch)
+            entry.held = True
+            await coalescer.offer((platform, item["convo"] or "no-convo"), item, entry,
+                                  lambda held_item, held_entry: commit_held(held_item, held_entry, sink))
+            held = True
+        else:
+            await commit_to_log(item, sink, sketch)
     
     # Enhanced logging with platform and metadata info
-    metadata = item.get("metadata", {})
-    tools = metadata.get("tools", [])
-    artifacts = metadata.get("artifacts", [])
-    
-    log_details = f"logged: {platform}-{item['role']} chars:{len(content)} content:'{content[:30]}...'"
-    if tools:
-        log_details += f" tools:{','.join(tools)}"
-    if artifacts:
-        log_details += f" artifacts:{len(artifacts)}"
-    if is_noise:
-        log_details += " [FILTERED - not in chat.log]"
-    else:
-        log_details += " [SAVED to chat.log]"
-    
-    print(log_details)
+    if log.isEnabledFor(logging.INFO):
+        metadata = item.get("metadata", {})
+        tools = metadata.get("tools", [])
+        artifacts = metadata.get("artifacts", [])
+        
+        log_details = f"logged: {platform}-{item['role']} chars:{len(content)} content:'{content[:30]}...'"
+        if tools:
+            log_details += f" tools:{','.join(tools)}"
+        if artifacts:
+            log_details += f" artifacts:{len(artifacts)}"
+        if is_noise:
+            log_details += " [FILTERED - not in chat.log]"
+        elif held:
+            log_details += " [HELD for chat.log]"
+        else:
+            log_details += " [SAVED to chat.log]"
+        
+        log.info(log_details, extra={"seq": item["seq"], "platform": platform, "role": item["role"],
+                                     "chars": len(content), "noise": is_noise})
+    return FILTERED if is_noise else ACCEPTED
+
+@app.post("/log")
+@request_seconds.time(endpoint="POST /log")
+async def log_msg(req: Request):
+    try:
+        message = decode_message(await req.body())
+    except ValueError as e:   # not JSON, or a SchemaError
+        return JSONResponse({"error": str(e)}, status_code=400)
+    messages_total.inc(status=await ingest(message))
     return PlainTextResponse("ok")
 
+@app.post("/log/batch")
+@request_seconds.time(endpoint="POST /log/batch")
+async def log_batch(req: Request):
+    """Ingest an array of message payloads (or {"messages": [...]}) in order.
+
+    Every item goes through the same pipeline as POST /log; the writes of
+    the whole batch are committed together. Returns one status per item.
+    """
+    try:
+        messages = decode_batch(await req.body())
+    except ValueError:
+        messages = None
+    status, content = await worker_batch(messages)
+    return JSONResponse(content, status_code=status)
+
+async def ingest_batch(messages: list) -> list:
+    """Statuses of a decoded batch's items (see codec.decode_batch); an item that is None is "invalid" """
+    batch = writer.batch()
+    statuses, keys = [], set()
+    for message in messages:
+        if message is None:
+            statuses.append("invalid")
+            continue
+        status = await ingest(message, batch, keys)
+        messages_total.inc(status=status)
+        statuses.append(status)
+    await batch.commit()
+    for key in keys:
+        seen_ids.add(key)
+    return statuses
+
+# Frames forwarded by the ingest workers (see workers.py), carrying messages
+# the worker already decoded and validated; each answers with (status code,
+# content) for the worker to send back
+async def worker_log(message: Message) -> tuple:
+    status = await ingest(message)
+    messages_total.inc(status=status)
+    return 200, "ok", status   # the verdict tells the worker whether to remember the id
+
+async def worker_batch(messages) -> tuple:
+    """(status code, content) for a decoded batch; None (not a batch) gets a 400"""
+    if messages is None:
+        return 400, {"error": "expected an array of messages"}
+    return 200, {"statuses": await ingest_batch(messages)}
+
+async def worker_retransmissions(count: int):
+    """Retransmissions a worker answered itself from the shared id table"""
+    messages_total.inc(count, status=DUPLICATE)
+    dedup_decisions.inc(count, rule="retransmission")
+
 @app.post("/diagnostic")
+@request_seconds.time(endpoint="POST /diagnostic")
 async def log_diagnostic(req: Request):
     """Endpoint for receiving raw diagnostic data from Claude transmission analysis"""
     data = await req.json()
@@ -519,19 +821,19 @@ async def log_diagnostic(req: Request):
         "transmissionType": data.get("transmissionType")
     }
     
-    # Log diagnostic data to separate file
-    diagnostic_path = ROOT / "diagnostic.ndjson"
-    append_rolling(diagnostic_path, diagnostic_item, 1000)  # Keep more diagnostic entries
+    # Log diagnostic data to separate file (keeps 1000 entries)
+    await append_rolling(DIAGNOSTIC_LOG, diagnostic_item)
     
     # Enhanced console output for diagnostic data
     element = diagnostic_item.get("elementSignature", {})
     text_preview = element.get("textPreview", "")[:50] if element else ""
     
-    print(f"🔍 DIAGNOSTIC: {diagnostic_item['transmissionType']} - '{text_preview}' (len:{element.get('textLength', 0) if element else 0})")
+    log.info("🔍 DIAGNOSTIC: %s - '%s' (len:%s)", diagnostic_item['transmissionType'], text_preview, element.get('textLength', 0) if element else 0)
     
     return PlainTextResponse("ok")
 
 @app.post("/analytics")
+@request_seconds.time(endpoint="POST /analytics")
 async def log_analytics(req: Request):
     """Enhanced analytics endpoint for comprehensive retransmission analysis"""
     data = await req.json()
@@ -545,9 +847,8 @@ async def log_analytics(req: Request):
         "data": data.get("data")
     }
     
-    # Log analytics to separate file  
-    analytics_path = ROOT / "analytics.ndjson"
-    append_rolling(analytics_path, analytics_item, 2000)  # Keep extensive analytics
+    # Log analytics to separate file (keeps 2000 entries)
+    await append_rolling(ANALYTICS_LOG, analytics_item)
     
     # Enhanced console output for analytics
     event_type = analytics_item.get("type", "unknown")
@@ -560,35 +861,188 @@ async def log_analytics(req: Request):
         text_preview = transmission_data.get("text", "")[:50]
         
         dup_flag = " [DUPLICATE]" if is_duplicate else ""
-        print(f"ANALYTICS [{test_phase}]: {role} transmission - '{text_preview}'{dup_flag}")
+        log.info("ANALYTICS [%s]: %s transmission - '%s'%s", test_phase, role, text_preview, dup_flag)
         
     elif event_type == "duplicate_detected":
         dup_data = analytics_item.get("data", {})
         pattern = dup_data.get("duplicateInfo", {}).get("pattern", "unknown")
         text_preview = dup_data.get("text", "")[:50]
-        print(f"DUPLICATE PATTERN [{test_phase}]: {pattern} - '{text_preview}'")
+        log.info("DUPLICATE PATTERN [%s]: %s - '%s'", test_phase, pattern, text_preview)
         
     elif event_type == "conversation_event":
         event_details = analytics_item.get("data", {})
         event_subtype = event_details.get("eventType", "unknown")
-        print(f"CONVERSATION EVENT [{test_phase}]: {event_subtype}")
+        log.info("CONVERSATION EVENT [%s]: %s", test_phase, event_subtype)
         
     elif event_type == "test_start":
         test_name = analytics_item.get("data", {}).get("testName", "unknown")
-        print(f"TEST START: {test_name}")
+        log.info("TEST START: %s", test_name)
         
     elif event_type == "test_end":
         test_data = analytics_item.get("data", {})
         test_name = test_data.get("testName", "unknown")
         transmission_count = test_data.get("transmissionCount", 0)
         duplicate_count = test_data.get("duplicateCount", 0)
-        print(f"TEST END: {test_name} ({transmission_count} transmissions, {duplicate_count} duplicates)")
+        log.info("TEST END: %s (%s transmissions, %s duplicates)", test_name, transmission_count, duplicate_count)
     
     return PlainTextResponse("ok")
 
+@app.get("/conversations")
+async def list_conversations():
+    """Conversation ids in chat.log with their message counts"""
+    return {"conversations": convo_index.conversations()}
+
+@app.get("/conversations/{convo:path}/messages")
+async def conversation_messages(convo: str, limit: int = 0):
+    """One conversation's chat.log entries, oldest first, read by offset"""
+    def read():
+        lines = writer.log(LOG).read_at(lambda: convo_index.offsets(convo)[-limit:] if limit > 0
+                                        else convo_index.offsets(convo))
+        return [loads(line) for line in lines]
+
+    messages = await asyncio.to_thread(read)
+    if not messages:
+        return JSONResponse({"convo": convo, "messages": []}, status_code=404)
+    return {"convo": convo, "messages": messages}
+
+@app.get("/history")
+async def message_history(since: str = None, until: str = None, platform: str = None,
+                          role: str = None, convo: str = None, limit: int = 1000):
+    """Messages from the long-term history, oldest first.
+
+    since/until are ISO timestamps (inclusive); retracted messages are
+    left out. How the filters are answered is up to the storage backend.
+    """
+    if history is None:
+        return JSONResponse({"error": "history is disabled"}, status_code=404)
+    messages = await asyncio.to_thread(history.query, since, until, platform, role, convo, limit)
+    return {"messages": messages, "count": len(messages)}
+
+@app.get("/messages")
+async def messages_page(since: str = None, until: str = None, cursor: str = None, before: str = None,
+                        limit: int = 100):
+    """One page of long-term history, oldest first.
+
+    With since or cursor the page reads forward from there; otherwise it is
+    the newest `limit` messages (before `before`, at or before `until`).
+    Pass next_cursor back as cursor= to continue (or to poll for new
+    messages), prev_cursor as before= to page back.
+    """
+    if history is None:
+        return JSONResponse({"error": "history is disabled"}, status_code=404)
+    try:
+        return await asyncio.to_thread(history.page, since, until, cursor, before, max(1, min(limit, 1000)))
+    except ValueError as e:
+        return JSONResponse({"error": f"bad cursor or timestamp: {e}"}, status_code=400)
+
+@app.get("/history/info")
+async def history_info():
+    """Storage backend and what it holds (segment indexes, or row count and ts range)"""
+    if history is None:
+        return JSONResponse({"error": "history is disabled"}, status_code=404)
+    return await asyncio.to_thread(history.describe)
+
+@app.get("/search")
+async def search(q: str, platform: str = None, role: str = None, since: str = None, limit: int = 20):
+    """Messages matching q, best first (BM25), each with a snippet around the match"""
+    if search_index is None:
+        return JSONResponse({"error": "search is disabled"}, status_code=404)
+    try:
+        hits = await asyncio.to_thread(search_index.search, q, platform, role, since, min(limit, 200))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {"query": q, "hits": hits, "count": len(hits)}
+
+@app.get("/recent")
+async def recent_messages(request: Request, n: int = RECENT_N, wait: float = 0):
+    """The latest n messages, oldest first, from memory.
+
+    The response carries an ETag. A request whose If-None-Match still
+    matches gets 304, or with ?wait=SECONDS is held until the next message
+    arrives (long-poll, up to RECENT_WAIT_MAX) and then answered.
+    """
+    known = request.headers.get("if-none-match")
+    etag = recent_ring.etag()
+    if known == etag:
+        if wait > 0:
+            await recent_ring.wait(recent_ring.version, min(wait, RECENT_WAIT_MAX))
+            etag = recent_ring.etag()
+        if known == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({"messages": recent_ring.latest(min(n, RECENT_CAPACITY))},
+                        headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/feed")
+async def live_feed(request: Request, since: int = None, platform: str = None, role: str = None):
+    """Server-Sent Events stream of chat.log records as they are written.
+
+    Messages are sent as "message" events and retraction records as
+    "retraction" events, each with the record's seq as the event id.
+    ?since=SEQ (or a Last-Event-ID header) replays what came after that
+    record first; ?platform= and ?role= filter messages. A consumer that
+    falls FEED_QUEUE records behind gets a "lagged" event and is
+    disconnected; it should reconnect with the last seq it processed.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if since is None and last_event_id.isdigit():
+        since = int(last_event_id)
+    sub = feed.subscribe(since, platform, role)
+
+    async def events():
+        last_seq = since
+        try:
+            while True:
+                if sub.lagged and sub.queue.empty():
+                    yield f"event: lagged\ndata: {json.dumps({'last_seq': last_seq})}\n\n"
+                    return
+                try:
+                    record = await asyncio.wait_for(sub.queue.get(), FEED_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if record is None:   # server shutting down
+                    return
+                last_seq = record.get("seq")
+                kind = "retraction" if is_retraction(record) else "message"
+                yield f"id: {last_seq}\nevent: {kind}\ndata: {encode(record)}\n\n"
+        finally:
+            feed.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
 @app.get("/health")
 async def health():
     return PlainTextResponse("ok")
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Counters, histograms and queue depths in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def stats():
+    """Writer queue depth, commit counters, streaming hold-back, seen-id, feed and search state"""
+    return {"writer": writer.stats(), "coalescer": coalescer.stats(), "seen_ids": seen_ids.stats(),
+            "feed": feed.stats(), "search": search_index.stats() if search_index else None,
+            "workers": worker_pool.stats() if worker_pool else None}
+
+class Server(uvicorn.Server):
+    """uvicorn server that ends open /feed streams and /recent long-polls as soon as shutdown starts"""
+
+    def handle_exit(self, sig, frame):
+        feed.close_soon()
+        recent_ring.close_soon()
+        super().handle_exit(sig, frame)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8788)
\ No newline at end of file
+    if WORKERS > 1:
+        # The workers own the public port; this process serves them over a Unix socket
+        worker_pool = WorkerPool(WORKERS, HOST, PORT, {"log": worker_log, "batch": worker_batch,
+                                                       "retransmissions": worker_retransmissions},
+                                 log_level=LOG_LEVEL)
+        bind = {"uds": worker_pool.http_path}
+    else:
+        bind = {"host": HOST, "port": PORT}
+    # uvicorn's per-request access log is console I/O on the hot path too
+    Server(uvicorn.Config(app, **bind, access_log=logging.getLevelName(LOG_LEVEL) <= logging.DEBUG)).run()
\ No newline at end of file
@@ -0,0 +1,111 @@
+# bench_codec.py — decode and encode cost per message for each installed JSON backend
+#
+#   python server/bench/bench_codec.py [--text-chars 2000] [--rounds 5000]
+#
+# For every backend in codec.BACKENDS (always "json"; "orjson" and "msgspec"
+# when installed) measures, per message:
+#
+#   decode   POST /log body -> codec.Message (parse + schema validation)
+#   encode   the chat.log record -> NDJSON bytes (Codec.dumps)
+#
+# next to the old path: json.loads into a dict, with the fields reached by
+# .get() chains, and json.dumps of the record. Every backend must decode to
+# the same fields and encode to JSON that reads back as the same record.
+#
+# On the stdlib backend, bodies of codec.RAW_MIN_BYTES or more keep the raw
+# text of their large fields, which the server splices into the line instead
+# of encoding them (records.Record); the "json" row's encode column is that
+# splice once --text-chars is large enough.
+import argparse, json, random, sys, time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import codec   # noqa: E402
+from records import Record   # noqa: E402
+
+
+def make_body(rng: random.Random, text_chars: int) -> bytes:
+    words = []
+    while sum(len(w) + 1 for w in words) < text_chars:
+        words.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyzé") for _ in range(rng.randint(2, 9))))
+    return json.dumps({
+        "id": f"msg-{rng.getrandbits(48):012x}",
+        "platform": "claude",
+        "convo": "c-1234",
+        "role": "assistant",
+        "text": " ".join(words),
+        "urls": ["https://claude.ai/chat/c-1234"],
+        "metadata": {"tools": ["web_search"], "artifacts": [], "method": "fetch",
+                     "signalProcessing": {"filtered": False, "filteredBy": [], "isHistorical": False}},
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def legacy_decode(body: bytes) -> tuple:
+    data = json.loads(body)
+    metadata = data.get("metadata", {})
+    signal = metadata.get("signalProcessing", {})
+    return (data.get("id"), data.get("platform", "unknown"), data.get("role", "assistant"),
+            data.get("text", ""), data.get("urls", []),
+            signal.get("filtered", False) or metadata.get("isSignalNoise", False),
+            signal.get("isHistorical", False))
+
+
+def fields(message: codec.Message) -> tuple:
+    return (message.id, message.platform, message.role, message.text, message.urls,
+            message.signal.filtered or message.is_signal_noise, message.signal.is_historical)
+
+
+def record_of(message: codec.Message) -> dict:
+    return {"ts": datetime.now().isoformat(timespec="seconds"), "seq": 1, "id": message.id,
+            "platform": message.platform, "convo": message.convo, "role": message.role,
+            "content": message.text, "urls": message.urls, "metadata": message.metadata}
+
+
+def per_call_us(fn, items, rounds: int) -> float:
+    start = time.perf_counter()
+    for i in range(rounds):
+        fn(items[i % len(items)])
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message decode/encode per JSON backend")
+    parser.add_argument("--text-chars", type=int, default=2000, help="length of each message's text")
+    parser.add_argument("--messages", type=int, default=64, help="distinct bodies cycled through")
+    parser.add_argument("--rounds", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    bodies = [make_body(rng, args.text_chars) for _ in range(args.messages)]
+    stdlib = codec.Codec("json")
+    raws = [stdlib.decode_message(b).raw for b in bodies]
+    records = [record_of(stdlib.decode_message(b)) for b in bodies]
+    expected = [legacy_decode(b) for b in bodies]
+
+    for name in codec.BACKENDS:
+        backend = codec.Codec(name)
+        if [fields(backend.decode_message(b)) for b in bodies] != expected:
+            raise SystemExit(f"{name}: decoded fields differ from json.loads")
+        if [json.loads(backend.dumps(r)) for r in records] != records:
+            raise SystemExit(f"{name}: encoded records do not read back the same")
+    print(f"{args.messages} messages of ~{len(bodies[0])} bytes; backends: {', '.join(codec.BACKENDS)} "
+          f"(server uses {codec.BACKEND}); results identical")
+
+    base_dec = per_call_us(legacy_decode, bodies, args.rounds)
+    base_enc = per_call_us(lambda r: json.dumps(r, ensure_ascii=False).encode("utf-8"), records, args.rounds)
+    print(f"{'path':12s} {'decode us':>10s} {'encode us':>10s}")
+    print(f"{'legacy':12s} {base_dec:10.2f} {base_enc:10.2f}")
+    for name in codec.BACKENDS:
+        backend = codec.Codec(name)
+        dec = per_call_us(backend.decode_message, bodies, args.rounds)
+        if name == "json" and raws[0]:
+            enc = per_call_us(lambda pair: Record(pair[0], raw=dict(pair[1])).line(),
+                              list(zip(records, raws)), args.rounds)
+        else:
+            enc = per_call_us(backend.dumps, records, args.rounds)
+        print(f"{name:12s} {dec:10.2f} {enc:10.2f}  ({base_dec / dec:.1f}x / {base_enc / enc:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
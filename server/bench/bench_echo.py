@@ -0,0 +1,98 @@
+# bench_echo.py — cost of the "does this reply contain a recent user message" check
+#
+#   python server/bench/bench_echo.py [--users 10] [--reply-words 3000]
+#
+# Compares three ways of answering the echo question for one assistant reply
+# against the recent user messages:
+#
+#   legacy       .lower() both sides for every recent entry (the old code)
+#   fold-once    user messages folded at ingest, reply folded once, C `in`
+#   aho-corasick one pass over the reply with a pure-Python automaton
+#
+# The automaton is the textbook one-pass answer, but in pure Python it walks
+# the reply a character at a time and loses to a handful of C-level substring
+# searches by an order of magnitude at the 5-10 patterns the echo rules look
+# at, which is why DedupEntry.folded + `in` is what the server uses.
+import argparse, random, time
+from collections import deque
+
+
+def build_automaton(patterns):
+    goto, fail, out = [{}], [0], [set()]
+    for i, pattern in enumerate(patterns):
+        state = 0
+        for ch in pattern:
+            if ch not in goto[state]:
+                goto.append({})
+                fail.append(0)
+                out.append(set())
+                goto[state][ch] = len(goto) - 1
+            state = goto[state][ch]
+        out[state].add(i)
+    queue = deque(goto[0].values())
+    while queue:
+        r = queue.popleft()
+        for ch, s in goto[r].items():
+            queue.append(s)
+            f = fail[r]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[s] = goto[f].get(ch, 0)
+            out[s] |= out[fail[s]]
+    return goto, fail, out
+
+
+def per_call_us(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the assistant-echoes-user substring check")
+    parser.add_argument("--users", type=int, default=10, help="recent user messages to check against")
+    parser.add_argument("--reply-words", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocab = ["".join(rng.choice("abcdefghijklmnop") for _ in range(rng.randint(2, 8))) for _ in range(2000)]
+    users = [" ".join(rng.choice(vocab) for _ in range(rng.randint(5, 40))).title() for _ in range(args.users)]
+    reply = " ".join(rng.choice(vocab) for _ in range(args.reply_words))
+    reply += " " + users[-1].upper()   # make one of them an actual echo
+
+    folded_users = [u.casefold() for u in users]
+    automaton = build_automaton(folded_users)
+
+    def legacy():
+        return [u.lower() in reply.lower() for u in users]
+
+    def fold_once():
+        folded = reply.casefold()
+        return [u in folded for u in folded_users]
+
+    def aho_corasick():
+        goto, fail, out = automaton
+        state, found = 0, set()
+        for ch in reply.casefold():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return [i in found for i in range(len(users))]
+
+    expected = legacy()
+    for fn in (fold_once, aho_corasick):
+        if fn() != expected:
+            raise SystemExit(f"{fn.__name__} disagrees with the legacy check")
+    print(f"{args.users} user messages, {len(reply)}-char reply; results identical")
+    base = per_call_us(legacy, args.rounds)
+    for name, fn in (("legacy", legacy), ("fold-once", fold_once), ("aho-corasick", aho_corasick)):
+        us = base if fn is legacy else per_call_us(fn, args.rounds)
+        print(f"{name:13s} {us:10.1f} us/check  ({base / us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# bench_noise_filter.py — compiled noise filter vs the original is_noise_content
+#
+#   python server/bench/bench_noise_filter.py [--corpus server/chatverbose.log]
+#
+# Replays message contents from an NDJSON log through both implementations,
+# fails if any decision differs, and prints the per-message cost of each.
+# Without a corpus file it falls back to a synthetic mix of prose and UI noise.
+import argparse, json, random, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from noise_filter import match_noise_rule
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "chatverbose.log"
+
+
+def legacy_is_noise_content(content: str, platform: str, urls: list = None) -> bool:
+    # The pre-noise_filter implementation (debug prints removed), for comparison
+    content_lower = content.lower().strip()
+    urls = urls or []
+    if len(content) < 3:
+        return True
+    if any(css_pattern in content for css_pattern in [
+        "@keyframes", "position: fixed", "z-index:", "rgba(", "transform:",
+        "animation:", "box-shadow:", "border-radius:", "opacity:", "background:",
+        ".intercom-", "px;", "rem;", "vh;", "vw;", "%;"
+    ]):
+        return True
+    greeting_patterns = [
+        "hi, i'm claude", "hello, i'm claude", "i'm claude", "how can i help you today",
+        "what can i help you with today", "how may i assist you today", "hi there! how can i help"
+    ]
+    if any(greeting_pattern in content_lower for greeting_pattern in greeting_patterns):
+        if hasattr(urls, '__iter__') and any('sonnet' in str(url).lower() for url in urls):
+            return False
+        return True
+    ui_noise_exact = [
+        "all chats", "new chat", "retry", "share", "delete",
+        "claude can make mistakes", "please double-check responses",
+        "pending context request", "artifacts", "projects", "claude code",
+        "starred", "chats projects artifacts", "recents",
+        "test message confirmation share", "test message confirmation",
+        "retry", "share", "confirmation", "message confirmation"
+    ]
+    ui_noise_patterns = [
+        "chats projects artifacts", "claude can make mistakes",
+        "retry", "confirmation share", "message confirmation"
+    ]
+    if content_lower in ui_noise_exact or any(pattern in content_lower for pattern in ui_noise_patterns):
+        return True
+    has_chat_url = any("claude.ai/chat/" in url for url in urls)
+    if has_chat_url and len(content.split()) <= 6:
+        return True
+    single_word_ui = ["research", "sonnet", "writing", "method", "analysis", "review", "request"]
+    if (len(content.split()) == 1 and content_lower in single_word_ui):
+        return True
+    import re
+    if re.match(r'^okay\d+$', content_lower):
+        return False
+    chat_title_patterns = ["research sonnet 4", "j james", "j test"]
+    if any(pattern in content_lower for pattern in chat_title_patterns):
+        return True
+    claude_ui_patterns = [
+        r".*\s+retry$",
+        r".*\s+share$",
+        r"test\s+message\s+confirmation.*"
+    ]
+    import re
+    for pattern in claude_ui_patterns:
+        if re.match(pattern, content_lower):
+            return True
+    if content_lower.startswith('testmessage') or re.match(r'^okay\d+$', content_lower):
+        return False
+    return False
+
+
+def load_corpus(path: Path) -> list:
+    samples = []
+    for line in path.read_text(encoding="utf-8", errors="replace").splitlines():
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(item.get("content"), str):
+            samples.append((item["content"], item.get("platform", "unknown"), item.get("urls") or []))
+    return samples
+
+
+def synthetic_corpus(n: int = 5000) -> list:
+    rng = random.Random(7)
+    prose = ("Sure! Here is a detailed explanation of how the function works. "
+             "It iterates over the input list and accumulates the values. ")
+    noise = ["Retry", "Share", "New chat", "All chats", "Claude can make mistakes. Please double-check responses.",
+             "Hi, I'm Claude. How can I help you today?", "research sonnet 4", "okay27", "testmessage143",
+             ".intercom-lightweight-app{position: fixed;z-index:2147483001}", "Research", "J test chat",
+             "test message confirmation Share", "Here is the answer Share"]
+    samples = []
+    for _ in range(n):
+        if rng.random() < 0.3:
+            content = rng.choice(noise)
+        else:
+            content = prose * rng.randint(1, 40)
+        urls = rng.choice([[], [], ["https://claude.ai/chat/abc"], ["https://www.anthropic.com/claude/sonnet"]])
+        samples.append((content, rng.choice(["claude", "chatgpt"]), urls))
+    return samples
+
+
+def per_message_us(fn, samples, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for content, platform, urls in samples:
+            fn(content, platform, urls)
+    return (time.perf_counter() - start) / (rounds * len(samples)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled noise filter")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus.exists():
+        samples = load_corpus(args.corpus)
+        print(f"corpus: {len(samples)} messages from {args.corpus}")
+    else:
+        samples = synthetic_corpus()
+        print(f"corpus: {len(samples)} synthetic messages ({args.corpus} not found)")
+
+    mismatches = [(c, u) for c, p, u in samples
+                  if legacy_is_noise_content(c, p, u) != (match_noise_rule(c, p, u) is not None)]
+    if mismatches:
+        for content, urls in mismatches[:10]:
+            print(f"MISMATCH: {content[:60]!r} urls={urls}")
+        sys.exit(f"{len(mismatches)} decisions differ from the original filter")
+    print("decisions: identical")
+
+    legacy = per_message_us(legacy_is_noise_content, samples, args.rounds)
+    compiled = per_message_us(match_noise_rule, samples, args.rounds)
+    print(f"legacy   {legacy:8.2f} us/msg")
+    print(f"compiled {compiled:8.2f} us/msg  ({legacy / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
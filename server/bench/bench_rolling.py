@@ -0,0 +1,76 @@
+# bench_rolling.py — per-message append cost: old read-modify-write vs RollingLog
+#
+#   python server/bench/bench_rolling.py [--appends N]
+#
+# Prefills a file with MAX_LINES entries and times appends at several
+# retention sizes. The legacy column should grow with MAX_LINES; the
+# RollingLog column should stay flat.
+import argparse, json, sys, tempfile, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rolling_log import RollingLog
+
+SAMPLE = {
+    "ts": "2025-01-21T15:30:47",
+    "platform": "claude",
+    "role": "assistant",
+    "content": "Here's a Python script that prints the numbers one to ten. " * 4,
+    "urls": [],
+    "metadata": {"artifacts": [], "tools": ["python"], "streaming": True, "messageLength": 240},
+}
+
+
+def legacy_append_rolling(path: Path, item: dict, max_lines: int):
+    # The pre-RollingLog implementation, kept here for comparison
+    lines = []
+    if path.exists():
+        lines = [ln for ln in path.read_text(encoding="utf-8").splitlines() if ln.strip()]
+    lines.append(json.dumps(item, ensure_ascii=False))
+    if len(lines) > max_lines:
+        lines = lines[-max_lines:]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def prefill(path: Path, max_lines: int):
+    line = json.dumps(SAMPLE, ensure_ascii=False)
+    path.write_text((line + "\n") * max_lines, encoding="utf-8")
+
+
+def time_legacy(path: Path, max_lines: int, appends: int) -> float:
+    prefill(path, max_lines)
+    start = time.perf_counter()
+    for _ in range(appends):
+        legacy_append_rolling(path, SAMPLE, max_lines)
+    return (time.perf_counter() - start) / appends
+
+
+def time_rolling(path: Path, max_lines: int, appends: int) -> float:
+    prefill(path, max_lines)
+    log = RollingLog(path, max_lines)
+    start = time.perf_counter()
+    for _ in range(appends):
+        log.append(SAMPLE)
+    elapsed = time.perf_counter() - start
+    log.close()
+    return elapsed / appends
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rolling log appends")
+    parser.add_argument("--appends", type=int, default=2000)
+    parser.add_argument("--sizes", default="100,1000,10000,50000")
+    args = parser.parse_args()
+
+    print(f"{'MAX_LINES':>10} {'legacy us/msg':>15} {'RollingLog us/msg':>18}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for max_lines in (int(s) for s in args.sizes.split(",")):
+            # The legacy path is O(file size); cap its iterations so big sizes finish
+            legacy_n = max(10, min(args.appends, 2_000_000 // max_lines))
+            legacy = time_legacy(Path(tmp) / "legacy.log", max_lines, legacy_n)
+            rolling = time_rolling(Path(tmp) / "rolling.log", max_lines, args.appends)
+            print(f"{max_lines:>10} {legacy * 1e6:>15.1f} {rolling * 1e6:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
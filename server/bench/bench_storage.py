@@ -0,0 +1,101 @@
+# bench_storage.py — NDJSON segments vs SQLite (WAL) as the long-term history store
+#
+#   python server/bench/bench_storage.py [--records 50000] [--batch 64] [--convos 200]
+#
+# Appends the same synthetic chat.log records to both backends (in batches,
+# as the LogWriter hands them over), then times the reads the server does:
+#
+#   append     --records records in --batch sized append_lines() calls
+#   convo      /history?convo=C  (one conversation out of --convos)
+#   platform   /history?platform=P&role=R&limit=100
+#   range      /history?since=...&until=...  (one hour)
+#   tail       tail(50), what the duplicate index is seeded from
+#   scan       every record, oldest first
+#
+# The NDJSON backend scans whatever segments overlap the time range, so its
+# filtered queries cost about as much as a scan of that range; SQLite answers
+# them from its indexes.
+import argparse, json, random, sys, tempfile, time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from storage import BACKENDS, open_store   # noqa: E402
+
+
+def make_lines(count: int, convos: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    words = ["".join(rng.choice("abcdefghijklmnop") for _ in range(rng.randint(2, 8))) for _ in range(2000)]
+    start = datetime(2026, 1, 1)
+    lines = []
+    for seq in range(1, count + 1):
+        ts = (start + timedelta(seconds=seq * 3)).isoformat(timespec="seconds")
+        if seq % 50 == 0:
+            record = {"ts": ts, "seq": seq, "type": "retraction", "retracts": seq - 1, "reason": "duplicate"}
+        else:
+            record = {"ts": ts, "seq": seq, "platform": rng.choice(("claude", "chatgpt")),
+                      "role": "user" if seq % 2 else "assistant", "convo": f"c{rng.randrange(convos)}",
+                      "content": " ".join(rng.choice(words) for _ in range(rng.randint(5, 120))),
+                      "urls": [], "metadata": {}}
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return lines
+
+
+def timed(fn, rounds: int = 1) -> tuple:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    return (time.perf_counter() - start) / rounds * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the history storage backends")
+    parser.add_argument("--records", type=int, default=50_000)
+    parser.add_argument("--batch", type=int, default=64, help="records per append_lines() call")
+    parser.add_argument("--convos", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5, help="repetitions of each read")
+    args = parser.parse_args()
+
+    lines = make_lines(args.records, args.convos)
+    mid = json.loads(lines[len(lines) // 2])["ts"]
+    hour_end = (datetime.fromisoformat(mid) + timedelta(hours=1)).isoformat(timespec="seconds")
+    reads = [
+        ("convo", lambda s: s.query(convo="c7")),
+        ("platform", lambda s: s.query(platform="chatgpt", role="user", limit=100)),
+        ("range", lambda s: s.query(since=mid, until=hour_end)),
+        ("tail", lambda s: s.tail(50)),
+        ("scan", lambda s: list(s.records())),
+    ]
+
+    print(f"{args.records} records, {args.batch} per batch, {args.convos} conversations")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in BACKENDS:
+            if backend == "ndjson":
+                store = open_store(backend, Path(tmp) / "history", max_bytes=1 << 20)
+            else:
+                store = open_store(backend, Path(tmp) / "history.sqlite3")
+
+            def append():
+                for i in range(0, len(lines), args.batch):
+                    store.append_lines(lines[i:i + args.batch])
+                store.sync()
+
+            ms, _ = timed(append)
+            row = {"append": ms}
+            for name, read in reads:
+                row[name], result = timed(lambda: read(store), args.rounds)
+                row[name + "_n"] = len(result)
+            results[backend] = row
+            store.close()
+
+    names = ["append"] + [name for name, _ in reads]
+    print(f"{'':10s}" + "".join(f"{backend:>14s}" for backend in BACKENDS))
+    for name in names:
+        counts = {results[b].get(name + "_n") for b in BACKENDS}
+        note = "" if len(counts) == 1 else f"  (results differ: {sorted(counts, key=str)})"
+        print(f"{name:10s}" + "".join(f"{results[b][name]:11.1f} ms" for b in BACKENDS) + note)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# check_hot_memory.py — tracemalloc check of the memory each resident /recent message costs
+#
+#   python server/bench/check_hot_memory.py [--messages 200] [--text-chars 200]
+#                                           [--min-total-ratio 5] [--min-ratio 10]
+#
+# Builds messages the way POST /log does (body -> codec.Message -> Record,
+# whose line is cached once the writer has encoded it), pushes them into
+#
+#   dicts      a deque of the record dicts, which is how the ring kept them
+#   hot        recent_ring.RecentRing, backed by hot_window.HotWindow
+#
+# and measures with tracemalloc what stays allocated once the request is done
+# with the message. Reports bytes per message in total and apart from the
+# message text, which any store has to keep. With the defaults (200-char
+# texts) the total drops about 6x (5.7-5.8x with orjson, 6.3-6.4x with the stdlib),
+# and what is kept besides the text drops 11-13x, to about 220 bytes.
+#
+# It is an asserting check: it exits non-zero (printing FAIL) if the records
+# read back differ from those pushed, if the total per message is not at
+# least --min-total-ratio times smaller, or if the overhead besides the text
+# is not at least --min-ratio times smaller.
+import argparse, gc, json, random, sys, tracemalloc, uuid
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import codec   # noqa: E402
+from records import Record   # noqa: E402
+from recent_ring import RecentRing   # noqa: E402
+
+PLATFORMS = ("claude", "chatgpt")
+
+
+def make_bodies(rng: random.Random, count: int, text_chars: int) -> list:
+    """Payloads shaped like the extension's (shared/common.js createMessagePayload)"""
+    vocab = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+             for _ in range(3000)]
+    convos = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(8)]
+    bodies = []
+    for i in range(count):
+        platform, role = rng.choice(PLATFORMS), rng.choice(("user", "assistant"))
+        words = []
+        while sum(len(w) + 1 for w in words) < text_chars:
+            words.append(rng.choice(vocab))
+        text = " ".join(words)
+        bodies.append(json.dumps({
+            "id": f"{platform}-{role}-{1760000000000 + i * 1500}",
+            "ts": f"2026-10-16T12:{i // 60 % 60:02d}:{i % 60:02d}.000Z",
+            "platform": platform,
+            "convo": rng.choice(convos),
+            "role": role,
+            "text": text,
+            "urls": [],
+            "metadata": {"artifacts": [], "tools": ["web_search"] if i % 5 == 0 else [],
+                         "streaming": role == "assistant", "messageLength": len(text)},
+        }).encode("utf-8"))
+    return bodies
+
+
+def ingest(body: bytes, seq: int, start: datetime) -> Record:
+    message = codec.decode_message(body)
+    item = Record({
+        "ts": (start + timedelta(seconds=seq)).isoformat(timespec="seconds"),
+        "seq": seq,
+        "id": message.id,
+        "platform": message.platform,
+        "convo": message.convo,
+        "role": message.role,
+        "content": message.text,
+        "urls": message.urls,
+        "metadata": message.metadata,
+    }, raw=message.raw)
+    item.line()   # the writer thread encodes it; the cached line stays with the record
+    return item
+
+
+def resident(make_store, push, bodies: list) -> tuple:
+    """(store, bytes still allocated per message after every push)"""
+    start = datetime(2026, 10, 16, 12)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = make_store()
+    for seq, body in enumerate(bodies, 1):
+        push(store, ingest(body, seq, start))
+    gc.collect()   # a Record and its cached line refer to each other
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, (after - before) / len(bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check memory per resident message in the recent ring")
+    parser.add_argument("--messages", type=int, default=200, help="messages pushed (and kept) in the ring")
+    parser.add_argument("--text-chars", type=int, default=200, help="length of each message's text")
+    parser.add_argument("--min-total-ratio", type=float, default=5.0,
+                        help="required reduction of the bytes per message, text included")
+    parser.add_argument("--min-ratio", type=float, default=10.0,
+                        help="required reduction of the bytes per message besides the text")
+    args = parser.parse_args()
+
+    bodies = make_bodies(random.Random(0), args.messages, args.text_chars)
+    dicts, old = resident(lambda: deque(maxlen=args.messages), deque.append, bodies)
+    ring, new = resident(lambda: RecentRing(args.messages), RecentRing.push, bodies)
+
+    if ring.latest(args.messages) != [dict(item) for item in dicts]:
+        raise SystemExit("FAIL: records read back from the ring differ from those pushed")
+    text = sum(sys.getsizeof(item["content"]) for item in dicts) / len(dicts)
+    ratio = (old - text) / (new - text)
+    print(f"{args.messages} messages, ~{text:.0f} bytes of text each (codec: {codec.BACKEND})")
+    print(f"{'store':6s} {'bytes/msg':>10s} {'w/o text':>10s}")
+    print(f"{'dicts':6s} {old:10.0f} {old - text:10.0f}")
+    print(f"{'hot':6s} {new:10.0f} {new - text:10.0f}  ({old / new:.1f}x, {ratio:.1f}x without text)")
+    failures = []
+    if old / new < args.min_total_ratio:
+        failures.append(f"bytes per message only {old / new:.1f}x smaller (need {args.min_total_ratio:g}x)")
+    if ratio < args.min_ratio:
+        failures.append(f"bytes besides the text only {ratio:.1f}x smaller (need {args.min_ratio:g}x)")
+    if failures:
+        raise SystemExit("FAIL: " + "; ".join(failures))
+    print(f"OK: {old / new:.1f}x >= {args.min_total_ratio:g}x in total, "
+          f"{ratio:.1f}x >= {args.min_ratio:g}x without text")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# check_near_dup.py — checks what the near-duplicate index does and does not treat as the same message
+#
+#   python server/bench/check_near_dup.py [--messages 500] [--seed 0]
+#
+# Feeds random messages into a near_dup.NearDupIndex set up as the server
+# sets it up, then looks up
+#
+#   variants   the same text with other case and spacing, or a trailing
+#              "Retry"/"Share" label: must be found
+#   edits      the text with one word replaced, for messages of 8 to 30
+#              words: must not be found
+#
+# and checks that simhash() gives the same fingerprints in a process with
+# another PYTHONHASHSEED (fingerprints must not depend on str hashing).
+# Exits non-zero on any miss, false match or differing fingerprint.
+import argparse, ast, json, os, random, subprocess, sys
+from pathlib import Path
+
+SERVER = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER))
+from near_dup import NearDupIndex, simhash, normalize   # noqa: E402
+
+
+def load_settings() -> dict:
+    """NEAR_DUP_* constants from ai-live-logger.py, read without starting the server"""
+    settings = {}
+    for line in (SERVER / "ai-live-logger.py").read_text(encoding="utf-8").splitlines():
+        if line.startswith(("NEAR_DUP_DISTANCE", "NEAR_DUP_SIMILARITY")):
+            name, value = line.split("#")[0].split("=")
+            settings[name.strip()] = ast.literal_eval(value.strip())
+    return settings
+
+
+class Entry:
+    __slots__ = ("fingerprint", "platform", "role", "content")
+
+    def __init__(self, index: NearDupIndex, content: str):
+        self.fingerprint = index.fingerprint(content)
+        self.platform, self.role, self.content = "claude", "user", content
+
+
+def make_messages(rng: random.Random, count: int) -> tuple:
+    """(messages as word lists, the vocabulary they were drawn from)"""
+    vocab = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+             for _ in range(3000)]
+    return [[rng.choice(vocab) for _ in range(rng.randint(8, 30))] for _ in range(count)], vocab
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check near-duplicate matching on variants and one-word edits")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = load_settings()
+    rng = random.Random(args.seed)
+    messages, vocab = make_messages(rng, args.messages)
+    failures = []
+    misses = edits_found = 0
+    for words in messages:
+        index = NearDupIndex(settings["NEAR_DUP_DISTANCE"], min_similarity=settings["NEAR_DUP_SIMILARITY"])
+        text = " ".join(words)
+        index.add(Entry(index, text))
+
+        variant = rng.choice([text.upper(), "  " + text.replace(" ", "\n  "), text + " Retry", text + "\nShare"])
+        if not index.find(index.fingerprint(variant), "claude", "user", variant):
+            misses += 1
+            failures.append(f"variant not found: {variant[:60]!r}")
+
+        edited = list(words)
+        at = rng.randrange(len(edited))
+        edited[at] = rng.choice([w for w in vocab[:50] if w != words[at]])
+        edit = " ".join(edited)
+        if index.find(index.fingerprint(edit), "claude", "user", edit):
+            edits_found += 1
+            failures.append(f"one-word edit of a {len(words)}-word message matched: {edit[:60]!r}")
+
+    texts = [normalize(" ".join(words)) for words in messages[:50]]
+    here = [simhash(t) for t in texts]
+    script = ("import json, sys; sys.path.insert(0, sys.argv[1]); from near_dup import simhash; "
+              "print(json.dumps([simhash(t) for t in json.load(sys.stdin)]))")
+    there = json.loads(subprocess.run([sys.executable, "-c", script, str(SERVER)], input=json.dumps(texts),
+                                      capture_output=True, text=True, check=True,
+                                      env=dict(os.environ, PYTHONHASHSEED=str(args.seed + 1))).stdout)
+    if here != there:
+        failures.append("fingerprints differ between processes")
+
+    print(f"{args.messages} messages of 8-30 words; distance {settings['NEAR_DUP_DISTANCE']}, "
+          f"similarity {settings['NEAR_DUP_SIMILARITY']}")
+    print(f"variants missed: {misses}, one-word edits matched: {edits_found}, "
+          f"fingerprints stable across processes: {here == there}")
+    if failures:
+        raise SystemExit("FAIL: " + "; ".join(failures[:5]))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
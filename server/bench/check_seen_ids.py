@@ -0,0 +1,76 @@
+# check_seen_ids.py — checks that SeenIds restored from a checkpoint still knows the ids it had taken in
+#
+#   python server/bench/check_seen_ids.py [--capacity 1000] [--ids 5000]
+#
+# Adds ids to an idempotency.SeenIds backed by a file in a temporary
+# directory, taking a checkpoint header (snapshot() then flush(), as the
+# server does) after every `capacity // 3` ids. At each checkpoint it then
+# adds more ids, up to and past a generation rotation, and "crashes": the
+# object is dropped without another flush, and a new one is opened on the
+# same file with the saved header. Every id of the generations the live
+# object still covered must be found in the restored one, and the restored
+# counts must match. Also checks that a header newer than the file is
+# refused. Exits non-zero on any lost id or mismatch.
+import argparse, sys, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from idempotency import SeenIds   # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check SeenIds against crashes after a checkpoint")
+    parser.add_argument("--capacity", type=int, default=1000)
+    parser.add_argument("--ids", type=int, default=5000)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "seen-ids.bloom"
+        step = max(1, args.capacity // 3)
+        for saved_at in range(step, args.ids, step):
+            seen = SeenIds(path, capacity=args.capacity, recent=10)
+            for i in range(saved_at):
+                seen.add(f"id-{i}")
+            state = seen.snapshot()
+            seen.flush()
+            # Past the checkpoint, far enough for at least one rotation
+            for i in range(saved_at, saved_at + args.capacity + step):
+                seen.add(f"id-{i}")
+            total = saved_at + args.capacity + step
+            covered = [f"id-{i}" for i in range(total) if f"id-{i}" in seen]
+            live = (len(seen), seen.stats()["generations"])
+            del seen   # no flush: a crash
+            try:
+                restored = SeenIds(path, capacity=args.capacity, recent=10, state=state)
+            except ValueError as e:
+                failures.append(f"checkpoint after {saved_at} ids: refused ({e})")
+                continue
+            lost = sum(1 for key in covered if key not in restored)
+            if lost or (len(restored), restored.stats()["generations"]) != live:
+                failures.append(f"checkpoint after {saved_at} ids: {lost} of {len(covered)} ids lost, "
+                                f"{len(restored)} ids in {restored.stats()['generations']} generations "
+                                f"restored, {live[0]} in {live[1]} live")
+            restored.close()
+        print(f"{len(range(step, args.ids, step))} checkpoints, capacity {args.capacity}")
+
+        seen = SeenIds(path, capacity=args.capacity, recent=10)
+        for i in range(args.capacity * 3):
+            seen.add(f"id-{i}")
+        newer = seen.snapshot()
+        seen.close()
+        seen = SeenIds(path, capacity=args.capacity, recent=10)   # fresh: the file starts over
+        seen.flush()
+        seen.close()
+        try:
+            SeenIds(path, capacity=args.capacity, recent=10, state=newer).close()
+            failures.append("a header newer than the file was adopted")
+        except ValueError:
+            pass
+    if failures:
+        raise SystemExit("FAIL: " + "; ".join(failures[:5]))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# check_worker_retry.py — checks that an ingest worker forwards a retry of a message the core failed on
+#
+#   python server/bench/check_worker_retry.py [--port 8799]
+#
+# Starts a workers.WorkerPool with one real worker process in front of a
+# scripted core whose "log" handler, per message, fails (raises: the worker
+# answers 500), rules it filtered, or accepts it. Each message is then sent
+# again, and again, and the check follows where every send ended up:
+#
+#   after a failure or "filtered"          the retry must reach the core
+#   after "accepted" or "duplicate"        the retry must be answered by the
+#                                          worker, from the shared IdTable
+#
+# Also sends two different texts under one id, which must both reach the
+# core (ids are keyed together with a hash of the text), and a payload that
+# is not a valid message, which the worker must refuse (400) without
+# forwarding it. Every message the core gets must be a decoded codec.Message
+# with its near_dup.Sketch. Exits non-zero on any mismatch. Linux or macOS, with uvicorn installed (as WORKERS > 1 needs).
+import argparse, asyncio, json, socket, sys, time, urllib.error, urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from workers import WorkerPool   # noqa: E402
+
+# text -> (what the core does with each send of it, in order, "ok" once the list
+# runs out; (HTTP status, who answered) expected for three sends)
+PLANS = {
+    "the core raises on the first send": (["raise"], [(500, "core"), (200, "core"), (200, "worker")]),
+    "the core filters the first send": (["filtered", "duplicate"],
+                                        [(200, "core"), (200, "core"), (200, "worker")]),
+    "the core accepts the first send": ([], [(200, "core"), (200, "worker"), (200, "worker")]),
+}
+
+
+class ScriptedCore:
+    def __init__(self):
+        self.received = []   # texts, in the order the core got them
+        self.plans = {text: list(plan) for text, (plan, _) in PLANS.items()}
+        self.retransmissions = 0
+
+    async def log(self, message):
+        text = message.text
+        self.received.append(text)
+        if message.sketch is None:
+            raise RuntimeError("the worker forwarded a message without its sketch")
+        step = self.plans.get(text, []).pop(0) if self.plans.get(text) else "ok"
+        if step == "raise":
+            raise RuntimeError("scripted core failure")
+        return 200, "ok", {"ok": "accepted"}.get(step, step)
+
+    async def batch(self, messages):
+        return 200, {"statuses": []}
+
+    async def count_retransmissions(self, count: int):
+        self.retransmissions += count
+
+
+def post(port: int, msg_id: str, text) -> int:
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/log", method="POST",
+                                     data=json.dumps({"id": msg_id, "platform": "claude", "role": "user",
+                                                      "text": text}).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_for_port(port: int, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"FAIL: no worker listening on port {port}")
+
+
+async def run(port: int) -> list:
+    core = ScriptedCore()
+    pool = WorkerPool(1, "127.0.0.1", port, {"log": core.log, "batch": core.batch,
+                                              "retransmissions": core.count_retransmissions})
+    await pool.start()
+    failures = []
+    try:
+        await asyncio.to_thread(wait_for_port, port)
+        for i, (text, (_, expected)) in enumerate(PLANS.items()):
+            statuses = []
+            for _ in range(3):
+                before = len(core.received)
+                status = await asyncio.to_thread(post, port, f"claude-user-{1760000000000 + i}", text)
+                statuses.append((status, "core" if len(core.received) > before else "worker"))
+            print(f"{text:36s} {statuses}")
+            if statuses != expected:
+                failures.append(f"{text}: got {statuses}, expected {expected}")
+        before = len(core.received)
+        for text in ("same id, one text", "same id, another text"):
+            await asyncio.to_thread(post, port, "claude-user-1760000000999", text)
+        if len(core.received) - before != 2:
+            failures.append("two texts under one id did not both reach the core")
+        before = len(core.received)
+        status = await asyncio.to_thread(post, port, "claude-user-1760000000998", 42)
+        print(f"{'a text that is not a string':36s} {status}")
+        if status != 400 or len(core.received) != before:
+            failures.append(f"an invalid message got {status} and reached the core "
+                            f"{len(core.received) - before} times, expected 400 from the worker")
+        await asyncio.sleep(1.0)   # the worker reports the retransmissions it answered every 0.5 s
+        print(f"retransmissions the worker reported: {core.retransmissions}")
+        if core.retransmissions != 4:
+            failures.append(f"worker reported {core.retransmissions} retransmissions, expected 4")
+    finally:
+        await pool.stop(grace=0)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that workers retry messages the core did not take in")
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args()
+    failures = asyncio.run(run(args.port))
+    if failures:
+        raise SystemExit("FAIL: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
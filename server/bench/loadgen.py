@@ -0,0 +1,437 @@
+# loadgen.py — end-to-end ingest load generator for a running ai-live-logger
+#
+#   python server/bench/loadgen.py [--source server/chatverbose.log] [--scenario mixed]
+#                                  [--concurrency 8] [--rate 0] [--count 2000]
+#                                  [--out bench-results.ndjson] [--label before]
+#                                  [--compare-workers 1,2,4 [--port 8790]]
+#
+# Start the server first (python server/ai-live-logger.py). Payloads are
+# built from recorded NDJSON traffic (chatverbose.log / chat.log entries go
+# to POST /log, analytics.ndjson entries to POST /analytics) or, without a
+# source, from a synthetic conversation. Scenarios:
+#
+#   replay           the source as recorded
+#   prefix-storm     every assistant reply streamed as growing snapshots
+#   duplicate-burst  every user message re-sent several times, half with a
+#                    fresh id (content duplicates), half with the same id
+#                    (retransmissions)
+#   mixed            replay with storms and bursts interleaved
+#
+# With --rate, requests are scheduled at a fixed rate and latency is
+# measured from the scheduled send time, so a stalled server shows up in
+# the percentiles instead of silently slowing the generator down.
+#
+# The summary (throughput, p50/p95/p99, HTTP statuses, the server's
+# accepted/duplicate/filtered counts from /metrics and the chat.log line
+# counts, and how many worker processes the server runs) is printed and,
+# with --out, appended as one JSON line so runs can be compared.
+#
+# --compare-workers runs the same requests once per listed WORKERS setting,
+# each against a fresh copy of the server (its modules only, in a temporary
+# directory, with WORKERS and PORT rewritten; no logs or history carried
+# over) that it starts and stops itself, and ends with a table of the runs
+# side by side. Outcome counts match between settings at --concurrency 1;
+# with more connections, requests on different connections reach the core
+# in a different order under each setting, so dedup can rule differently.
+# On Linux the table also has the CPU time per request of the core process
+# and of its workers, and the request rate that would saturate the core:
+# with fewer cores than processes req/s cannot rise with WORKERS, and the
+# core's CPU time is the figure that shows what more cores would give.
+import argparse, asyncio, json, os, re, shutil, signal, subprocess, sys, tempfile, time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+SYNTHETIC = [
+    ("user", "How do I reverse a list in Python without modifying the original?"),
+    ("assistant", "Use slicing: `reversed_list = original[::-1]` creates a new list in reverse "
+                  "order and leaves the original untouched. You can also call "
+                  "`list(reversed(original))`, which reads a little more explicitly."),
+    ("user", "And for a string?"),
+    ("assistant", "The same slice works on strings: `'hello'[::-1]` gives `'olleh'`. "
+                  "Strings are immutable, so you always get a new object back."),
+]
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client over asyncio streams (no dependencies)"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> tuple:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("ascii") + body)
+        try:
+            return await self._response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+
+    async def _response(self) -> tuple:
+        status = int((await self.reader.readuntil(b"\r\n")).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") == "chunked":
+            body = b""
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).strip(), 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = self.reader = None
+
+
+# -- workload ---------------------------------------------------------------
+
+def load_source(path: Path) -> list:
+    """(endpoint, record) pairs from a recorded NDJSON file"""
+    out = []
+    for line in path.read_text(encoding="utf-8", errors="replace").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or record.get("type") == "retraction":
+            continue
+        if "content" in record and "role" in record:
+            out.append(("/log", record))
+        elif "sessionTime" in record or "testPhase" in record:
+            out.append(("/analytics", record))
+    return out
+
+
+def synthetic_source(count: int) -> list:
+    out = []
+    for i in range(max(1, count // len(SYNTHETIC))):
+        for role, text in SYNTHETIC:
+            out.append(("/log", {"platform": "claude", "role": role, "content": f"{text} (#{i})",
+                                 "convo": f"synthetic-{i // 10}", "metadata": {}}))
+    return out
+
+
+def as_payload(record: dict, msg_id: str, content: str = None) -> dict:
+    """A POST /log body as the extension would send it"""
+    return {
+        "platform": record.get("platform", "claude"),
+        "role": record.get("role", "assistant"),
+        "text": record.get("content", "") if content is None else content,
+        "urls": record.get("urls") or [],
+        "metadata": record.get("metadata") or {},
+        "convo": record.get("convo"),
+        "id": msg_id,
+    }
+
+
+def build_requests(source: list, scenario: str, run_id: str, steps: int, burst: int) -> list:
+    """(path, body) pairs in send order"""
+    out = []
+    n = 0
+
+    def next_id():
+        nonlocal n
+        n += 1
+        return f"{run_id}-{n}"
+
+    for i, (endpoint, record) in enumerate(source):
+        if endpoint != "/log":
+            out.append((endpoint, json.dumps(record, ensure_ascii=False).encode("utf-8")))
+            continue
+        content = record.get("content", "")
+        storm = scenario == "prefix-storm" or (scenario == "mixed" and i % 3 == 1)
+        dupes = scenario == "duplicate-burst" or (scenario == "mixed" and i % 5 == 0)
+        if storm and record.get("role") == "assistant" and len(content) > steps:
+            for k in range(1, steps + 1):
+                snapshot = content[:len(content) * k // steps]
+                out.append(("/log", as_payload(record, next_id(), snapshot)))
+        elif dupes and record.get("role") == "user":
+            payload = as_payload(record, next_id())
+            out.append(("/log", payload))
+            for k in range(burst):
+                copy = dict(payload, id=payload["id"] if k % 2 else next_id())
+                out.append(("/log", copy))
+        else:
+            out.append(("/log", as_payload(record, next_id())))
+    return [(path, body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            for path, body in out]
+
+
+# -- run ----------------------------------------------------------------------
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+async def message_outcomes(host: str, port: int) -> dict:
+    """Server-side messages_total by status, from GET /metrics ({} if unavailable)"""
+    conn = Connection(host, port)
+    try:
+        status, body = await conn.request("GET", "/metrics")
+    except OSError:
+        return {}
+    finally:
+        conn.close()
+    out = {}
+    for line in body.decode("utf-8", "replace").splitlines():
+        if line.startswith('ailogger_messages_total{status="'):
+            labels, _, value = line.rpartition(" ")
+            out[labels.split('"')[1]] = float(value)
+    return out if status == 200 else {}
+
+
+async def server_workers(host: str, port: int):
+    """How many ingest worker processes the server runs (1 = single process), from GET /stats"""
+    conn = Connection(host, port)
+    try:
+        status, body = await conn.request("GET", "/stats")
+        workers = json.loads(body).get("workers") if status == 200 else None
+    except (OSError, ValueError):
+        return None
+    finally:
+        conn.close()
+    return workers["workers"] if workers else 1
+
+
+def count_lines(path: Path) -> int:
+    try:
+        with open(path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    except FileNotFoundError:
+        return 0
+
+
+async def run(requests: list, host: str, port: int, concurrency: int, rate: float) -> dict:
+    queue = asyncio.Queue()
+    for i, request in enumerate(requests):
+        queue.put_nowait((i, request))
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+
+    async def worker():
+        conn = Connection(host, port)
+        while True:
+            try:
+                i, (path, body) = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            scheduled = start + i / rate if rate > 0 else None
+            if scheduled is not None:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            sent = time.perf_counter()
+            try:
+                status, _ = await conn.request("POST", path, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status = "error"
+            latencies.append(time.perf_counter() - (scheduled or sent))
+            statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(requests),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(requests) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def measure(requests: list, host: str, port: int, log_dir: Path, args) -> dict:
+    """Send requests and summarize the run, with the server's outcomes and chat.log growth"""
+    chat_log = log_dir / "chat.log"
+    before = count_lines(chat_log)
+    workers = asyncio.run(server_workers(host, port))
+    outcomes_before = asyncio.run(message_outcomes(host, port))
+    result = asyncio.run(run(requests, host, port, args.concurrency, args.rate))
+    time.sleep(2.0)   # let the writer drain and the stream hold-back expire
+    after = count_lines(chat_log)
+    outcomes = asyncio.run(message_outcomes(host, port))
+    outcomes = {k: int(v - outcomes_before.get(k, 0)) for k, v in outcomes.items()}
+    return {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "label": args.label,
+        "scenario": args.scenario,
+        "source": str(args.source) if args.source else "synthetic",
+        "concurrency": args.concurrency,
+        "server_workers": workers,
+        "rate": args.rate,
+        **result,
+        "chat_log_lines_before": before,
+        "chat_log_lines_after": after,
+        "outcomes": outcomes,
+    }
+
+
+def report(summary: dict, out: Path = None):
+    print(f"{summary['requests']} requests in {summary['elapsed_s']}s "
+          f"({summary['throughput_rps']} req/s, concurrency {summary['concurrency']}, "
+          f"server workers {summary['server_workers']})")
+    print(f"latency p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  "
+          f"p99 {summary['p99_ms']}ms  max {summary['max_ms']}ms")
+    print(f"statuses {summary['statuses']}  chat.log lines "
+          f"{summary['chat_log_lines_before']} -> {summary['chat_log_lines_after']}")
+    if summary["outcomes"]:
+        print(f"server outcomes {summary['outcomes']}")
+    if out:
+        with open(out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
+
+
+def cpu_seconds(pid: int) -> tuple:
+    """(CPU seconds of process pid, of its child processes) so far; Linux only, (None, None) elsewhere.
+
+    The core process runs dedup and the writes for every message on one
+    interpreter, so on a machine with more cores than processes its CPU time
+    per request is what bounds throughput.
+    """
+    def own(stat_path: Path) -> tuple:
+        # Fields after the parenthesized command name: state is [0], ppid [1], utime [11], stime [12]
+        fields = stat_path.read_text().rpartition(")")[2].split()
+        return int(fields[1]), (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    try:
+        core = own(Path(f"/proc/{pid}/stat"))[1]
+    except (OSError, ValueError, AttributeError):
+        return None, None
+    children = 0.0
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            ppid, seconds = own(stat_path)
+        except (OSError, ValueError):
+            continue
+        if ppid == pid:
+            children += seconds
+    return core, children
+
+
+def start_server(workers: int, port: int) -> tuple:
+    """(process, directory) of a fresh copy of the server with WORKERS and PORT set, once it answers"""
+    root = Path(tempfile.mkdtemp(prefix="loadgen-server-"))
+    for module in SERVER_DIR.glob("*.py"):
+        shutil.copy(module, root)
+    script = root / "ai-live-logger.py"
+    text = script.read_text(encoding="utf-8")
+    text = re.sub(r"^WORKERS(\s*)= \d+", rf"WORKERS\g<1>= {workers}", text, count=1, flags=re.M)
+    text = re.sub(r"^(HOST, PORT\s*= \S+,) \d+", rf"\g<1> {port}", text, count=1, flags=re.M)
+    script.write_text(text, encoding="utf-8")
+    proc = subprocess.Popen([sys.executable, script.name], cwd=root,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while asyncio.run(server_workers("127.0.0.1", port)) is None:
+        if proc.poll() is not None or time.monotonic() > deadline:
+            stop_server(proc, root)
+            sys.exit(f"the server with WORKERS = {workers} did not start")
+        time.sleep(0.2)
+    return proc, root
+
+
+def stop_server(proc: subprocess.Popen, root: Path):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def compare_workers(requests: list, counts: list, port: int, args):
+    summaries = []
+    for count in counts:
+        print(f"-- WORKERS = {count}")
+        proc, root = start_server(count, port)
+        try:
+            core_before, workers_before = cpu_seconds(proc.pid)
+            summary = measure(requests, "127.0.0.1", port, root, args)
+            core_after, workers_after = cpu_seconds(proc.pid)
+        finally:
+            stop_server(proc, root)
+        if core_before is not None:
+            # measure() idles 2 s after the run; that costs next to no CPU
+            summary["core_cpu_us"] = round((core_after - core_before) / len(requests) * 1e6, 1)
+            summary["worker_cpu_us"] = round((workers_after - workers_before) / len(requests) * 1e6, 1)
+        summaries.append(dict(summary, label=args.label or f"workers={count}"))
+        report(summaries[-1], args.out)
+    print()
+    print(f"{'workers':>7s} {'req/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+          f"{'accepted':>9s} {'duplicate':>9s} {'filtered':>9s} {'core us':>8s} {'worker us':>9s} {'core max/s':>10s}")
+    for count, s in zip(counts, summaries):
+        outcomes = s["outcomes"]
+        core, workers = s.get("core_cpu_us"), s.get("worker_cpu_us")
+        cpu = (f" {core:8.0f} {workers:9.0f} {1e6 / core if core else 0:10.0f}" if core is not None
+               else f" {'-':>8s} {'-':>9s} {'-':>10s}")
+        print(f"{count:7d} {s['throughput_rps']:9.1f} {s['p50_ms']:8.2f} {s['p95_ms']:8.2f} {s['p99_ms']:8.2f} "
+              f"{outcomes.get('accepted', 0):9d} {outcomes.get('duplicate', 0):9d} {outcomes.get('filtered', 0):9d}"
+              + cpu)
+    print(f"(this machine has {os.cpu_count()} CPUs; core us and worker us are CPU time per request in the "
+          f"core process and in all workers together, and core max/s is the rate at which the core would "
+          f"be saturated, on a machine with enough cores for every process)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic traffic against a running ai-live-logger")
+    parser.add_argument("--url", default="http://127.0.0.1:8788")
+    parser.add_argument("--source", type=Path, help="NDJSON to replay (chatverbose.log, chat.log, analytics.ndjson)")
+    parser.add_argument("--scenario", choices=("replay", "prefix-storm", "duplicate-burst", "mixed"), default="mixed")
+    parser.add_argument("--count", type=int, default=2000, help="stop after this many requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel keep-alive connections")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second (0 = as fast as possible)")
+    parser.add_argument("--steps", type=int, default=6, help="snapshots per reply in a prefix storm")
+    parser.add_argument("--burst", type=int, default=4, help="extra copies per message in a duplicate burst")
+    parser.add_argument("--log-dir", type=Path, default=SERVER_DIR, help="where the server writes chat.log")
+    parser.add_argument("--out", type=Path, help="append the summary to this NDJSON file")
+    parser.add_argument("--label", default="", help="free-form tag stored with the summary")
+    parser.add_argument("--compare-workers", help="comma-separated WORKERS settings to start and measure in turn")
+    parser.add_argument("--port", type=int, default=8790, help="port of the servers --compare-workers starts")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    source = load_source(args.source) if args.source else synthetic_source(args.count)
+    if not source:
+        sys.exit(f"no usable records in {args.source}")
+    run_id = f"load-{os.getpid()}-{int(time.time())}"
+    requests = []
+    while len(requests) < args.count:
+        requests.extend(build_requests(source, args.scenario, f"{run_id}-{len(requests)}",
+                                       args.steps, args.burst))
+    requests = requests[:args.count]
+
+    if args.compare_workers:
+        compare_workers(requests, [int(n) for n in args.compare_workers.split(",")], args.port, args)
+    else:
+        report(measure(requests, url.hostname, url.port or 80, args.log_dir, args), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# checkpoint.py — one-file snapshot of the server's in-memory state, so a restart skips the rebuild
+#
+# Layout: a JSON header line, then the sections' bytes back to back:
+#   {"format": 1, "ts": ..., <caller's fields>, "sections": [[name, length, crc32], ...]}\n
+#   <section 1><section 2>...
+# The file is replaced atomically; a torn or damaged one fails load() and
+# the server falls back to rebuilding its state from the logs.
+import json, os, zlib
+from datetime import datetime
+from pathlib import Path
+
+FORMAT = 1
+
+
+def save(path: Path, meta: dict, sections: dict):
+    """Write meta (JSON-able) and named byte sections to path atomically"""
+    header = dict(meta, format=FORMAT, ts=datetime.now().isoformat(timespec="seconds"),
+                  sections=[[name, len(data), zlib.crc32(data)] for name, data in sections.items()])
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        for data in sections.values():
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load(path: Path) -> tuple:
+    """(meta, {name: bytes}); raises FileNotFoundError or ValueError"""
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError(f"checkpoint format {header.get('format')!r}, expected {FORMAT}")
+        sections = {}
+        for name, length, crc in header.pop("sections"):
+            data = f.read(length)
+            if len(data) != length or zlib.crc32(data) != crc:
+                raise ValueError(f"checkpoint section {name!r} is damaged")
+            sections[name] = data
+    return header, sections
@@ -0,0 +1,98 @@
+# coalesce.py — hold-back window that merges growing assistant snapshots before they reach chat.log
+import asyncio, logging
+from logsetup import LOGGER_NAME
+
+log = logging.getLogger(LOGGER_NAME + ".coalesce")
+
+
+class StreamCoalescer:
+    """Holds the latest assistant snapshot per (platform, conversation).
+
+    While a reply is streaming the extension sends several snapshots, each
+    extending the previous one. offer() keeps only the newest snapshot for
+    its key and restarts a quiescence timer; once no extending snapshot has
+    arrived for `window` seconds the held item is passed to `commit`. A
+    snapshot that does not extend the held one flushes the held one first,
+    through offer()'s `commit` if given (so it lands with the caller's other
+    writes) or the default one.
+
+    Each snapshot carries a `tag` chosen by the caller (the server's dedup
+    entry for it), handed back as commit(item, tag) and as discard(item,
+    tag) when a longer snapshot replaces it. drop() takes a held snapshot
+    back by its tag. Commits started by the timer run as tasks that are
+    kept until they finish; one that fails is logged.
+    """
+
+    def __init__(self, window: float, commit, discard=None):
+        self.window = window
+        self._commit = commit        # async callable(item, tag)
+        self._discard = discard      # callable(item, tag), or None
+        self._pending = {}           # key -> (item, tag, timer handle)
+        self._tasks = set()          # timer commits under way
+        self.held = 0
+        self.replaced = 0
+        self.dropped = 0
+        self.committed = 0
+
+    async def offer(self, key, item: dict, tag=None, commit=None):
+        pending = self._pending.pop(key, None)
+        if pending:
+            held_item, held_tag, timer = pending
+            timer.cancel()
+            if item["content"].startswith(held_item["content"]):
+                self.replaced += 1
+                if self._discard:
+                    self._discard(held_item, held_tag)
+            else:
+                await self._flush_item(held_item, held_tag, commit)
+        self.held += 1
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(self.window, self._on_quiet, key, item)
+        self._pending[key] = (item, tag, timer)
+
+    def drop(self, tag) -> bool:
+        """Forget the held snapshot with this tag; False if none is held"""
+        for key, (_, held_tag, timer) in self._pending.items():
+            if held_tag is tag:
+                timer.cancel()
+                del self._pending[key]
+                self.dropped += 1
+                return True
+        return False
+
+    def _on_quiet(self, key, item):
+        task = asyncio.get_running_loop().create_task(self._flush_if_held(key, item))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    async def _flush_if_held(self, key, item):
+        # Still held unless a later offer() or drop() got here first
+        pending = self._pending.get(key)
+        if pending and pending[0] is item:
+            del self._pending[key]
+            await self._flush_item(item, pending[1])
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("HOLDBACK COMMIT ERROR: %s", task.exception())
+
+    async def _flush_item(self, item, tag, commit=None):
+        self.committed += 1
+        await (commit or self._commit)(item, tag)
+
+    async def flush_all(self):
+        """Commit everything still held (used on shutdown)"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+        pending, self._pending = self._pending, {}
+        for item, tag, timer in pending.values():
+            timer.cancel()
+            await self._flush_item(item, tag)
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        return {"pending": self.depth(), "held": self.held, "replaced": self.replaced,
+                "dropped": self.dropped, "committed": self.committed}
@@ -0,0 +1,305 @@
+# codec.py — JSON decoding and encoding for messages and log lines, with typed message payloads
+#
+# Uses the fastest JSON library installed: msgspec, then orjson, then the
+# stdlib json module. Whatever the library, the results are the same:
+#
+#   - input a fast decoder rejects (NaN, integers beyond 64 bits) gets a
+#     second look from the stdlib, so nothing that parsed before stops parsing
+#   - records a fast encoder refuses are encoded by the stdlib
+#   - the fast libraries write compact JSON ({"a":1}); the stdlib keeps its
+#     usual separators. Readers of the logs accept both.
+#
+# POST /log bodies are decoded into a Message: the payload's fields checked
+# against the schema below, with metadata.signalProcessing as a typed
+# SignalProcessing. The checks are not free. Message.from_obj() adds about
+# 2-3 us per message to the parse, for one inline type() test per field on
+# well-formed payloads; the old dict-and-.get() path did not pay that. On
+# the stdlib backend, decode therefore runs at about 0.8-1.0x the old
+# speed, and at about the old speed with orjson (bench/bench_codec.py).
+#
+# On the stdlib path a body of RAW_MIN_BYTES or more is parsed by
+# parse_object(), which also keeps the raw JSON text of the large fields so
+# the log line can reuse it (see records.Record). Below that, and with the
+# fast libraries, encoding the fields costs less than the slower parse that
+# keeps their text (bench/bench_codec.py).
+import json, re
+
+try:
+    import msgspec
+except ImportError:   # optional
+    msgspec = None
+try:
+    import orjson
+except ImportError:   # optional
+    orjson = None
+
+_decoder = json.JSONDecoder()
+_scanstring = json.decoder.scanstring
+_WS = re.compile(r"[ \t\n\r]*")
+
+RAW_MIN_BYTES = 4096     # stdlib only: smaller bodies are parsed without keeping raw text
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8", "replace")
+
+
+BACKENDS = {"json": (json.loads, _stdlib_dumps)}
+if orjson is not None:
+    BACKENDS["orjson"] = (orjson.loads, orjson.dumps)
+if msgspec is not None:
+    BACKENDS["msgspec"] = (msgspec.json.Decoder().decode, msgspec.json.Encoder().encode)
+BACKEND = "msgspec" if msgspec is not None else "orjson" if orjson is not None else "json"
+
+_DECODE_ERRORS = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+_ENCODE_ERRORS = (TypeError, ValueError, OverflowError) + ((msgspec.EncodeError,) if msgspec is not None else ())
+
+
+class SchemaError(ValueError):
+    """A payload that is valid JSON but not a valid message"""
+
+
+# -- typed payloads -----------------------------------------------------------
+
+def _field(obj: dict, key: str, kind, default, where: str = ""):
+    """obj[key] if it has type kind; default if missing or null"""
+    value = obj.get(key)
+    if value is None:
+        return default
+    if not isinstance(value, kind):
+        raise SchemaError(f"{where}{key} must be {_KIND_NAMES[kind]}")
+    return value
+
+
+def _str_list(obj: dict, key: str, where: str = "") -> list:
+    value = _field(obj, key, list, [], where)
+    if not all(isinstance(v, str) for v in value):
+        raise SchemaError(f"{where}{key} must be a list of strings")
+    return value
+
+
+_KIND_NAMES = {str: "a string", bool: "true or false", list: "a list", dict: "an object"}
+
+
+class SignalProcessing:
+    """metadata.signalProcessing: the extension's own verdict on a message"""
+
+    __slots__ = ("filtered", "filtered_by", "is_historical")
+
+    def __init__(self, filtered: bool = False, filtered_by: list = (), is_historical: bool = False):
+        self.filtered = filtered
+        self.filtered_by = list(filtered_by)
+        self.is_historical = is_historical
+
+    @classmethod
+    def from_obj(cls, obj) -> "SignalProcessing":
+        if obj is None:
+            return cls()
+        where = "metadata.signalProcessing."
+        if not isinstance(obj, dict):
+            raise SchemaError("metadata.signalProcessing must be an object")
+        return cls(_field(obj, "filtered", bool, False, where), _str_list(obj, "filteredBy", where),
+                   _field(obj, "isHistorical", bool, False, where))
+
+
+_NO_SIGNAL = SignalProcessing()   # shared by every message without one; read-only
+
+
+class Message:
+    """A POST /log payload, validated.
+
+    Missing or null fields take their defaults; a field of the wrong type
+    raises SchemaError. metadata is kept whole (the extension sends more
+    than the server reads) apart from the typed views below. raw maps record
+    keys ("content", "urls", "metadata") to the payload's JSON text for them,
+    when the decoder kept it. sketch is the near_dup.Sketch of text when
+    whoever decoded the message made one (an ingest worker does), else None.
+    """
+
+    __slots__ = ("id", "platform", "convo", "role", "text", "urls", "metadata",
+                 "signal", "is_signal_noise", "signal_filters", "raw", "sketch")
+
+    # record key -> payload key, for the fields whose raw text may be reused
+    RAW_FIELDS = {"content": "text", "urls": "urls", "metadata": "metadata"}
+
+    @classmethod
+    def from_obj(cls, data, raw: dict = None) -> "Message":
+        # Well-formed payloads (nearly all of them) are checked inline, one
+        # type() test per field; anything else takes _checked(), which
+        # names the offending field
+        if type(data) is not dict:
+            return cls._checked(data, raw)
+        get = data.get
+        msg_id, platform, convo, role = get("id"), get("platform"), get("convo"), get("role")
+        text, urls, metadata = get("text"), get("urls"), get("metadata")
+        if not ((msg_id is None or type(msg_id) is str) and (platform is None or type(platform) is str) and
+                (convo is None or type(convo) is str) and (role is None or type(role) is str) and
+                (text is None or type(text) is str) and
+                (urls is None or (type(urls) is list and (not urls or all(type(u) is str for u in urls)))) and
+                (metadata is None or type(metadata) is dict)):
+            return cls._checked(data, raw)
+        if metadata:
+            meta_get = metadata.get
+            signal, noise, filters = (meta_get("signalProcessing"), meta_get("isSignalNoise"),
+                                      meta_get("signalProcessingFilter"))
+            if not ((signal is None or type(signal) is dict) and (noise is None or type(noise) is bool) and
+                    (filters is None or (type(filters) is list and
+                                         (not filters or all(type(f) is str for f in filters))))):
+                return cls._checked(data, raw)
+            if signal is not None:
+                sp_filtered, sp_by, sp_historical = (signal.get("filtered"), signal.get("filteredBy"),
+                                                     signal.get("isHistorical"))
+                if not ((sp_filtered is None or type(sp_filtered) is bool) and
+                        (sp_by is None or (type(sp_by) is list and
+                                           (not sp_by or all(type(f) is str for f in sp_by)))) and
+                        (sp_historical is None or type(sp_historical) is bool)):
+                    return cls._checked(data, raw)
+                signal = SignalProcessing.__new__(SignalProcessing)
+                signal.filtered, signal.is_historical = sp_filtered or False, sp_historical or False
+                signal.filtered_by = [] if sp_by is None else sp_by
+        else:
+            signal = noise = filters = None
+            metadata = {} if metadata is None else metadata
+        msg = cls.__new__(cls)
+        msg.id, msg.convo = msg_id, convo
+        msg.platform = "unknown" if platform is None else platform
+        msg.role = "assistant" if role is None else role
+        msg.text = "" if text is None else text
+        msg.urls = [] if urls is None else urls
+        msg.metadata = metadata
+        msg.signal = _NO_SIGNAL if signal is None else signal
+        msg.is_signal_noise = noise or False
+        msg.signal_filters = [] if filters is None else filters
+        msg.raw = {key: raw[field] for key, field in cls.RAW_FIELDS.items()
+                   if field in raw and data[field] is not None} if raw else {}
+        msg.sketch = None
+        return msg
+
+    @classmethod
+    def _checked(cls, data, raw: dict = None) -> "Message":
+        """from_obj() one field at a time; raises SchemaError for the first that is wrong"""
+        if not isinstance(data, dict):
+            raise SchemaError("a message must be a JSON object")
+        msg = cls.__new__(cls)
+        msg.id = _field(data, "id", str, None)
+        msg.platform = _field(data, "platform", str, "unknown")
+        msg.convo = _field(data, "convo", str, None)
+        msg.role = _field(data, "role", str, "assistant")
+        msg.text = _field(data, "text", str, "")
+        msg.urls = _str_list(data, "urls")
+        msg.metadata = metadata = _field(data, "metadata", dict, {})
+        msg.signal = SignalProcessing.from_obj(metadata.get("signalProcessing"))
+        msg.is_signal_noise = _field(metadata, "isSignalNoise", bool, False, "metadata.")
+        msg.signal_filters = _str_list(metadata, "signalProcessingFilter", "metadata.")
+        msg.raw = {key: raw[field] for key, field in cls.RAW_FIELDS.items()
+                   if field in raw and data[field] is not None} if raw else {}
+        msg.sketch = None
+        return msg
+
+
+# -- codecs ---------------------------------------------------------------------
+
+class Codec:
+    """loads/dumps/decode_message through one backend (see BACKENDS)"""
+
+    __slots__ = ("name", "_loads", "_dumps")
+
+    def __init__(self, name: str = BACKEND):
+        self.name = name
+        self._loads, self._dumps = BACKENDS[name]
+
+    def loads(self, data):
+        """json.loads, sped up"""
+        try:
+            return self._loads(data)
+        except _DECODE_ERRORS:
+            if self.name == "json":
+                raise
+            return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        """UTF-8 JSON of obj (non-ASCII characters as they are)"""
+        try:
+            return self._dumps(obj)
+        except _ENCODE_ERRORS:
+            if self.name == "json":
+                raise
+            return _stdlib_dumps(obj)
+
+    def decode_message(self, body: bytes) -> Message:
+        """Parse and validate a POST /log body; raises ValueError (SchemaError if it is not a message)"""
+        if self.name == "json" and len(body) >= RAW_MIN_BYTES:
+            try:
+                return Message.from_obj(*parse_object(body))
+            except SchemaError:
+                raise
+            except ValueError:
+                pass   # not an object, or not JSON: json.loads says which
+        return Message.from_obj(self.loads(body))
+
+    def decode_batch(self, body: bytes) -> list:
+        """Parse a POST /log/batch body (an array of messages, or {"messages": [...]}).
+
+        Returns one Message per item, None for an item that is not a valid
+        message; raises ValueError if the body is not a batch at all.
+        """
+        data = self.loads(body)
+        if isinstance(data, dict):
+            data = data.get("messages")
+        if not isinstance(data, list):
+            raise ValueError("expected an array of messages")
+        messages = []
+        for payload in data:
+            try:
+                messages.append(Message.from_obj(payload))
+            except SchemaError:
+                messages.append(None)
+        return messages
+
+
+default = Codec()
+loads, dumps, decode_message, decode_batch = default.loads, default.dumps, default.decode_message, default.decode_batch
+
+
+def parse_object(body: bytes) -> tuple:
+    """(members, raw) for a JSON object body; raw maps each key to its value's JSON text.
+
+    Values are decoded by the json module's scanner, so this is a single
+    parse. Raw text that spans lines (a pretty-printed nested object) is left
+    out, since it could not go into an NDJSON line as-is. Raises ValueError
+    for anything json.loads would reject, and for bodies that are not objects.
+    """
+    text = body.decode(json.detect_encoding(body), "surrogatepass") if isinstance(body, bytes) else body
+    idx = _WS.match(text, 0).end()
+    if text[idx:idx + 1] != "{":
+        raise ValueError("not a JSON object")
+    members, raw = {}, {}
+    idx = _WS.match(text, idx + 1).end()
+    if text[idx:idx + 1] == "}":
+        idx += 1
+    else:
+        while True:
+            if text[idx:idx + 1] != '"':
+                raise ValueError(f"expected a member name at {idx}")
+            key, idx = _scanstring(text, idx + 1)
+            idx = _WS.match(text, idx).end()
+            if text[idx:idx + 1] != ":":
+                raise ValueError(f"expected ':' at {idx}")
+            idx = _WS.match(text, idx + 1).end()
+            value, end = _decoder.raw_decode(text, idx)
+            members[key] = value
+            token = text[idx:end]
+            if "\n" in token or "\r" in token:
+                raw.pop(key, None)
+            else:
+                raw[key] = token
+            idx = _WS.match(text, end).end()
+            sep, idx = text[idx:idx + 1], idx + 1
+            if sep == "}":
+                break
+            if sep != ",":
+                raise ValueError(f"expected ',' or '}}' at {idx - 1}")
+            idx = _WS.match(text, idx).end()
+    if _WS.match(text, idx).end() != len(text):
+        raise ValueError(f"extra data at {idx}")
+    return members, raw
@@ -0,0 +1,66 @@
+# convo_index.py — per-conversation byte-offset index over an NDJSON log
+import threading
+from records import parse
+from tombstones import is_retraction
+
+
+class ConvoIndex:
+    """convo id -> byte offsets of that conversation's entries in one log.
+
+    Plugged into a RollingLog as its indexer: the log calls on_append for
+    every line it writes and on_rewrite whenever it rewrites the file, both
+    while holding its own lock, so offsets always match the file. Lookups
+    (offsets, conversations) should be made through RollingLog.read_at so
+    they see the same state as the read. Retraction records are tracked so
+    retracted entries can be skipped without reading them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._offsets = {}      # convo -> [(offset, seq), ...] in file order
+        self._retracted = set()
+
+    def on_append(self, offset: int, line: str):
+        try:
+            record = parse(line)
+        except ValueError:
+            return
+        with self._lock:
+            self._add(offset, record)
+
+    def on_rewrite(self, entries):
+        """entries: (offset, line) for every line now in the file"""
+        with self._lock:
+            self._offsets = {}
+            self._retracted = set()
+            for offset, line in entries:
+                try:
+                    self._add(offset, parse(line))
+                except ValueError:
+                    continue
+
+    def _add(self, offset: int, record: dict):
+        if not isinstance(record, dict):
+            return
+        if is_retraction(record):
+            self._retracted.add(record.get("retracts"))
+            return
+        convo = record.get("convo")
+        if convo is not None:
+            self._offsets.setdefault(convo, []).append((offset, record.get("seq")))
+
+    def offsets(self, convo: str) -> list:
+        """Offsets of the conversation's live (unretracted) entries, oldest first"""
+        with self._lock:
+            return [off for off, seq in self._offsets.get(convo, ())
+                    if seq is None or seq not in self._retracted]
+
+    def conversations(self) -> dict:
+        """convo id -> number of live entries"""
+        with self._lock:
+            counts = {}
+            for convo, entries in self._offsets.items():
+                live = sum(1 for _, seq in entries if seq is None or seq not in self._retracted)
+                if live:
+                    counts[convo] = live
+            return counts
@@ -0,0 +1,167 @@
+# dedup_index.py — resident, time-expiring index of recent chat.log entries for duplicate checks
+import hashlib, sys
+from collections import deque
+from datetime import datetime
+
+
+def content_hash(content: str) -> int:
+    """Stable 64-bit digest of message content (same value across restarts)"""
+    digest = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def ts_epoch(ts: str) -> float:
+    return datetime.fromisoformat(ts).timestamp()
+
+
+def _intern(value):
+    """One shared copy of a repeated string (platform and role names)"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class DedupEntry:
+    """One chat.log entry as the duplicate rules see it"""
+    __slots__ = ("ts", "seq", "epoch", "platform", "role", "content", "digest", "historical", "removed",
+                 "fingerprint", "folded", "held")
+
+    def __init__(self, item: dict, epoch: float = None):
+        self.ts = item["ts"]
+        self.seq = item.get("seq")
+        self.epoch = ts_epoch(item["ts"]) if epoch is None else epoch
+        self.platform = _intern(item.get("platform"))
+        self.role = _intern(item["role"])
+        self.content = item["content"]
+        self.digest = content_hash(self.content)
+        signal_processing = (item.get("metadata") or {}).get("signalProcessing") or {}
+        self.historical = bool(signal_processing.get("isHistorical", False))
+        self.removed = False
+        self.held = False         # a streamed reply still in the hold-back, not yet in chat.log
+        self.fingerprint = None   # SimHash, when the index does near-duplicate lookups
+        # Case-folded once here for the echo checks, which search assistant
+        # replies for recent user messages
+        self.folded = self.content.casefold() if self.role == "user" else None
+
+    @property
+    def key(self):
+        return (self.platform, self.role, self.digest)
+
+
+class DedupIndex:
+    """Recent entries, in log order and by (platform, role, content hash).
+
+    Entries expire once they are older than `ttl` seconds or once more than
+    `max_entries` newer ones have been added, whichever comes first. Every
+    duplicate rule in log_msg reads from here, so a check is a dict lookup
+    or a walk over a handful of tail entries, with no disk I/O.
+
+    With a NearDupIndex as `near`, entries are also fingerprinted and
+    find_near() returns near-identical ones.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 50, near=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.near = near
+        self._entries = deque()     # oldest first, may hold removed entries
+        self._by_key = {}           # key -> list of live entries, oldest first
+        self._platforms = set()
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def seed(self, items):
+        """Load entries (oldest first), e.g. the resolved chat.log tail"""
+        for item in items:
+            try:
+                self.add(item)
+            except Exception:
+                continue
+
+    def add(self, item: dict, epoch: float = None, sketch=None) -> DedupEntry:
+        """Index item; sketch is a near_dup.Sketch of its content, if one was made already"""
+        entry = DedupEntry(item, epoch)
+        if self.near:
+            entry.fingerprint = self.near.fingerprint(entry.content, sketch)
+            self.near.add(entry, sketch.text if sketch is not None else None)
+        self._entries.append(entry)
+        self._by_key.setdefault(entry.key, []).append(entry)
+        self._platforms.add(entry.platform)
+        self._live += 1
+        self.expire(entry.epoch)
+        return entry
+
+    def remove(self, entry: DedupEntry):
+        """Forget an entry that was taken back out of chat.log"""
+        if entry.removed:
+            return
+        entry.removed = True
+        self._live -= 1
+        if self.near:
+            self.near.remove(entry)
+        bucket = self._by_key.get(entry.key)
+        if bucket:
+            bucket.remove(entry)
+            if not bucket:
+                del self._by_key[entry.key]
+
+    def expire(self, now: float):
+        cutoff = now - self.ttl
+        while self._entries and (self._live > self.max_entries or
+                                 self._entries[0].removed or
+                                 self._entries[0].epoch < cutoff):
+            self.remove(self._entries.popleft())
+
+    def find(self, role: str, content: str, platform=None) -> list:
+        """Live entries with exactly this content, oldest first.
+
+        platform=None searches every platform.
+        """
+        digest = content_hash(content)
+        platforms = [platform] if platform is not None else self._platforms
+        found = [e for p in platforms for e in self._by_key.get((p, role, digest), ())
+                 if e.content == content]
+        if len(platforms) > 1:
+            found.sort(key=lambda e: e.epoch)
+        return found
+
+    def find_near(self, role: str, content: str, platform, sketch=None) -> list:
+        """Live entries of this platform and role whose text nearly matches (see add for sketch)"""
+        if not self.near:
+            return []
+        if sketch is None:
+            return self.near.find(self.near.fingerprint(content), platform, role, content)
+        return self.near.find(self.near.fingerprint(content, sketch), platform, role, text=sketch.text)
+
+    def remove_seq(self, seq):
+        """remove() the live entry with this seq, if there is one"""
+        for entry in reversed(self._entries):
+            if entry.seq == seq and not entry.removed:
+                self.remove(entry)
+                return
+
+    def snapshot(self) -> list:
+        """Live entries as plain rows, oldest first (see restore); held ones are not in chat.log yet"""
+        return [[e.ts, e.seq, e.epoch, e.platform, e.role, e.content, e.historical]
+                for e in self._entries if not e.removed and not e.held]
+
+    def restore(self, rows):
+        """Re-add entries from snapshot(); fingerprints are recomputed"""
+        for ts, seq, epoch, platform, role, content, historical in rows:
+            self.add({"ts": ts, "seq": seq, "platform": platform, "role": role, "content": content,
+                      "metadata": {"signalProcessing": {"isHistorical": historical}}}, epoch)
+
+    def tail(self, n: int) -> list:
+        """The last n live entries, oldest first"""
+        out = []
+        for entry in reversed(self._entries):
+            if len(out) == n:
+                break
+            if not entry.removed:
+                out.append(entry)
+        out.reverse()
+        return out
+
+    def last(self):
+        tail = self.tail(1)
+        return tail[0] if tail else None
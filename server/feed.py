@@ -0,0 +1,102 @@
+# feed.py — in-process publish/subscribe of accepted chat.log records for the live feed
+import asyncio
+from collections import deque
+from tombstones import is_retraction
+
+
+class Subscription:
+    """One feed consumer: a bounded queue plus its filters"""
+    __slots__ = ("queue", "platform", "role", "lagged")
+
+    def __init__(self, queue_size: int, platform=None, role=None):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.platform = platform
+        self.role = role
+        self.lagged = False
+
+    def wants(self, record: dict) -> bool:
+        if is_retraction(record):
+            return True   # no platform/role on a tombstone; let the reader match it
+        return ((self.platform is None or record.get("platform") == self.platform) and
+                (self.role is None or record.get("role") == self.role))
+
+
+class Feed:
+    """Fan-out of every record that reaches chat.log (messages and retractions).
+
+    The last `history` records are kept so a subscriber can resume after a
+    seq it has already seen. Resume is by position in publish order, not by
+    comparing seqs: a held-back assistant reply is published after messages
+    with higher seqs, and must not be skipped.
+
+    Each subscriber has a queue of `queue_size` records. publish() never
+    waits: a subscriber whose queue is full is marked lagged and dropped, and
+    is expected to reconnect with the last seq it processed.
+
+    close() ends every subscription (each gets None from its queue); open
+    streams would otherwise hold up a graceful server shutdown.
+    """
+
+    def __init__(self, history: int = 1000, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._loop = None
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, record: dict):
+        self._history.append(record)
+        self.published += 1
+        for sub in list(self._subscribers):
+            if not sub.wants(record):
+                continue
+            try:
+                sub.queue.put_nowait(record)
+            except asyncio.QueueFull:
+                sub.lagged = True
+                self._subscribers.discard(sub)
+                self.dropped += 1
+
+    def subscribe(self, since: int = None, platform=None, role=None) -> Subscription:
+        """Register a subscriber, pre-loaded with what it missed after `since`"""
+        self._loop = asyncio.get_running_loop()
+        sub = Subscription(self.queue_size, platform, role)
+        if since is not None:
+            backlog = list(self._history)
+            for pos in range(len(backlog) - 1, -1, -1):
+                if backlog[pos].get("seq") == since:
+                    backlog = backlog[pos + 1:]
+                    break
+            else:
+                # since is older than the history (or unknown): send what we have
+                backlog = [r for r in backlog if (r.get("seq") or 0) > since]
+            for record in backlog:
+                if not sub.wants(record):
+                    continue
+                if sub.queue.full():
+                    sub.lagged = True
+                    return sub
+                sub.queue.put_nowait(record)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+    def close(self):
+        subscribers, self._subscribers = self._subscribers, set()
+        for sub in subscribers:
+            if sub.queue.full():
+                sub.queue.get_nowait()
+            sub.queue.put_nowait(None)
+
+    def close_soon(self):
+        """close() on the event loop; safe from a signal handler or another thread"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.close)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "published": self.published,
+                "dropped": self.dropped,
+                "max_queue_depth": max((s.queue.qsize() for s in self._subscribers), default=0)}
@@ -0,0 +1,260 @@
+# hot_window.py — compact columnar store for the latest messages held in memory
+#
+# The recent ring used to keep every message as the record dict ingest built:
+# the dict itself, its metadata dicts and lists, a ts string, and the cached
+# NDJSON line as both str and bytes. A message with 200 characters of text
+# took about 3 KB that way, roughly ten times its text on top of the text
+# itself. A HotWindow keeps it in about 470 bytes, which is about 220 bytes
+# plus the text: about 6x less in total, and 11-13x less besides the text
+# (bench/check_hot_memory.py). It keeps the same messages as
+#
+#   columns   array-backed, one slot per message: epoch (from ts), seq, id,
+#             platform and role codes, content hash
+#   HotRow    a __slots__ object with the rest: convo, content, urls and
+#             metadata (an OddRow also keeps any field no column can hold)
+#
+# Nested values are compacted (see compact()): objects become tuples whose
+# first item is their shared, interned key tuple, lists become tuples, and
+# short strings are interned, so repeated metadata keys, urls and flags cost
+# one pointer each. Records are rebuilt, with their original key order, only
+# when they are read.
+import sys
+from array import array
+from datetime import datetime
+from dedup_index import content_hash, ts_epoch
+
+MAX_CODES  = 255     # distinct platforms (and roles) with a column code; others go in the row
+MAX_SHAPES = 4096    # distinct key tuples shared between objects
+INTERN_MAX = 64      # strings up to this length are interned when compacted
+NO_VALUE   = -1      # seq or id column: None
+
+# The keys of the records ingest() builds, in its order
+RECORD_KEYS = ("ts", "seq", "id", "platform", "convo", "role", "content", "urls", "metadata")
+
+
+class _Shape(tuple):
+    """The keys of a compacted object; one instance per distinct key tuple"""
+    __slots__ = ()
+
+
+_EMPTY = (_Shape(),)
+_shapes = {}
+
+
+def _shape(keys: tuple) -> _Shape:
+    shape = _shapes.get(keys)
+    if shape is None:
+        shape = _Shape(sys.intern(k) if type(k) is str else k for k in keys)
+        if len(_shapes) < MAX_SHAPES:
+            _shapes[shape] = shape
+    return shape
+
+
+def compact(value):
+    """value (decoded JSON) as interned tuples; expand() gives it back"""
+    if isinstance(value, dict):
+        if not value:
+            return _EMPTY
+        return (_shape(tuple(value)),) + tuple(map(compact, value.values()))
+    if isinstance(value, list):
+        return tuple(map(compact, value))
+    if type(value) is str and len(value) <= INTERN_MAX:
+        return sys.intern(value)
+    return value
+
+
+def expand(value):
+    if type(value) is tuple:
+        if value and type(value[0]) is _Shape:
+            return dict(zip(value[0], map(expand, value[1:])))
+        return list(map(expand, value))
+    return value
+
+
+_RECORD_SHAPE = _shape(RECORD_KEYS)
+
+
+class Codes:
+    """Small-integer codes for a handful of repeated strings (platforms, roles)"""
+
+    def __init__(self, limit: int = MAX_CODES):
+        self.limit = limit
+        self._code = {}
+        self.values = []
+
+    def code(self, value):
+        """value's code, or None if value is not a string or the table is full"""
+        if type(value) is not str:
+            return None
+        code = self._code.get(value)
+        if code is None and len(self.values) < self.limit:
+            code = self._code[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return code
+
+
+class HotRow:
+    """The fields of one message that have no column"""
+    __slots__ = ("convo", "content", "urls", "metadata")
+
+
+class OddRow(HotRow):
+    """A HotRow for a record with other keys than ingest() builds, or values no column holds"""
+    __slots__ = ("keys", "extra")
+
+
+class HotWindow:
+    """The last `capacity` records, oldest first, stored as columns plus HotRows.
+
+    append() takes a record dict (any keys); latest() rebuilds dicts equal
+    to the ones appended. A column only takes a value it gives back exactly:
+    ts when its epoch converts back to the same string, seq when it is an
+    int, ids of the extension's "<platform>-<role>-<ms>" form as the number.
+    Anything else goes in the row's extra. A record whose content matches a
+    resident one (same hash and text) shares its string.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.epoch = array("d", bytes(8 * capacity))
+        self.seq = array("q", bytes(8 * capacity))
+        self.ids = array("q", bytes(8 * capacity))
+        self.platform = array("B", bytes(capacity))
+        self.role = array("B", bytes(capacity))
+        self.digest = array("Q", bytes(8 * capacity))
+        self.rows = [None] * capacity
+        self.platforms = Codes()
+        self.roles = Codes()
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, record: dict):
+        if self._len < self.capacity:
+            pos = (self._start + self._len) % self.capacity
+            self._len += 1
+        else:
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+            self.rows[pos] = None
+        extra = {key: compact(value) for key, value in record.items() if key not in _FIELDS}
+
+        ts = record.get("ts")
+        try:
+            epoch = ts_epoch(ts)
+            if datetime.fromtimestamp(epoch).isoformat(timespec="seconds") != ts:
+                raise ValueError(ts)
+        except (TypeError, ValueError, OverflowError):
+            epoch = float("nan")
+            if "ts" in record:
+                extra["ts"] = compact(ts)
+        self.epoch[pos] = epoch
+
+        seq = record.get("seq")
+        if seq is None or (type(seq) is int and 0 <= seq < 1 << 63):
+            self.seq[pos] = NO_VALUE if seq is None else seq
+        else:
+            self.seq[pos] = NO_VALUE
+            extra["seq"] = compact(seq)
+
+        coded = True
+        for key, codes, column in (("platform", self.platforms, self.platform),
+                                   ("role", self.roles, self.role)):
+            code = codes.code(record.get(key))
+            if code is None:
+                coded = False
+                column[pos] = MAX_CODES
+                if key in record:
+                    extra[key] = compact(record[key])
+            else:
+                column[pos] = code
+
+        id_ = record.get("id")
+        self.ids[pos] = NO_VALUE
+        if id_ is not None:
+            number = _id_number(id_, record["platform"], record["role"]) if coded else None
+            if number is None:
+                extra["id"] = compact(id_)
+            else:
+                self.ids[pos] = number
+
+        keys = _shape(tuple(record))
+        if extra or keys is not _RECORD_SHAPE:
+            row = OddRow()
+            row.keys, row.extra = keys, extra
+        else:
+            row = HotRow()
+        content = record.get("content")
+        self.digest[pos] = 0
+        if type(content) is str:
+            digest = content_hash(content)
+            row.content = self._shared(content, digest)
+            self.digest[pos] = digest
+        else:
+            row.content = compact(content)
+        row.convo = compact(record.get("convo"))
+        row.urls = compact(record.get("urls"))
+        row.metadata = compact(record.get("metadata"))
+        self.rows[pos] = row
+
+    def _shared(self, content: str, digest: int) -> str:
+        """content, or the equal string of a resident row with the same hash"""
+        try:
+            other = self.rows[self.digest.index(digest)]
+        except ValueError:
+            return content
+        return other.content if other is not None and other.content == content else content
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def record(self, pos: int) -> dict:
+        row = self.rows[pos]
+        if type(row) is HotRow:
+            return {key: _FIELDS[key](self, pos, row) for key in RECORD_KEYS}
+        extra = row.extra
+        return {key: expand(extra[key]) if key in extra else _FIELDS[key](self, pos, row)
+                for key in row.keys}
+
+    def positions(self, n: int = None) -> list:
+        """Ring positions of the last n records (all if None), oldest first"""
+        count = self._len if n is None else max(0, min(n, self._len))
+        first = self._start + self._len - count
+        return [(first + i) % self.capacity for i in range(count)]
+
+    def latest(self, n: int) -> list:
+        return [self.record(pos) for pos in self.positions(n)]
+
+
+def _id_number(id_, platform: str, role: str):
+    """The number in an id of the form "<platform>-<role>-<number>", if it has that form exactly"""
+    if type(id_) is not str or not id_.startswith(platform + "-" + role + "-"):
+        return None
+    digits = id_[len(platform) + len(role) + 2:]
+    if not (digits.isascii() and digits.isdigit()) or (digits[0] == "0" and len(digits) > 1):
+        return None
+    number = int(digits)
+    return number if number < 1 << 63 else None
+
+
+def _id_text(window, pos: int) -> str:
+    number = window.ids[pos]
+    if number == NO_VALUE:
+        return None
+    return f"{window.platforms.values[window.platform[pos]]}-{window.roles.values[window.role[pos]]}-{number}"
+
+
+_FIELDS = {
+    "ts": lambda w, pos, row: datetime.fromtimestamp(w.epoch[pos]).isoformat(timespec="seconds"),
+    "seq": lambda w, pos, row: None if w.seq[pos] == NO_VALUE else w.seq[pos],
+    "id": lambda w, pos, row: _id_text(w, pos),
+    "platform": lambda w, pos, row: w.platforms.values[w.platform[pos]],
+    "convo": lambda w, pos, row: expand(row.convo),
+    "role": lambda w, pos, row: w.roles.values[w.role[pos]],
+    "content": lambda w, pos, row: expand(row.content),
+    "urls": lambda w, pos, row: expand(row.urls),
+    "metadata": lambda w, pos, row: expand(row.metadata),
+}
@@ -0,0 +1,211 @@
+# idempotency.py — compact seen-set of client message ids for idempotent ingest
+import hashlib, json, math, mmap, os, struct
+from collections import deque
+from pathlib import Path
+from dedup_index import content_hash
+
+
+def message_key(msg_id: str, text: str) -> str:
+    """What SeenIds remembers for a message: its client id plus a hash of its text.
+
+    The extension's ids ("<platform>-<role>-<Date.now()>") only have
+    millisecond resolution, so two different messages can share one; only
+    the same id with the same text is a retransmission.
+    """
+    return f"{msg_id}:{content_hash(text if isinstance(text, str) else ''):016x}"
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (k hashes by double hashing)"""
+
+    def __init__(self, capacity: int, error_rate: float, bits: bytearray = None, count: int = 0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.m = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.m + 7) // 8)
+        self.count = count
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def add(self, key: str):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class SeenIds:
+    """Every client message id the server has taken in, within bounded memory.
+
+    Callers store message_key()s rather than bare ids.
+
+    Recent ids are kept exactly (a set plus insertion-order deque of
+    `recent` ids). Older ones live in two generations of Bloom filters:
+    when the current generation reaches `capacity` ids it becomes the
+    previous one and a fresh filter takes over, so the false-positive rate
+    stays at about `error_rate` and coverage spans the last 2 * capacity
+    ids. check_and_add() is O(1) either way.
+
+    The filters' bits are a memory mapping of `path` (two slots, one per
+    generation), so persisting them is flush(): the OS writes back only the
+    pages ids have touched since the last one. The file describes itself:
+    a header in front of the slots numbers each slot's generation and
+    counts its ids, and is updated along with the bits, so a rotation after
+    a checkpoint leaves it consistent. snapshot() is the small header a
+    checkpoint keeps (settings and current generation); passing it back as
+    `state` adopts the file, provided the file is at least as new. The
+    exact set is not saved, since the filters hold the same ids. Without a
+    path the mapping is anonymous and nothing outlives the process.
+    """
+
+    FORMAT = 3
+    # magic, then (generation, count) for each slot; generation 0 is an unused slot
+    _HEADER = struct.Struct("<8sQQQQ")
+    _HEADER_BYTES = 64
+    _MAGIC = b"SEENIDS3"
+
+    def __init__(self, path: Path = None, capacity: int = 200_000,
+                 error_rate: float = 1e-6, recent: int = 10_000, state: bytes = None):
+        """Raises ValueError if `state` does not fit `path` and these settings"""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.recent_max = recent
+        self._slot_bytes = len(BloomFilter(capacity, error_rate).bits)
+        size = self._HEADER_BYTES + 2 * self._slot_bytes
+        kept = False   # the file already held filters of this size
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                kept = os.fstat(fd).st_size == size
+                if not kept:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        self._view = memoryview(self._map)
+        start = self._HEADER_BYTES
+        self._slots = [self._view[start:start + self._slot_bytes], self._view[start + self._slot_bytes:]]
+        self._recent = set()
+        self._order = deque()
+        self.dirty = False
+        if state is None:
+            self._reset()
+            return
+        try:
+            if not kept:
+                raise ValueError("the filter file is missing or has another size")
+            self._adopt(json.loads(state))
+        except (ValueError, KeyError, TypeError) as e:
+            self.close()
+            raise ValueError(f"unusable seen-id state: {e}") from None
+
+    def _filter(self, slot: int, count: int = 0) -> BloomFilter:
+        return BloomFilter(self.capacity, self.error_rate, self._slots[slot], count)
+
+    def _write_header(self):
+        counts = [self._current.count, self._previous.count if self._previous else 0]
+        gens = [self._generation, self._generation - 1 if self._previous else 0]
+        if self._current_slot:
+            counts.reverse()
+            gens.reverse()
+        self._HEADER.pack_into(self._map, 0, self._MAGIC, gens[0], counts[0], gens[1], counts[1])
+
+    def _reset(self):
+        for slot in self._slots:
+            slot[:] = bytes(self._slot_bytes)
+        self._current_slot, self._generation = 0, 1
+        self._current = self._filter(0)
+        self._previous = None
+        self._write_header()
+
+    def _adopt(self, header: dict):
+        if (header.get("format") != self.FORMAT or header["capacity"] != self.capacity
+                or header["error_rate"] != self.error_rate):
+            raise ValueError("written with different settings")
+        magic, gen0, count0, gen1, count1 = self._HEADER.unpack_from(self._map, 0)
+        if magic != self._MAGIC:
+            raise ValueError("the filter file has no header")
+        slot = self._current_slot = 0 if gen0 >= gen1 else 1
+        self._generation, count = (gen0, count0) if slot == 0 else (gen1, count1)
+        if self._generation < header["generation"]:
+            raise ValueError("the filter file is older than the checkpoint")
+        self._current = self._filter(slot, count)
+        previous_gen, previous_count = (gen1, count1) if slot == 0 else (gen0, count0)
+        self._previous = (self._filter(1 - slot, previous_count)
+                          if previous_gen and previous_gen == self._generation - 1 else None)
+
+    def __contains__(self, msg_id: str) -> bool:
+        return (msg_id in self._recent or msg_id in self._current or
+                (self._previous is not None and msg_id in self._previous))
+
+    def add(self, msg_id: str):
+        self._recent.add(msg_id)
+        self._order.append(msg_id)
+        while len(self._order) > self.recent_max:
+            self._recent.discard(self._order.popleft())
+        if self._current.full:
+            # The previous generation's slot is cleared and takes over
+            slot = self._current_slot = 1 - self._current_slot
+            self._slots[slot][:] = bytes(self._slot_bytes)
+            self._previous, self._current = self._current, self._filter(slot)
+            self._generation += 1
+        self._current.add(msg_id)
+        self._write_header()
+        self.dirty = True
+
+    def check_and_add(self, msg_id: str) -> bool:
+        """True if msg_id was seen before; records it either way"""
+        if msg_id in self:
+            return True
+        self.add(msg_id)
+        return False
+
+    def __len__(self):
+        return self._current.count + (self._previous.count if self._previous else 0)
+
+    def stats(self) -> dict:
+        return {"ids": len(self), "recent_exact": len(self._recent),
+                "generations": 2 if self._previous else 1}
+
+    # -- persistence -------------------------------------------------------
+
+    def snapshot(self) -> bytes:
+        """Header for the checkpoint; flush() must reach the file before it is saved.
+
+        The generations and counts are read back from the file itself, so
+        ids added after this (even a rotation) do not make them disagree.
+        """
+        self.dirty = False
+        return json.dumps({
+            "format": self.FORMAT,
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "generation": self._generation,
+        }).encode("utf-8")
+
+    def flush(self):
+        """Write the filter pages changed since the last flush to the file (blocking)"""
+        self._map.flush()
+
+    def close(self):
+        self._current = self._previous = None
+        for view in self._slots + [self._view]:
+            view.release()
+        self._map.close()
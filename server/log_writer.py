@@ -0,0 +1,250 @@
+# log_writer.py — single writer thread that owns every ai-live-logger log file
+import asyncio, logging, queue, threading, time
+from pathlib import Path
+from logsetup import LOGGER_NAME
+from records import encode
+from rolling_log import RollingLog
+
+FSYNC_MODES = ("none", "interval", "always")
+_STOP = object()
+
+log = logging.getLogger(LOGGER_NAME + ".writer")
+
+
+class LogWriter:
+    """Write-behind queue in front of the RollingLogs.
+
+    Request handlers only enqueue; one thread takes records off a bounded
+    queue in batches (group commit): each batch costs one write + flush per
+    touched file. Durability is set by fsync_mode:
+
+      none      leave flushing to the OS
+      interval  fsync touched files at most every fsync_interval seconds
+      always    fsync after every group commit, before taking more work
+
+    Retraction records are appended like any other record; once
+    `compact_after` of them have gone into a log, the writer rewrites it
+    through the log's compact hook.
+
+    stop() drains everything still queued before returning.
+    """
+
+    def __init__(self, max_queue: int = 10000, fsync_mode: str = "interval",
+                 fsync_interval: float = 1.0, max_batch: int = 512,
+                 compact_after: int = 32):
+        if fsync_mode not in FSYNC_MODES:
+            raise ValueError(f"fsync_mode must be one of {FSYNC_MODES}, got {fsync_mode!r}")
+        self.max_queue = max_queue
+        self.fsync_mode = fsync_mode
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.compact_after = compact_after
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._logs = {}
+        self._archives = {}       # path -> stores that also receive every line appended to it
+        self._dirty = set()       # logs written since the last fsync
+        self._retractions = {}    # path -> retractions appended since last rewrite
+        self._last_sync = time.monotonic()
+        self._thread = None
+        self.batches = 0
+        self.records = 0
+        self._bytes_written = {}  # file name -> bytes appended by this writer
+        self._stats_lock = threading.Lock()   # the writer thread updates _bytes_written while others read it
+
+    # -- setup / lifecycle -------------------------------------------------
+
+    def log(self, path: Path, max_lines: int = None, compact=None, indexer=None,
+            archive=None) -> RollingLog:
+        """Register (or return) the RollingLog for path; the writer owns it.
+
+        archive (e.g. a SegmentStore, or a list of such consumers) gets a
+        copy of every line appended to the log, in the same commit, and is
+        never trimmed.
+        """
+        log = self._logs.get(path)
+        if log is None:
+            log = self._logs[path] = RollingLog(path, max_lines, background_trim=False,
+                                                compact=compact, indexer=indexer)
+            archives = archive if isinstance(archive, (list, tuple)) else [archive]
+            archives = [a for a in archives if a is not None]
+            if archives:
+                self._archives[path] = archives
+        return log
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Drain the queue, fsync and close every log"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self._drain_inline()
+        for log in list(self._logs.values()) + [a for archives in self._archives.values() for a in archives]:
+            log.sync()
+            log.close()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "queue_max": self.max_queue,
+            "fsync_mode": self.fsync_mode,
+            "batches": self.batches,
+            "records": self.records,
+        }
+
+    def bytes_written(self) -> dict:
+        """Copy of file name -> bytes appended so far, safe to read from any thread"""
+        with self._stats_lock:
+            return dict(self._bytes_written)
+
+    # -- producers ---------------------------------------------------------
+
+    async def append(self, path: Path, item: dict):
+        await self._put(("append", path, item))
+
+    async def retract(self, path: Path, tombstone: dict):
+        """Append a retraction record; counts towards the next compaction"""
+        await self._put(("retract", path, tombstone))
+
+    async def call(self, path: Path, method: str, *args):
+        """Run a RollingLog method (remove, remove_last, ...) in queue order"""
+        await self._put(("call", path, (method, args)))
+
+    def batch(self) -> "LogBatch":
+        return LogBatch(self)
+
+    async def submit(self, ops: list):
+        """Enqueue several ops as one record so they share a group commit"""
+        if ops:
+            await self._put(("batch", None, ops))
+
+    async def _put(self, op):
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            # Back-pressure: wait for room without blocking the event loop
+            await asyncio.to_thread(self._queue.put, op)
+
+    # -- writer thread -----------------------------------------------------
+
+    def _run(self):
+        while True:
+            timeout = self.fsync_interval if self._dirty else None
+            try:
+                op = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._maybe_sync()
+                continue
+            batch = [op]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            self._commit([op for op in batch if op is not _STOP])
+            if stop:
+                self._drain_inline()
+                return
+
+    def _drain_inline(self):
+        while True:
+            try:
+                op = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if op is not _STOP:
+                self._commit([op])
+
+    def _commit(self, batch):
+        ops = []
+        for op in batch:
+            if op[0] == "batch":
+                ops.extend(op[2])
+            else:
+                ops.append(op)
+        pending = {}      # path -> serialized lines (records.Line), in arrival order
+        for kind, path, arg in ops:
+            if kind in ("append", "retract"):
+                pending.setdefault(path, []).append(encode(arg))
+                if kind == "retract":
+                    self._retractions[path] = self._retractions.get(path, 0) + 1
+                continue
+            # A rewrite must see every append queued before it
+            self._flush(pending)
+            method, args = arg
+            try:
+                getattr(self._logs[path], method)(*args)
+            except Exception as e:
+                log.error("LOG WRITER ERROR: %s on %s: %s", method, path.name, e)
+            self._dirty.add(path)
+        self._flush(pending)
+        self.batches += 1
+        self.records += len(ops)
+        for path, log in self._logs.items():
+            if log.needs_trim or self._retractions.get(path, 0) >= self.compact_after:
+                log.trim()
+                self._retractions[path] = 0
+        self._maybe_sync(force=self.fsync_mode == "always")
+
+    def _flush(self, pending):
+        for path, lines in pending.items():
+            try:
+                written = self._logs[path].append_lines(lines)
+                with self._stats_lock:
+                    self._bytes_written[path.name] = self._bytes_written.get(path.name, 0) + written
+            except Exception as e:
+                log.error("LOG WRITER ERROR: append to %s: %s", path.name, e)
+            for archive in self._archives.get(path, ()):
+                try:
+                    archive.append_lines(lines)
+                except Exception as e:
+                    log.error("LOG WRITER ERROR: archive of %s: %s", path.name, e)
+            self._dirty.add(path)
+        pending.clear()
+
+    def _maybe_sync(self, force: bool = False):
+        if not self._dirty or self.fsync_mode == "none":
+            self._dirty.clear()
+            return
+        if force or time.monotonic() - self._last_sync >= self.fsync_interval:
+            for path in self._dirty:
+                self._logs[path].sync()
+                for archive in self._archives.get(path, ()):
+                    archive.sync()
+            self._dirty.clear()
+            self._last_sync = time.monotonic()
+
+
+class LogBatch:
+    """Collects writes (same interface as LogWriter) and submits them at once.
+
+    Used by the batch ingest endpoint: everything a request produces goes to
+    the writer thread as a single queue record, so it lands in one write per
+    file, in the order it was produced.
+    """
+
+    def __init__(self, writer: LogWriter):
+        self.writer = writer
+        self.ops = []
+
+    async def append(self, path: Path, item: dict):
+        self.ops.append(("append", path, item))
+
+    async def retract(self, path: Path, tombstone: dict):
+        self.ops.append(("retract", path, tombstone))
+
+    async def call(self, path: Path, method: str, *args):
+        self.ops.append(("call", path, (method, args)))
+
+    async def commit(self):
+        ops, self.ops = self.ops, []
+        await self.writer.submit(ops)
@@ -0,0 +1,69 @@
+# logsetup.py — leveled, queue-backed logging for the ai-live-logger server
+#
+# Everything logs through the "ai-live-logger" logger with %-style arguments,
+# so a message below the configured level is never formatted. Records that
+# pass are handed to a queue; a listener thread does the actual console and
+# file writes, off the event loop.
+import json, logging, logging.handlers, queue, sys
+from datetime import datetime
+from pathlib import Path
+
+LOGGER_NAME = "ai-live-logger"
+
+# Attributes every LogRecord has; anything else came in through extra=
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, including any extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "WARNING", jsonl_path: Path = None,
+                      jsonl_level: str = "DEBUG") -> logging.handlers.QueueListener:
+    """Install the queue handler and start the listener thread.
+
+    level       console level; per-message traces are DEBUG, the one-line
+                summary per logged message is INFO
+    jsonl_path  optional JSON-lines sink for structured diagnostics
+    jsonl_level level for that sink (may be lower than the console's)
+
+    Returns the listener; call .stop() on shutdown to flush it.
+    """
+    # Windows consoles can't encode every character users paste into chats
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(errors="backslashreplace")
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(level)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    handlers = [console]
+    levels = [console.level]
+    if jsonl_path:
+        sink = logging.FileHandler(jsonl_path, encoding="utf-8")
+        sink.setLevel(jsonl_level)
+        sink.setFormatter(JsonLinesFormatter())
+        handlers.append(sink)
+        levels.append(sink.level)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+    logger.setLevel(min(levels))
+    logger.propagate = False
+    listener.start()
+    return listener
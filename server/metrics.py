@@ -0,0 +1,136 @@
+# metrics.py — minimal in-process counters/histograms rendered in Prometheus text format
+import functools, time
+from bisect import bisect_left
+
+# Seconds; tuned for a local server where most requests take well under 10ms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels (inc(rule="css")).
+
+    Like Histogram, meant to be updated from the event loop only.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {} if self.labels else {(): 0}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _labels(self.labels, key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, **labels):
+        """Decorator: observe the run time of an async function"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, **labels)
+            return timed
+        return decorate
+
+    def samples(self):
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (self.name + "_bucket",
+                       _labels(self.labels + ("le",), key + (le,)), cumulative)
+            yield self.name + "_sum", _labels(self.labels, key), series[-1]
+            yield self.name + "_count", _labels(self.labels, key), cumulative
+
+
+class Collected:
+    """Counter or gauge whose values are read from `fn` at scrape time.
+
+    fn returns a number, or a dict of label value (or tuple of values) ->
+    number. Used for state other components already keep (queue depths,
+    the writer thread's byte counts), so the hot path records nothing.
+    """
+
+    def __init__(self, name: str, help: str, fn, labels=(), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            yield self.name, "", values
+            return
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield self.name, _labels(self.labels, key), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name: str, help: str, fn, labels=(), kind: str = "gauge") -> Collected:
+        return self.register(Collected(name, help, fn, labels, kind))
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format (version 0.0.4)"""
+        out = []
+        for metric in self._metrics:
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                out.append(f"{name}{labels} {value!r}")
+        return "\n".join(out) + "\n"
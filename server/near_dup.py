@@ -0,0 +1,173 @@
+# near_dup.py — SimHash fingerprints + banded LSH lookup for near-identical messages
+import hashlib, re
+from itertools import islice
+
+# Button labels the DOM scraper sometimes picks up at the end of a message
+_BUTTON_SUFFIX = re.compile(r"(?:\s*\b(?:retry|share|copy|edit)\b)+\s*$")
+
+_MASK64 = (1 << 64) - 1
+_LANE = 16                      # bits per counter in the packed accumulator
+_MAX_TOKENS = (1 << _LANE) - 1  # ...so at most this many shingles are counted
+# _SPREAD[byte] puts each of the byte's 8 bits into its own _LANE-bit counter
+_SPREAD = [sum(((b >> i) & 1) << (_LANE * i) for i in range(8)) for b in range(256)]
+_BYTE_SHIFT = 8 * _LANE
+
+
+def normalize(content: str) -> str:
+    """Case-folded, whitespace-collapsed text without trailing button labels"""
+    text = " ".join(content.casefold().split())
+    return _BUTTON_SUFFIX.sub("", text)
+
+
+def shingles(text: str):
+    """Word bigrams of normalized text (the single word of a one-word text)"""
+    words = text.split()
+    return zip(words, words[1:]) if len(words) > 1 else ((w,) for w in words)
+
+
+def _shingle_hash(shingle: tuple) -> int:
+    return int.from_bytes(hashlib.blake2b(" ".join(shingle).encode("utf-8", "surrogatepass"),
+                                          digest_size=8).digest(), "little")
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of the word bigrams of normalized text.
+
+    Every shingle's 64 hash bits are counted at once in one packed integer
+    (one 16-bit lane per bit), so the cost is a few integer operations per
+    shingle rather than 64. Shingles are hashed with blake2b, so a text has
+    the same fingerprint in every process and across restarts.
+    """
+    acc = 0
+    n = 0
+    spread = _SPREAD
+    for shingle in islice(shingles(text), _MAX_TOKENS):
+        h = _shingle_hash(shingle)
+        acc += (spread[h & 255] |
+                spread[(h >> 8) & 255] << _BYTE_SHIFT |
+                spread[(h >> 16) & 255] << 2 * _BYTE_SHIFT |
+                spread[(h >> 24) & 255] << 3 * _BYTE_SHIFT |
+                spread[(h >> 32) & 255] << 4 * _BYTE_SHIFT |
+                spread[(h >> 40) & 255] << 5 * _BYTE_SHIFT |
+                spread[(h >> 48) & 255] << 6 * _BYTE_SHIFT |
+                spread[h >> 56] << 7 * _BYTE_SHIFT)
+        n += 1
+    fingerprint = 0
+    lane_mask = (1 << _LANE) - 1
+    for bit in range(64):
+        if 2 * ((acc >> (_LANE * bit)) & lane_mask) > n:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class Sketch:
+    """A message text as near-duplicate lookups see it: normalized, its word count and SimHash.
+
+    It depends on nothing but the text, so it can be made anywhere (an
+    ingest worker makes one before forwarding a message) and passed to
+    NearDupIndex in place of the content.
+    """
+
+    __slots__ = ("text", "words", "simhash")
+
+    def __init__(self, content: str):
+        self.text = normalize(content)
+        self.words = self.text.count(" ") + 1
+        self.simhash = simhash(self.text)
+
+
+def similarity(a: str, b: str) -> float:
+    """Share of word bigrams two normalized texts have in common (Jaccard)"""
+    return _jaccard(set(shingles(a)), set(shingles(b)))
+
+
+def _jaccard(first: set, second: set) -> float:
+    return len(first & second) / len(first | second) if first or second else 1.0
+
+
+class NearDupIndex:
+    """LSH over SimHash fingerprints: finds entries within `max_distance` bits.
+
+    The 64-bit fingerprint is split into max_distance + 1 bands; two
+    fingerprints that differ in at most max_distance bits must agree on at
+    least one whole band, so looking up each band of the query finds every
+    candidate without comparing against the whole window. Only entries of
+    the same platform and role are compared. Entries are anything with
+    `fingerprint`, `platform`, `role` and `content` attributes (see
+    DedupEntry) and are added and removed by their owner; the index keeps
+    each one's set of bigrams for the similarity check below.
+
+    A few bits of SimHash distance cannot tell a scraping artifact from a
+    one-word edit of a short message (2 of its 15 bigrams change, often 5
+    bits or fewer), so given the query's content find() also requires
+    `min_similarity` of the bigrams to be shared. At 0.95 a one-word edit
+    matches only in messages of 40 words or more (80 if the word is not at
+    either end, since then two bigrams change).
+    """
+
+    def __init__(self, max_distance: int = 6, min_words: int = 8, min_similarity: float = 0.95):
+        self.max_distance = max_distance
+        self.min_words = min_words
+        self.min_similarity = min_similarity
+        bands = max_distance + 1
+        width = 64 // bands
+        self._bands = [(i * width, (1 << (width if i < bands - 1 else 64 - i * width)) - 1)
+                       for i in range(bands)]
+        self._buckets = {}   # (band no, band value, platform, role) -> list of entries
+        self._shingles = {}  # id(entry) -> set of the bigrams of its normalized content
+
+    def fingerprint(self, content: str, sketch: Sketch = None):
+        """SimHash of content (or of its sketch), or None if it is too short to compare reliably"""
+        if sketch is None:
+            text = normalize(content)
+            if text.count(" ") + 1 < self.min_words:
+                return None
+            return simhash(text)
+        return sketch.simhash if sketch.words >= self.min_words else None
+
+    def _keys(self, fingerprint: int, platform, role):
+        for band, (shift, mask) in enumerate(self._bands):
+            yield (band, (fingerprint >> shift) & mask, platform, role)
+
+    def add(self, entry, text: str = None):
+        """Index entry; text is its normalized content, if already at hand"""
+        if entry.fingerprint is None:
+            return
+        self._shingles[id(entry)] = set(shingles(normalize(entry.content) if text is None else text))
+        for bucket_key in self._keys(entry.fingerprint, entry.platform, entry.role):
+            self._buckets.setdefault(bucket_key, []).append(entry)
+
+    def remove(self, entry):
+        if entry.fingerprint is None:
+            return
+        self._shingles.pop(id(entry), None)
+        for bucket_key in self._keys(entry.fingerprint, entry.platform, entry.role):
+            bucket = self._buckets.get(bucket_key)
+            if bucket and entry in bucket:
+                bucket.remove(entry)
+                if not bucket:
+                    del self._buckets[bucket_key]
+
+    def find(self, fingerprint: int, platform, role, content: str = None, text: str = None) -> list:
+        """Entries of this platform and role within max_distance bits of fingerprint
+        (and, given the query's content or its normalized text, sharing min_similarity of its bigrams)"""
+        if fingerprint is None:
+            return []
+        if text is None and content is not None:
+            text = normalize(content)
+        query = set(shingles(text)) if text is not None else None
+        seen = set()
+        found = []
+        for bucket_key in self._keys(fingerprint, platform, role):
+            for entry in self._buckets.get(bucket_key, ()):
+                if id(entry) not in seen:
+                    seen.add(id(entry))
+                    if (hamming(entry.fingerprint, fingerprint) <= self.max_distance and
+                            (query is None or
+                             _jaccard(self._shingles[id(entry)], query) >= self.min_similarity)):
+                        found.append(entry)
+        return found
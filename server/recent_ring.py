@@ -0,0 +1,85 @@
+# recent_ring.py — in-memory ring of the latest messages behind GET /recent
+import asyncio, os
+from pathlib import Path
+from hot_window import HotWindow
+from records import encode
+
+
+class RecentRing:
+    """The last `capacity` messages, newest last, with a change version.
+
+    `version` goes up by one per push; etag() combines it with a per-process
+    boot id so a client cache never matches across restarts. wait() lets a
+    long-poll sleep until something newer than a given version arrives.
+    Messages are held compactly (see hot_window.HotWindow); latest() returns
+    fresh dicts equal to the ones pushed.
+    """
+
+    def __init__(self, capacity: int = 200, boot_id: str = None):
+        self._items = HotWindow(capacity)
+        self.version = 0
+        self.boot_id = boot_id or os.urandom(4).hex()
+        self._changed = None   # asyncio.Event for the current version
+        self._loop = None
+        self._closed = False
+
+    def push(self, item: dict):
+        self._items.append(item)
+        self.version += 1
+        self._wake()
+
+    def seed(self, items):
+        """Load messages (oldest first) without waking anyone"""
+        self._items.extend(items)
+
+    def latest(self, n: int) -> list:
+        return self._items.latest(n) if n > 0 else []
+
+    def etag(self) -> str:
+        return f'"{self.boot_id}-{self.version}"'
+
+    async def wait(self, version: int, timeout: float) -> bool:
+        """Wait up to timeout seconds for a push after `version`; True if one came"""
+        if self.version != version:
+            return True
+        if self._closed:
+            return False
+        self._loop = asyncio.get_running_loop()
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.version != version
+
+    def _wake(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def close(self):
+        """Release every long-poll (used on shutdown)"""
+        self._closed = True
+        self._wake()
+
+    def close_soon(self):
+        """close() on the event loop; safe from a signal handler or another thread"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.close)
+        else:
+            self._closed = True
+
+    @staticmethod
+    def write_mirror(path: Path, items: list):
+        """Write items to path as NDJSON (atomically); runs fine off the event loop"""
+        data = "".join(encode(item) + "\n" for item in items)
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data.encode("utf-8", "replace"))
+        try:
+            os.replace(tmp, path)
+        except PermissionError:
+            # Windows refuses to replace a file another process has open
+            path.write_bytes(data.encode("utf-8", "replace"))
+            tmp.unlink(missing_ok=True)
@@ -0,0 +1,76 @@
+# records.py — log records that are serialized once and shared by every sink
+#
+# A message used to be re-encoded with json.dumps for each file it went to
+# (chatverbose.log, chat.log, /feed, recent.ndjson), and the history, search
+# and conversation indexes parsed every chat.log line back again. Now:
+#
+#   Record               the item dict; line() builds its NDJSON line once
+#                        (through codec), splicing raw member text from the
+#                        request body in verbatim when the decoder kept it
+#   Line                 that line as a str, carrying its UTF-8 bytes and the
+#                        Record it came from, so the writer's sinks write the
+#                        same bytes object and read fields without parsing
+import json
+import codec
+
+
+class Line(str):
+    """One serialized record (no trailing newline) with its bytes and record attached"""
+
+    def __new__(cls, text: str, record: dict, data: bytes = None):
+        line = super().__new__(cls, text)
+        line.data = data + b"\n" if data is not None else (text + "\n").encode("utf-8", "replace")
+        line.record = record
+        return line
+
+    @classmethod
+    def of(cls, record: dict) -> "Line":
+        data = codec.dumps(record)
+        return cls(data.decode("utf-8"), record, data)
+
+
+class Record(dict):
+    """A log record that serializes itself once.
+
+    `raw` maps keys to JSON text taken verbatim from the request body; those
+    values are spliced into the line as they are. Setting a key drops its raw
+    text and the cached line. Nested values must not be changed in place:
+    assign a new value to the key instead.
+    """
+
+    __slots__ = ("raw", "_line")
+
+    def __init__(self, *args, raw: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.raw = raw or {}
+        self._line = None
+
+    def __setitem__(self, key, value):
+        self._line = None
+        self.raw.pop(key, None)
+        super().__setitem__(key, value)
+
+    def line(self) -> Line:
+        if self._line is None:
+            raw = self.raw
+            if raw:
+                text = "{" + ", ".join(
+                    json.dumps(key) + ": " + (raw[key] if key in raw else json.dumps(value, ensure_ascii=False))
+                    for key, value in self.items()) + "}"
+                self._line = Line(text, self)
+            else:
+                self._line = Line.of(self)
+        return self._line
+
+
+def encode(record: dict) -> Line:
+    """The NDJSON line for any record; cached when it is a Record"""
+    if isinstance(record, Record):
+        return record.line()
+    return Line.of(record)
+
+
+def parse(line: str) -> dict:
+    """The record behind a line, without parsing it again if it is a Line"""
+    return line.record if isinstance(line, Line) else codec.loads(line)
+
@@ -0,0 +1,186 @@
+# rolling_log.py — O(1) append NDJSON writer with lazy retention for ai-live-logger
+import os, threading
+from collections import deque
+from pathlib import Path
+from records import Line, encode
+
+
+class RollingLog:
+    """NDJSON file that keeps (roughly) the last `max_lines` entries.
+
+    Appends go straight to the end of the file, so each message costs one
+    small write no matter how big the file is. Retention is enforced lazily:
+    once the file holds `slack` lines more than `max_lines` it is rewritten
+    from the in-memory tail, either by a background thread or, with
+    background_trim=False, by whoever owns the log (see LogWriter) when
+    needs_trim says so. The rewrite goes to a temp file that is swapped in
+    with os.replace, so readers see either the old or the new file, never a
+    half-written one.
+
+    If `compact` is given it is applied to the retained lines on every
+    rewrite (see tombstones.compact_lines). If `indexer` is given it is told
+    the byte offset of every line appended (on_append) and of every line
+    after a rewrite (on_rewrite), under the log's lock (see ConvoIndex).
+    """
+
+    def __init__(self, path: Path, max_lines: int, slack: int = None,
+                 background_trim: bool = True, compact=None, indexer=None):
+        self.path = Path(path)
+        self.max_lines = max_lines
+        self.slack = slack if slack is not None else max(max_lines, 16)
+        self.background_trim = background_trim
+        self.compact = compact
+        self.indexer = indexer
+        self._lock = threading.RLock()
+        self._tail = deque(maxlen=max_lines)   # last max_lines serialized lines
+        self._count = 0                        # lines physically in the file
+        self._size = 0                         # bytes in the file
+        self._trimming = False
+        self._fh = None
+        self._load()
+
+    def _load(self):
+        needs_rewrite = False
+        if self.path.exists():
+            text = self.path.read_text(encoding="utf-8", errors="replace")
+            lines = [ln for ln in text.splitlines() if ln.strip()]
+            self._tail.extend(lines)
+            self._count = len(lines)
+            # Normalise files left behind by older versions (blank lines,
+            # missing trailing newline, over the retention limit)
+            needs_rewrite = (self._count > self.max_lines or
+                             (text and text != "\n".join(lines) + "\n"))
+        if needs_rewrite:
+            self._rewrite()
+            return
+        self._fh = open(self.path, "ab")
+        self._size = self._fh.tell()
+        if self.indexer:
+            # The tail is the end of the file, so work the offsets out backwards
+            entries = []
+            offset = self._size
+            for line in reversed(self._tail):
+                offset -= len((line + "\n").encode("utf-8", "replace"))
+                entries.append((offset, line))
+            entries.reverse()
+            self.indexer.on_rewrite(entries)
+
+    def append(self, item: dict):
+        self.append_line(encode(item))
+
+    def append_line(self, line: str):
+        self.append_lines([line])
+
+    def append_lines(self, lines: list) -> int:
+        """Append serialized lines with a single write; returns bytes written"""
+        chunks = [ln.data if isinstance(ln, Line) else (ln + "\n").encode("utf-8", "replace") for ln in lines]
+        data = b"".join(chunks)
+        with self._lock:
+            self._fh.write(data)
+            self._fh.flush()
+            if self.indexer:
+                offset = self._size
+                for line, chunk in zip(lines, chunks):
+                    self.indexer.on_append(offset, line)
+                    offset += len(chunk)
+            self._size += len(data)
+            self._tail.extend(lines)
+            self._count += len(lines)
+            if self.background_trim and self.needs_trim and not self._trimming:
+                self._trimming = True
+                threading.Thread(target=self.trim, daemon=True).start()
+        return len(data)
+
+    @property
+    def needs_trim(self) -> bool:
+        return self._count >= self.max_lines + self.slack
+
+    def sync(self):
+        """fsync the file so everything appended so far survives a crash"""
+        with self._lock:
+            if self._fh:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+
+    def read_at(self, offsets) -> list:
+        """Read the lines starting at the given byte offsets.
+
+        offsets may be a callable; it is then evaluated under the log's lock
+        so an indexer lookup and the read see the same version of the file.
+        """
+        with self._lock:
+            if callable(offsets):
+                offsets = offsets()
+            out = []
+            with open(self.path, "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    out.append(f.readline().decode("utf-8", "replace").rstrip("\n"))
+            return out
+
+    def lines(self) -> list:
+        """Snapshot of the retained lines, oldest first."""
+        with self._lock:
+            return list(self._tail)
+
+    def trim(self):
+        """Drop everything but the last max_lines lines from the file."""
+        with self._lock:
+            self._rewrite()
+            self._trimming = False
+
+    def remove(self, predicate) -> int:
+        """Rewrite the file without the retained lines matching predicate(line)."""
+        with self._lock:
+            kept = [ln for ln in self._tail if not predicate(ln)]
+            removed = len(self._tail) - len(kept)
+            if removed:
+                self._tail.clear()
+                self._tail.extend(kept)
+                self._rewrite()
+            return removed
+
+    def remove_last(self) -> bool:
+        """Rewrite the file without its last line."""
+        with self._lock:
+            if not self._tail:
+                return False
+            self._tail.pop()
+            self._rewrite()
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+
+    def _rewrite(self):
+        # Caller holds the lock (or we're still in __init__)
+        if self.compact:
+            kept = self.compact(list(self._tail))
+            self._tail.clear()
+            self._tail.extend(kept)
+        chunks = [ln.data if isinstance(ln, Line) else (ln + "\n").encode("utf-8", "replace") for ln in self._tail]
+        data = b"".join(chunks)
+        if self._fh:
+            self._fh.close()
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_bytes(data)
+        try:
+            os.replace(tmp, self.path)
+        except PermissionError:
+            # Windows refuses to replace a file another process has open;
+            # fall back to rewriting it in place
+            self.path.write_bytes(data)
+            tmp.unlink(missing_ok=True)
+        self._count = len(self._tail)
+        self._size = len(data)
+        self._fh = open(self.path, "ab")
+        if self.indexer:
+            entries = []
+            offset = 0
+            for line, chunk in zip(self._tail, chunks):
+                entries.append((offset, line))
+                offset += len(chunk)
+            self.indexer.on_rewrite(entries)
@@ -0,0 +1,449 @@
+# search_index.py — incremental inverted index with BM25 ranking over chat.log messages
+import json, math, mmap, os, re, threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from heapq import nlargest
+from operator import itemgetter
+from pathlib import Path
+from records import parse
+from tombstones import is_retraction
+
+_TOKEN = re.compile(r"\w+")
+MAX_TOKEN_LEN = 40
+MAX_TF = 0xFFFF
+MANIFEST = "manifest.json"
+DOCS = "docs.ndjson"
+# Per-document columns, doc id = position; appended to doc-<name>.bin at each flush
+COLUMNS = {"seq": "q", "epoch": "d", "platform": "H", "role": "H", "length": "I", "offset": "Q"}
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN.findall(text.casefold()) if 1 < len(t) <= MAX_TOKEN_LEN]
+
+
+def snippet(content: str, terms, width: int = 160) -> str:
+    """About `width` characters of content around the first query term"""
+    text = " ".join(content.split())
+    match = re.search("|".join(re.escape(t) for t in terms), text, re.IGNORECASE) if terms else None
+    start = max(0, (match.start() if match else 0) - width // 3)
+    end = min(len(text), start + width)
+    start = max(0, min(start, end - width))
+    return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+def _json_bytes(obj) -> bytes:
+    # Lone surrogates (a string cut in the middle of an emoji) become "?",
+    # as they do in chat.log
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8", "replace")
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class _Segment:
+    """One immutable on-disk segment: term dictionary + memory-mapped postings.
+
+    seg-NNNNNN.post holds every posting list's doc ids (uint32) followed by
+    their term frequencies (uint16), term by term; seg-NNNNNN.terms maps each
+    term to [start, df] in both arrays. Doc ids are global, so a segment
+    covers the range [base, base + count).
+    """
+    __slots__ = ("name", "base", "count", "terms", "_file", "_mm", "ids", "tfs")
+
+    def __init__(self, root: Path, name: str):
+        meta = json.loads((root / f"{name}.terms").read_bytes())
+        self.name = name
+        self.base = meta["base"]
+        self.count = meta["count"]
+        self.terms = meta["terms"]
+        total = meta["postings"]
+        self._file = self._mm = None
+        self.ids = self.tfs = memoryview(b"")
+        if total:
+            self._file = open(root / f"{name}.post", "rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self._mm)
+            self.ids = view[:4 * total].cast("I")
+            self.tfs = view[4 * total:6 * total].cast("H")
+
+    def postings(self, term: str):
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        start, df = entry
+        return self.ids[start:start + df], self.tfs[start:start + df]
+
+    def close(self):
+        try:
+            self.ids.release()
+            self.tfs.release()
+            if self._mm is not None:
+                self._mm.close()
+        except BufferError:
+            pass   # a slice is still referenced somewhere; the GC closes it
+        if self._file is not None:
+            self._file.close()
+
+
+def _write_segment(root: Path, name: str, base: int, count: int, postings):
+    """Write (term, ids, tfs) triples, sorted by term, as segment `name`"""
+    ids_out, tfs_out = array("I"), array("H")
+    terms = {}
+    for term, ids, tfs in postings:
+        terms[term] = [len(ids_out), len(ids)]
+        ids_out.frombytes(ids.tobytes())
+        tfs_out.frombytes(tfs.tobytes())
+    _write_atomic(root / f"{name}.post", ids_out.tobytes() + tfs_out.tobytes())
+    meta = {"base": base, "count": count, "postings": len(ids_out), "terms": terms}
+    _write_atomic(root / f"{name}.terms", _json_bytes(meta))
+
+
+class SearchIndex:
+    """BM25 full-text search over chat.log messages, maintained at ingest.
+
+    Plugged into the LogWriter as an archive of chat.log, so append_lines()
+    runs on the writer thread with every committed batch. New messages go
+    to an in-memory segment (term -> array-backed postings); every
+    `flush_docs` messages it is written out as an immutable segment whose
+    postings are memory-mapped. When `merge_factor` segments of the same
+    size tier pile up at the end they are merged into one, so a search
+    touches O(log n) segments. Message text is kept in docs.ndjson for
+    snippets; per-message fields used for ranking and filtering live in
+    compact columns.
+
+    Retractions mark their target deleted; deleted messages are skipped at
+    query time. The in-memory segment is written out on close(); after a
+    crash it is rebuilt by catch_up() from the history store.
+    """
+
+    k1 = 1.2
+    b = 0.75
+    # Terms in more than this fraction of messages (and at least
+    # common_postings of them) only re-score messages that a rarer query term
+    # already matched, when there is one: the long posting lists are probed
+    # by bisection instead of walked
+    common_fraction = 0.1
+    common_postings = 5000
+    # A query of nothing but common terms ranks the newest walk_limit
+    # messages containing the rarest of them
+    walk_limit = 10_000
+
+    def __init__(self, root: Path, flush_docs: int = 10_000, merge_factor: int = 4):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.flush_docs = flush_docs
+        self.merge_factor = merge_factor
+        self._lock = threading.RLock()
+        self._segments = []
+        self._live = {}            # term -> (array of doc ids, array of tfs)
+        self._live_base = 0
+        self._deleted = set()
+        self._load()
+
+    def _load(self):
+        try:
+            manifest = json.loads((self.root / MANIFEST).read_bytes())
+        except FileNotFoundError:
+            manifest = {}
+        count = manifest.get("docs", 0)
+        self._columns = {}
+        for name, code in COLUMNS.items():
+            column = array(code)
+            path = self.root / f"doc-{name}.bin"
+            if path.exists():
+                column.frombytes(path.read_bytes()[:count * column.itemsize])
+            self._columns[name] = column
+        # Anything past what the manifest covers is from a segment that was
+        # never completed; drop it (catch_up re-indexes those messages)
+        for name in COLUMNS:
+            path = self.root / f"doc-{name}.bin"
+            if path.exists() and path.stat().st_size > count * self._columns[name].itemsize:
+                os.truncate(path, count * self._columns[name].itemsize)
+        self._docs_bytes = manifest.get("docs_bytes", 0)
+        docs = self.root / DOCS
+        if docs.exists() and docs.stat().st_size > self._docs_bytes:
+            os.truncate(docs, self._docs_bytes)
+        self._docs = open(docs, "ab")
+        self._platforms = manifest.get("platforms", [])
+        self._roles = manifest.get("roles", [])
+        self._codes = ({p: i for i, p in enumerate(self._platforms)}, {r: i for i, r in enumerate(self._roles)})
+        self._deleted = set(manifest.get("deleted", []))
+        self._next_segment = manifest.get("next_segment", 1)
+        self._segments = [_Segment(self.root, name) for name in manifest.get("segments", [])]
+        self._live_base = count
+        self._total_length = sum(self._columns["length"])
+
+    def _save_manifest(self):
+        manifest = {
+            "segments": [s.name for s in self._segments],
+            "next_segment": self._next_segment,
+            "docs": self._live_base,
+            "docs_bytes": self._docs_bytes,
+            "platforms": self._platforms,
+            "roles": self._roles,
+            "deleted": sorted(self._deleted),
+        }
+        _write_atomic(self.root / MANIFEST, _json_bytes(manifest))
+
+    # -- write side (writer thread) ---------------------------------------
+
+    def _code(self, which: int, value) -> int:
+        codes, names = self._codes[which], (self._platforms, self._roles)[which]
+        value = value or ""
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def append_lines(self, lines: list) -> int:
+        added = 0
+        with self._lock:
+            for line in lines:
+                try:
+                    record = parse(line)
+                except ValueError:
+                    continue
+                if is_retraction(record):
+                    self._retract(record.get("retracts"))
+                elif record.get("content"):
+                    self._add(record)
+                    added += 1
+            self._docs.flush()
+        if len(self._columns["seq"]) - self._live_base >= self.flush_docs:
+            self.flush()
+        return added
+
+    def _add(self, record: dict):
+        # Caller holds the lock. Everything that can fail runs before the
+        # postings and columns are touched, so they always agree on doc ids
+        content = record["content"]
+        tfs = {}
+        for token in tokenize(content):
+            tfs[token] = tfs.get(token, 0) + 1
+        try:
+            epoch = datetime.fromisoformat(record.get("ts") or "").timestamp()
+        except ValueError:
+            epoch = 0.0
+        seq = int(record.get("seq") or 0)
+        line = _json_bytes({"seq": record.get("seq"), "ts": record.get("ts"), "platform": record.get("platform"),
+                            "role": record.get("role"), "convo": record.get("convo"), "content": content}) + b"\n"
+        platform, role = self._code(0, record.get("platform")), self._code(1, record.get("role"))
+        offset = self._docs.tell()
+        self._docs.write(line)
+        columns = self._columns
+        doc = len(columns["seq"])
+        for term, tf in tfs.items():
+            postings = self._live.get(term)
+            if postings is None:
+                postings = self._live[term] = (array("I"), array("H"))
+            postings[0].append(doc)
+            postings[1].append(min(tf, MAX_TF))
+        columns["seq"].append(seq)
+        columns["epoch"].append(epoch)
+        columns["platform"].append(platform)
+        columns["role"].append(role)
+        columns["length"].append(sum(tfs.values()))
+        columns["offset"].append(offset)
+        self._total_length += columns["length"][-1]
+
+    def _retract(self, seq, lookback: int = 10_000):
+        # Targets are recent, and logs written before held replies took their
+        # seq at commit are only roughly in seq order, so look back linearly
+        # rather than bisect
+        if seq is None:
+            return
+        seqs = self._columns["seq"]
+        for doc in range(len(seqs) - 1, max(-1, len(seqs) - 1 - lookback), -1):
+            if seqs[doc] == seq:
+                self._deleted.add(doc)
+                return
+
+    def flush(self):
+        """Write the in-memory segment out and merge the tail segments as due"""
+        with self._lock:
+            count = len(self._columns["seq"]) - self._live_base
+            if count <= 0:
+                return
+            name = f"seg-{self._next_segment:06d}"
+            self._next_segment += 1
+            _write_segment(self.root, name, self._live_base, count,
+                           ((term, *self._live[term]) for term in sorted(self._live)))
+            for column_name, column in self._columns.items():
+                with open(self.root / f"doc-{column_name}.bin", "ab") as f:
+                    f.write(column[self._live_base:].tobytes())
+            self._docs.flush()
+            self._docs_bytes = self._docs.tell()
+            self._segments.append(_Segment(self.root, name))
+            self._live = {}
+            self._live_base += count
+            self._save_manifest()
+        self._merge_tail()
+
+    def _tier(self, segment: _Segment) -> int:
+        tier, size = 0, self.flush_docs * self.merge_factor
+        while segment.count >= size:
+            tier += 1
+            size *= self.merge_factor
+        return tier
+
+    def _merge_tail(self):
+        while True:
+            tail = self._segments[-self.merge_factor:]
+            if len(tail) < self.merge_factor or len({self._tier(s) for s in tail}) > 1:
+                return
+            name = f"seg-{self._next_segment:06d}"
+            self._next_segment += 1
+            terms = sorted(set().union(*(s.terms for s in tail)))
+
+            def merged():
+                # Segments are consecutive doc id ranges, so concatenating
+                # each term's postings keeps them sorted
+                for term in terms:
+                    ids, tfs = array("I"), array("H")
+                    for segment in tail:
+                        found = segment.postings(term)
+                        if found:
+                            ids.frombytes(found[0].tobytes())
+                            tfs.frombytes(found[1].tobytes())
+                    yield term, ids, tfs
+
+            _write_segment(self.root, name, tail[0].base, sum(s.count for s in tail), merged())
+            with self._lock:
+                self._segments[-self.merge_factor:] = [_Segment(self.root, name)]
+                self._save_manifest()
+                for segment in tail:
+                    segment.close()
+            for segment in tail:
+                for suffix in (".post", ".terms"):
+                    (self.root / f"{segment.name}{suffix}").unlink(missing_ok=True)
+
+    def catch_up(self, store) -> int:
+        """Index what a MessageStore holds past the last flush (after a crash)"""
+        known = set()
+        since = None
+        epochs, seqs = self._columns["epoch"], self._columns["seq"]
+        if epochs:
+            # A minute of overlap covers records written slightly out of ts
+            # order (a held reply keeps the ts it arrived with); the ones
+            # already indexed are skipped by seq
+            cutoff = epochs[-1] - 60
+            since = datetime.fromtimestamp(cutoff).isoformat(timespec="seconds")
+            for doc in range(len(seqs) - 1, -1, -1):
+                if epochs[doc] < cutoff:
+                    break
+                known.add(seqs[doc])
+        lines = [json.dumps(r, ensure_ascii=False) for r in store.records(since)
+                 if is_retraction(r) or r.get("seq") not in known]
+        if lines:
+            self.append_lines(lines)
+        return len(lines)
+
+    def sync(self):
+        with self._lock:
+            self._docs.flush()
+            os.fsync(self._docs.fileno())
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._save_manifest()
+            self._docs.close()
+            for segment in self._segments:
+                segment.close()
+
+    # -- read side -----------------------------------------------------------
+
+    def _sources(self, term: str) -> list:
+        """(base, ids, tfs) for term in every segment that has it, oldest first"""
+        out = []
+        for segment in self._segments:
+            found = segment.postings(term)
+            if found:
+                out.append((segment.base, *found))
+        live = self._live.get(term)
+        if live:
+            out.append((self._live_base, *live))
+        return out
+
+    def search(self, query: str, platform: str = None, role: str = None, since: str = None,
+               limit: int = 20) -> list:
+        """Top `limit` messages for query by BM25, with snippets, best first"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        since_epoch = datetime.fromisoformat(since).timestamp() if since else None
+        with self._lock:
+            platform_code = self._codes[0].get(platform, -1) if platform is not None else None
+            role_code = self._codes[1].get(role, -1) if role is not None else None
+            if platform_code == -1 or role_code == -1:
+                return []
+            columns = self._columns
+            lengths, epochs = columns["length"], columns["epoch"]
+            platforms, roles, deleted = columns["platform"], columns["role"], self._deleted
+            n = len(lengths) - len(deleted)
+            if n <= 0:
+                return []
+            k1, avgdl = self.k1, self._total_length / len(lengths) or 1.0
+            norm_a, norm_b = k1 * (1 - self.b), k1 * self.b / avgdl
+            per_term = [(self._sources(term), term) for term in terms]
+            per_term.sort(key=lambda entry: sum(len(ids) for _, ids, _ in entry[0]))
+            scores = {}
+            for sources, term in per_term:
+                df = sum(len(ids) for _, ids, _ in sources)
+                if not df:
+                    continue
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5)) * (k1 + 1)
+                common = df > max(n * self.common_fraction, self.common_postings)
+                if scores and common:
+                    bases = [base for base, _, _ in sources]
+                    for doc in scores:
+                        base_at = bisect_right(bases, doc) - 1
+                        if base_at < 0:
+                            continue
+                        _, ids, tfs = sources[base_at]
+                        i = bisect_left(ids, doc)
+                        if i < len(ids) and ids[i] == doc:
+                            tf = tfs[i]
+                            scores[doc] += idf * tf / (tf + norm_a + norm_b * lengths[doc])
+                    continue
+                budget = self.walk_limit if common else None
+                for _, ids, tfs in (reversed(sources) if common else sources):
+                    if budget is not None:
+                        if budget <= 0:
+                            break
+                        ids, tfs = ids[-budget:], tfs[-budget:]
+                        budget -= len(ids)
+                    for doc, tf in zip(ids, tfs):
+                        score = scores.get(doc)
+                        if score is None:
+                            if (doc in deleted or
+                                    (platform_code is not None and platforms[doc] != platform_code) or
+                                    (role_code is not None and roles[doc] != role_code) or
+                                    (since_epoch is not None and epochs[doc] < since_epoch)):
+                                continue
+                            score = 0.0
+                        scores[doc] = score + idf * tf / (tf + norm_a + norm_b * lengths[doc])
+            top = nlargest(limit, scores.items(), key=itemgetter(1))
+            offsets = [columns["offset"][doc] for doc, _ in top]
+        hits = []
+        with open(self.root / DOCS, "rb") as f:
+            for (doc, score), offset in zip(top, offsets):
+                f.seek(offset)
+                record = json.loads(f.readline())
+                content = record.pop("content")
+                hits.append(dict(record, score=round(score, 4), snippet=snippet(content, terms)))
+        return hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "messages": len(self._columns["seq"]),
+                "deleted": len(self._deleted),
+                "segments": len(self._segments),
+                "unflushed": len(self._columns["seq"]) - self._live_base,
+            }
@@ -0,0 +1,684 @@
+# segments.py — tiered, append-only archive of chat.log records (hot / sealed / compressed segments)
+import gzip, json, os, re, struct, threading, time, zlib
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from codec import loads
+from records import Line
+from storage import MessageStore
+from tombstones import is_retraction
+
+try:
+    import zstandard
+except ImportError:   # optional; gzip is always available
+    zstandard = None
+
+ACTIVE = "active.ndjson"
+BLOCK_BYTES = 64 << 10               # sparse index: one entry per block of about this many bytes
+_SEGMENT_RE = re.compile(r"^seg-(\d{6,})\.ndjson(\.gz|\.zst)?$")
+_INDEX_SUBFIELD = b"AL"              # gzip FEXTRA subfield id holding the index (older files)
+_ZSTD_SKIPPABLE = 0x184D2A50         # zstd skippable frame magic holding the index
+_FEXTRA, _FNAME, _FCOMMENT = 0x04, 0x08, 0x10
+
+
+def _new_index() -> dict:
+    # blocks: [min ts, max ts, offset in the NDJSON, offset of its compressed
+    # form (past the index header) or None] per BLOCK_BYTES of records.
+    # retracts: seqs retracted by tombstones in this segment
+    # convos: conversation id -> offsets of its records in the NDJSON
+    # (missing from indexes written before it existed: read every block)
+    return {"count": 0, "first_ts": None, "last_ts": None, "first_seq": None, "last_seq": None,
+            "bytes": 0, "blocks": [], "retracts": [], "convos": {}}
+
+
+def _parse(line: bytes):
+    try:
+        record = loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def _scan_index(data: bytes, index: dict = None, offset: int = 0) -> dict:
+    """Index (counts, ts/seq range, sparse block offsets, retractions) of NDJSON bytes.
+
+    With index, extends it by data, which starts at `offset` in the file.
+    """
+    index = index or _new_index()
+    for line in data.splitlines(keepends=True):
+        _extend_index(index, _parse(line), offset, len(line))
+        offset += len(line)
+    return index
+
+
+def _extend_index(index: dict, record, offset: int, length: int):
+    blocks = index["blocks"]
+    if not blocks or offset - blocks[-1][2] >= BLOCK_BYTES:
+        blocks.append([None, None, offset, offset])
+    index["bytes"] = offset + length
+    if record is None:
+        return
+    index["count"] += 1
+    ts, seq = record.get("ts"), record.get("seq")
+    if ts:
+        index["first_ts"] = index["first_ts"] or ts
+        index["last_ts"] = ts
+        block = blocks[-1]
+        block[0] = ts if block[0] is None or ts < block[0] else block[0]
+        block[1] = ts if block[1] is None or ts > block[1] else block[1]
+    if seq is not None:
+        index["first_seq"] = index["first_seq"] if index["first_seq"] is not None else seq
+        index["last_seq"] = seq
+    if is_retraction(record) and record.get("retracts") is not None:
+        index["retracts"].append(record["retracts"])
+    convo = record.get("convo")
+    if isinstance(convo, str) and "convos" in index:
+        index["convos"].setdefault(convo, []).append(offset)
+
+
+# -- cold segment formats ---------------------------------------------------
+# Both are standard files (zcat / zstdcat read them). Each block of the
+# index is compressed on its own (a gzip member / zstd frame) so one block
+# can be read without the rest, and the index travels in a part of the
+# format decompressors skip: the gzip header's comment field, or a zstd
+# skippable frame in front of the data.
+
+def _with_block_offsets(data: bytes, index: dict, compress, start: int) -> tuple:
+    blocks = [list(b) for b in index["blocks"]]
+    bounds = [b[2] for b in blocks] + [len(data)]
+    parts, offset = [], start
+    for i, block in enumerate(blocks):
+        part = compress(data[bounds[i]:bounds[i + 1]])
+        block[3] = offset
+        offset += len(part)
+        parts.append(part)
+    return dict(index, blocks=blocks), parts
+
+
+def _write_gzip(path: Path, data: bytes, index: dict, level: int = 6) -> dict:
+    # An empty first member carries the index; the blocks follow as members
+    empty = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS).flush() + struct.pack("<II", 0, 0)
+    index, members = _with_block_offsets(data, index, lambda block: gzip.compress(block, level, mtime=0),
+                                         len(empty))
+    meta = json.dumps(index).encode("ascii")
+    header = b"\x1f\x8b\x08" + bytes([_FCOMMENT]) + struct.pack("<I", int(time.time())) + b"\x00\xff"
+    path.write_bytes(header + meta + b"\x00" + empty + b"".join(members))
+    return index
+
+
+def _read_gzip_index(f) -> tuple:
+    """(index, offset the block offsets are relative to) from a gzip segment's header"""
+    head = f.read(10)
+    if head[:2] != b"\x1f\x8b":
+        raise ValueError("not a gzip segment")
+    flags, pos, index = head[3], 10, None
+    if flags & _FEXTRA:
+        xlen = struct.unpack("<H", f.read(2))[0]
+        extra = f.read(xlen)
+        pos += 2 + xlen
+        at = 0
+        while at + 4 <= len(extra):
+            sub_id, sub_len = extra[at:at + 2], struct.unpack("<H", extra[at + 2:at + 4])[0]
+            if sub_id == _INDEX_SUBFIELD:
+                index = json.loads(extra[at + 4:at + 4 + sub_len])
+            at += 4 + sub_len
+    for flag in (_FNAME, _FCOMMENT):
+        if flags & flag:
+            field = bytearray()
+            while (ch := f.read(1)) not in (b"\x00", b""):
+                field += ch
+            pos += len(field) + 1
+            if flag == _FCOMMENT:
+                index = json.loads(field)
+    if index is None:
+        raise ValueError("no index in gzip header")
+    return index, pos
+
+
+def _write_zstd(path: Path, data: bytes, index: dict, level: int = 3) -> dict:
+    compressor = zstandard.ZstdCompressor(level=level)
+    index, frames = _with_block_offsets(data, index, compressor.compress, 0)
+    meta = json.dumps(index).encode("ascii")
+    path.write_bytes(struct.pack("<II", _ZSTD_SKIPPABLE, len(meta)) + meta + b"".join(frames))
+    return index
+
+
+def _read_zstd_index(f) -> tuple:
+    magic, size = struct.unpack("<II", f.read(8))
+    if magic != _ZSTD_SKIPPABLE:
+        raise ValueError("no index frame in zstd segment")
+    return json.loads(f.read(size)), 8 + size
+
+
+# suffix, write(path, data, index) -> index, read index(file) -> (index, data start),
+# decompress(bytes past the index)
+CODECS = {
+    "gzip": (".gz", _write_gzip, _read_gzip_index, lambda raw: zlib.decompress(raw, 16 + zlib.MAX_WBITS)),
+    "zstd": (".zst", _write_zstd, _read_zstd_index,
+             lambda raw: zstandard.ZstdDecompressor().decompressobj().decompress(raw)),
+}
+
+
+class Segment:
+    """One sealed or cold segment file and its index"""
+    __slots__ = ("number", "path", "codec", "index", "data_start")
+
+    def __init__(self, number: int, path: Path, codec: str = None, index: dict = None, data_start: int = 0):
+        self.number = number
+        self.path = path
+        self.codec = codec        # None for an uncompressed (sealed) segment
+        self.index = index
+        self.data_start = data_start
+
+    def overlaps(self, since: str = None, until: str = None) -> bool:
+        first, last = self.index.get("first_ts"), self.index.get("last_ts")
+        if first is None:
+            return self.index.get("count", 0) > 0
+        return (since is None or last >= since) and (until is None or first <= until)
+
+    def _legacy(self) -> bool:
+        # Cold files written before blocks were compressed separately
+        blocks = self.index["blocks"]
+        return self.codec is not None and bool(blocks) and blocks[0][3] is None
+
+    def read(self) -> bytes:
+        if self.codec is None:
+            return self.path.read_bytes()
+        if self._legacy():
+            raw = self.path.read_bytes()
+            if self.codec == "zstd":
+                raw = raw[self.data_start:]
+            return CODECS[self.codec][3](raw)
+        return b"".join(self.read_block(i) for i in range(len(self.index["blocks"])))
+
+    def read_block(self, i: int) -> bytes:
+        """The NDJSON bytes of block i, reading (and decompressing) only that block"""
+        blocks = self.index["blocks"]
+        start = blocks[i][2]
+        end = blocks[i + 1][2] if i + 1 < len(blocks) else self.index["bytes"]
+        if self._legacy():
+            return self.read()[start:end]
+        with open(self.path, "rb") as f:
+            if self.codec is None:
+                f.seek(start)
+                return f.read(end - start)
+            stored = blocks[i][3]
+            f.seek(self.data_start + stored)
+            raw = f.read(blocks[i + 1][3] - stored if i + 1 < len(blocks) else -1)
+        return CODECS[self.codec][3](raw)
+
+
+class SegmentStore(MessageStore):
+    """Append-only history in three tiers under one directory.
+
+      hot     active.ndjson, appended to like any other log (O(1) per batch)
+      sealed  seg-NNNNNN.ndjson, the active segment once it reaches
+              `max_bytes` or `max_age` seconds since its first record
+      cold    seg-NNNNNN.ndjson.gz (or .zst), sealed segments beyond the
+              newest `keep_sealed`, compressed with their index (record
+              count, ts and seq range, sparse block offsets) stored in the
+              file header
+
+    Every segment's index has an entry per BLOCK_BYTES of records (ts range
+    and byte offset), and cold segments compress each block separately, so
+    page() reads only the blocks it returns records from. records() walks
+    the tiers oldest first and skips whole segments whose ts range is
+    outside the query; query(convo=...) parses only the records each
+    segment's conversation index lists for it. Writes come from one thread
+    (the LogWriter); readers may run concurrently from others. Compression
+    runs on a background thread of its own, so writes never wait for it;
+    the cold file replaces the sealed one once it is complete.
+    """
+
+    # index_state: what index_state() returned at the end of the previous
+    # run (via a checkpoint). Indexes of sealed segments whose size still
+    # matches are reused, and the active segment's index is only extended by
+    # the records written after it, instead of scanning the files again.
+
+    # How far out of ts order records can be in the file (the stream
+    # hold-back commits a reply after later records); page() stops scanning
+    # forward once blocks start this far past `until`
+    ts_slack = 60
+
+    def __init__(self, root: Path, max_bytes: int = 8 << 20, max_age: float = 86400,
+                 keep_sealed: int = 2, codec: str = "gzip", index_state: dict = None):
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {tuple(CODECS)}, got {codec!r}")
+        if codec == "zstd" and zstandard is None:
+            raise ValueError("codec 'zstd' needs the zstandard package")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep_sealed = keep_sealed
+        self.codec = codec
+        self._lock = threading.Lock()
+        self._segments = []       # sealed and cold, oldest first
+        self._compressor = None   # the thread compressing sealed segments, while one runs
+        self._closing = False
+        self._load(index_state or {})
+
+    def _load(self, state: dict):
+        cached = state.get("sealed", {})
+        for path in sorted(self.root.iterdir()):
+            match = _SEGMENT_RE.match(path.name)
+            if not match:
+                continue
+            number, suffix = int(match.group(1)), match.group(2)
+            codec = {".gz": "gzip", ".zst": "zstd", None: None}[suffix]
+            try:
+                if codec is None:
+                    index = cached.get(path.name)
+                    if (index is None or index.get("bytes") != path.stat().st_size or
+                            "convos" not in index):
+                        index = _scan_index(path.read_bytes())
+                    segment = Segment(number, path, None, index)
+                else:
+                    with open(path, "rb") as f:
+                        index, data_start = CODECS[codec][2](f)
+                    segment = Segment(number, path, codec, index, data_start)
+                    if "blocks" not in index:
+                        # Older cold file: one compressed stream, index without
+                        # blocks; index it now, blocks are read by decompressing it
+                        segment.index = {"blocks": [[None, None, 0, None]]}
+                        index = _scan_index(segment.read())
+                        for block in index["blocks"]:
+                            block[3] = None
+                        segment.index = index
+            except Exception:
+                continue   # unreadable segment: leave it alone, don't serve it
+            self._segments.append(segment)
+        # A crash (or a reader holding the file on Windows) between writing a
+        # cold file and deleting its sealed twin leaves both; the cold file
+        # only exists once complete, so keep that one
+        by_number = {}
+        for segment in self._segments:
+            kept = by_number.get(segment.number)
+            if kept is None:
+                by_number[segment.number] = segment
+                continue
+            sealed, cold = (kept, segment) if kept.codec is None else (segment, kept)
+            sealed.path.unlink(missing_ok=True)
+            by_number[segment.number] = cold
+        self._segments = sorted(by_number.values(), key=lambda s: s.number)
+        active = self.root / ACTIVE
+        self._active_index = self._resume_index(active, state.get("active"))
+        first_ts = self._active_index["first_ts"]
+        self._active_started = (datetime.fromisoformat(first_ts).timestamp() if first_ts else
+                                active.stat().st_mtime if self._active_index["count"] else None)
+        self._fh = open(active, "ab")
+        self._size = self._fh.tell()
+
+    @staticmethod
+    def _resume_index(active: Path, index: dict) -> dict:
+        if not active.exists():
+            return _new_index()
+        with open(active, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # Reuse a checkpointed index only for the same file: it must not
+            # have shrunk, and must still start with the same record
+            first = _parse(f.readline()) or {}
+            if (not index or not index["bytes"] or index["bytes"] > size or "convos" not in index or
+                    (first.get("seq"), first.get("ts")) != (index["first_seq"], index["first_ts"])):
+                f.seek(0)
+                return _scan_index(f.read())
+            f.seek(index["bytes"])
+            return _scan_index(f.read(), index, index["bytes"])
+
+    def index_state(self) -> dict:
+        """Indexes of the uncompressed segments, for the next start (see __init__)"""
+        with self._lock:
+            active = self._active_index
+            state = {"sealed": {s.path.name: s.index for s in self._segments if s.codec is None},
+                     "active": dict(active, blocks=[list(b) for b in active["blocks"]],
+                                    retracts=list(active["retracts"]))}
+            if "convos" in active:
+                state["active"]["convos"] = {c: list(n) for c, n in active["convos"].items()}
+            return state
+
+    def position(self) -> str:
+        with self._lock:
+            return f"{self._active_number()}:{self._size}"
+
+    def records_after(self, cursor: str):
+        number, offset = self._cursor(cursor)
+        for part, index in self._parts():
+            if part < number:
+                continue
+            blocks = index["blocks"]
+            first = max(0, bisect_right([b[2] for b in blocks], offset) - 1) if part == number else 0
+            for i in range(first, len(blocks)):
+                for start, _, record in self._lines(part, index, i):
+                    if record is not None and (part > number or start >= offset):
+                        yield record
+
+    def _active_number(self) -> int:
+        # The number the active segment will get when sealed; cursors use it
+        return (self._segments[-1].number + 1) if self._segments else 1
+
+    # -- write side (writer thread) ---------------------------------------
+
+    def append_lines(self, lines: list) -> int:
+        encoded = [ln.data if isinstance(ln, Line) else (ln + "\n").encode("utf-8", "replace") for ln in lines]
+        data = b"".join(encoded)
+        with self._lock:
+            self._fh.write(data)
+            self._fh.flush()
+            offset = self._size
+            self._size += len(data)
+            if self._active_started is None:
+                self._active_started = time.time()
+            for line, chunk in zip(lines, encoded):
+                record = line.record if isinstance(line, Line) else _parse(chunk)
+                _extend_index(self._active_index, record, offset, len(chunk))
+                offset += len(chunk)
+        self.maintain()
+        return len(data)
+
+    def maintain(self):
+        """Roll the active segment over, and start compressing old sealed ones, as due"""
+        with self._lock:
+            due = self._size >= self.max_bytes or (
+                self._active_started is not None and time.time() - self._active_started >= self.max_age)
+            if due and self._size:
+                self._seal()
+            if self._compressor is None and not self._closing and self._to_compress():
+                self._compressor = threading.Thread(target=self._compress_due, name="segment-compress",
+                                                    daemon=True)
+                self._compressor.start()
+
+    def _to_compress(self) -> list:
+        # Caller holds the lock
+        sealed = [s for s in self._segments if s.codec is None]
+        return sealed[:max(0, len(sealed) - self.keep_sealed)]
+
+    def _compress_due(self):
+        # Compression thread; also takes segments sealed while it runs
+        try:
+            while True:
+                with self._lock:
+                    due = self._to_compress()
+                if not due or self._closing:
+                    return
+                self._compress(due[0])
+        finally:
+            with self._lock:
+                self._compressor = None
+
+    def _seal(self):
+        # Caller holds the lock
+        number = self._active_number()
+        path = self.root / f"seg-{number:06d}.ndjson"
+        self._fh.close()
+        os.replace(self.root / ACTIVE, path)
+        self._segments.append(Segment(number, path, None, self._active_index))
+        self._fh = open(self.root / ACTIVE, "ab")
+        self._size = 0
+        self._active_index = _new_index()
+        self._active_started = None
+
+    def _compress(self, segment: Segment):
+        suffix, write, read_index, _ = CODECS[self.codec]
+        cold = segment.path.with_name(segment.path.name + suffix)
+        tmp = cold.with_name(cold.name + ".tmp")
+        index = write(tmp, segment.path.read_bytes(), segment.index)
+        with open(tmp, "rb") as f:
+            _, data_start = read_index(f)
+        os.replace(tmp, cold)
+        old_path = segment.path
+        with self._lock:
+            segment.path, segment.codec = cold, self.codec
+            segment.index, segment.data_start = index, data_start
+        try:
+            old_path.unlink()
+        except PermissionError:
+            pass   # a reader has it open (Windows); _load cleans it up next start
+
+    def sync(self):
+        with self._lock:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        """Close the active segment, once a compression under way has finished"""
+        with self._lock:
+            self._closing = True
+            compressor = self._compressor
+        if compressor is not None:
+            compressor.join()   # the rest are compressed by the next run
+        with self._lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+
+    # -- read side ---------------------------------------------------------
+
+    def segments(self) -> list:
+        """Index of every segment, oldest first, the active one last"""
+        def summary(index: dict, **extra) -> dict:
+            out = {k: v for k, v in index.items() if k not in ("blocks", "retracts", "convos")}
+            return dict(out, blocks=len(index["blocks"]), retractions=len(index["retracts"]),
+                        conversations=len(index["convos"]) if "convos" in index else None, **extra)
+
+        with self._lock:
+            out = [summary(s.index, segment=s.path.name, tier="cold" if s.codec else "sealed")
+                   for s in self._segments]
+            out.append(summary(self._active_index, segment=ACTIVE, tier="hot"))
+        return out
+
+    def describe(self) -> dict:
+        return {"backend": "ndjson", "segments": self.segments()}
+
+    def _snapshot(self, since: str = None, until: str = None) -> tuple:
+        with self._lock:
+            segments = [(s, s.path, s.codec) for s in self._segments if s.overlaps(since, until)]
+            # The active segment is at most max_bytes; read it now so a
+            # rollover can't slip between this snapshot and the read
+            with open(self.root / ACTIVE, "rb") as f:
+                active = f.read(self._size)
+        return segments, active
+
+    @staticmethod
+    def _read(segment: Segment, path: Path, codec: str) -> bytes:
+        try:
+            return Segment(segment.number, path, codec, segment.index, segment.data_start).read()
+        except FileNotFoundError:
+            return segment.read()   # compressed while we were getting here
+
+    def records(self, since: str = None, until: str = None):
+        """Yield archived records (oldest first) with since <= ts <= until"""
+        segments, active = self._snapshot(since, until)
+        for segment, path, codec in segments:
+            yield from self._filter(self._read(segment, path, codec), since, until)
+        yield from self._filter(active, since, until)
+
+    def tail(self, n: int) -> list:
+        return self.page(limit=n)["messages"] if n > 0 else []
+
+    def query(self, since: str = None, until: str = None, platform: str = None,
+              role: str = None, convo: str = None, limit: int = 0) -> list:
+        """As MessageStore.query; with convo, parses only the records its index lists for it"""
+        if convo is None:
+            return super().query(since, until, platform, role, convo, limit)
+        parts = self._parts()
+        retracted = set().union(*(index["retracts"] for _, index in parts))
+        out = []
+        for number, index in parts:
+            for record in self._convo_records(number, index, convo, since, until):
+                if (record is None or is_retraction(record) or record.get("convo") != convo or
+                        (record.get("seq") is not None and record.get("seq") in retracted) or
+                        (since and (record.get("ts") or "") < since) or
+                        (until and (record.get("ts") or "") > until) or
+                        (platform is not None and record.get("platform") != platform) or
+                        (role is not None and record.get("role") != role)):
+                    continue
+                out.append(record)
+                if limit > 0 and len(out) == limit:
+                    return out
+        return out
+
+    def _convo_records(self, number: int, index: dict, convo: str, since, until):
+        """Records of one segment that may belong to convo (every record if it has no convo index)"""
+        blocks = index["blocks"]
+        convos = index.get("convos")
+        if convos is None:
+            for i in range(len(blocks)):
+                for _, _, record in self._lines(number, index, i):
+                    yield record
+            return
+        # Offsets past the snapshot's end belong to records written since
+        offsets = [o for o in list(convos.get(convo, ())) if o < index["bytes"]]
+        starts = [b[2] for b in blocks]
+        i = 0
+        while i < len(offsets):
+            block = bisect_right(starts, offsets[i]) - 1
+            end = starts[block + 1] if block + 1 < len(blocks) else index["bytes"]
+            j = bisect_right(offsets, end - 1, i)
+            low, high = blocks[block][0], blocks[block][1]
+            if not ((since and high is not None and high < since) or (until and low is not None and low > until)):
+                data = self._block(number, index, block)
+                for offset in offsets[i:j]:
+                    at = offset - starts[block]
+                    stop = data.find(b"\n", at)
+                    yield _parse(data[at:stop if stop >= 0 else len(data)])
+            i = j
+
+    @staticmethod
+    def _filter(data: bytes, since, until):
+        for line in data.splitlines():
+            record = _parse(line)
+            if record is None:
+                continue
+            ts = record.get("ts") or ""
+            if (since is None or ts >= since) and (until is None or ts <= until):
+                yield record
+
+    # -- paging --------------------------------------------------------------
+
+    def _parts(self) -> list:
+        """(number, index snapshot) of every segment, the active one last"""
+        with self._lock:
+            parts = [(s.number, s.index) for s in self._segments]
+            active = self._active_index
+            parts.append((self._active_number(), dict(active, blocks=[list(b) for b in active["blocks"]],
+                                                      retracts=list(active["retracts"]))))
+        return parts
+
+    def _block(self, number: int, index: dict, i: int) -> bytes:
+        blocks = index["blocks"]
+        end = blocks[i + 1][2] if i + 1 < len(blocks) else index["bytes"]
+        for _ in range(2):
+            with self._lock:
+                if number == self._active_number():
+                    with open(self.root / ACTIVE, "rb") as f:
+                        f.seek(blocks[i][2])
+                        return f.read(end - blocks[i][2])
+                segment = next(s for s in self._segments if s.number == number)
+                segment = Segment(number, segment.path, segment.codec, segment.index, segment.data_start)
+            try:
+                return segment.read_block(i)
+            except FileNotFoundError:
+                continue   # compressed while we were getting here; look it up again
+        raise FileNotFoundError(f"segment {number} moved twice while reading")
+
+    def _lines(self, number: int, index: dict, i: int):
+        """(start offset, end offset, record or None) for each line of block i"""
+        offset = index["blocks"][i][2]
+        for line in self._block(number, index, i).splitlines(keepends=True):
+            yield offset, offset + len(line), _parse(line)
+            offset += len(line)
+
+    @staticmethod
+    def _cursor(text: str) -> tuple:
+        number, _, offset = text.partition(":")
+        return int(number), int(offset)
+
+    def page(self, since: str = None, until: str = None, cursor: str = None, before: str = None,
+             limit: int = 100) -> dict:
+        parts = self._parts()
+        if since is not None or cursor is not None:
+            return self._forward(parts, since, until, cursor, limit)
+        return self._backward(parts, since, until, before, limit)
+
+    def _forward(self, parts, since, until, cursor, limit) -> dict:
+        start_number, start_offset = self._cursor(cursor) if cursor else (parts[0][0], 0)
+        stop_after = None
+        if until:
+            stop_after = datetime.fromtimestamp(datetime.fromisoformat(until).timestamp() +
+                                                self.ts_slack).isoformat(timespec="seconds")
+        parts = [(number, index) for number, index in parts if number >= start_number]
+        retracted = set().union(*(index["retracts"] for _, index in parts))
+        out, first, position = [], None, (start_number, start_offset)
+        for number, index in parts:
+            blocks = index["blocks"]
+            i = 0
+            if number == start_number:
+                i = max(0, bisect_right([b[2] for b in blocks], start_offset) - 1)
+            for i in range(i, len(blocks)):
+                low, high = blocks[i][0], blocks[i][1]
+                if since and high is not None and high < since:
+                    continue
+                if stop_after and low is not None and low > stop_after:
+                    position = (number, blocks[i][2])
+                    return self._page(out, first, position, False)
+                for start, end, record in self._lines(number, index, i):
+                    if number == start_number and start < start_offset:
+                        continue
+                    if (record is None or is_retraction(record) or record.get("seq") in retracted or
+                            (since and (record.get("ts") or "") < since) or
+                            (until and (record.get("ts") or "") > until)):
+                        continue
+                    if len(out) == limit:
+                        return self._page(out, first, position, True)
+                    out.append(record)
+                    first = first or (number, start)
+                    position = (number, end)
+            position = (number, max(index["bytes"], position[1] if position[0] == number else 0))
+        return self._page(out, first, position, False)
+
+    def _backward(self, parts, since, until, before, limit) -> dict:
+        end_number, end_offset = self._cursor(before) if before else (parts[-1][0], parts[-1][1]["bytes"])
+        # Tombstones come after their targets: those in newer segments apply too
+        retracted = set().union(*(index["retracts"] for number, index in parts if number > end_number))
+        parts = [(number, index) for number, index in parts if number <= end_number]
+        out, first, last = [], None, None
+        for number, index in reversed(parts):
+            retracted.update(index["retracts"])
+            blocks = index["blocks"]
+            for i in range(len(blocks) - 1, -1, -1):
+                if number == end_number and blocks[i][2] >= end_offset:
+                    continue
+                low, high = blocks[i][0], blocks[i][1]
+                if until and low is not None and low > until:
+                    continue
+                if since and high is not None and high < since:
+                    return self._page(out, first, last or (end_number, end_offset), False)
+                found = []
+                for start, end, record in self._lines(number, index, i):
+                    if number == end_number and end > end_offset:
+                        break
+                    if (record is None or is_retraction(record) or
+                            (since and (record.get("ts") or "") < since) or
+                            (until and (record.get("ts") or "") > until)):
+                        continue
+                    found.append(((number, start), (number, end), record))
+                # Tombstones later in this block (or later blocks) were
+                # collected before it was read
+                found = [f for f in found if f[2].get("seq") not in retracted]
+                need = limit - len(out)
+                more = len(found) > need
+                found = found[-need:] if need > 0 else []
+                if found:
+                    out[:0] = [record for _, _, record in found]
+                    first = found[0][0]
+                    last = last or found[-1][1]
+                if more or len(out) >= limit:
+                    return self._page(out, first, last or (end_number, end_offset), True)
+        return self._page(out, first, last or (end_number, end_offset), False)
+
+    @staticmethod
+    def _page(records: list, first, position, more: bool) -> dict:
+        return {"messages": records,
+                "prev_cursor": f"{first[0]}:{first[1]}" if first else None,
+                "next_cursor": f"{position[0]}:{position[1]}" if position else None,
+                "more": more}
@@ -0,0 +1,275 @@
+# storage.py — long-term message storage interface with NDJSON-segment and SQLite (WAL) backends
+import sqlite3, threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from codec import loads
+from records import Line, parse
+from tombstones import is_retraction, resolve
+
+BACKENDS = ("ndjson", "sqlite")
+
+
+class MessageStore(ABC):
+    """What the server needs from long-term storage of chat.log records.
+
+    Write side (called from the LogWriter thread, see LogWriter.log's
+    archive): append_lines(serialized records), which returns the bytes
+    stored (each line counted with its newline, as in the NDJSON), sync(),
+    close(). Read side
+    (any thread):
+
+      records(since, until)  every record, retractions included, oldest first
+      query(...)             messages, retracted ones removed, filtered
+      tail(n)                the last n live messages, oldest first
+      page(...)              one page of live messages and cursors around it
+      describe()             backend-specific summary for /history/info
+
+    For checkpoints (see checkpoint.py), position() is a cursor at the
+    current end and records_after(cursor) yields every record written past
+    it, retractions included. index_state() is whatever the backend wants
+    handed back at the next start to skip rebuilding in-memory indexes.
+
+    Subclasses provide records(), tail(), page(), position() and
+    records_after(); query() has a generic implementation on top of
+    records() that a backend may replace.
+
+    page(since, until, cursor, before, limit) reads forward from `cursor`
+    (or from `since`) when either is given, and otherwise backwards from
+    `before` (or the end): the newest `limit` messages. Either way the
+    messages come oldest first, with `prev_cursor` (before the first one,
+    for `before=`), `next_cursor` (after the last one, for `cursor=`) and
+    `more` (the page stopped at `limit`). Cursors are opaque strings
+    specific to the backend.
+    """
+
+    # How far past `until` query() looks for retractions of messages in range;
+    # tombstones follow their target within seconds
+    retraction_slack = 60
+
+    @abstractmethod
+    def append_lines(self, lines: list) -> int:
+        ...
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def records(self, since: str = None, until: str = None):
+        ...
+
+    @abstractmethod
+    def tail(self, n: int) -> list:
+        ...
+
+    @abstractmethod
+    def page(self, since: str = None, until: str = None, cursor: str = None, before: str = None,
+             limit: int = 100) -> dict:
+        ...
+
+    @abstractmethod
+    def position(self) -> str:
+        ...
+
+    @abstractmethod
+    def records_after(self, cursor: str):
+        ...
+
+    def index_state(self):
+        return None
+
+    def describe(self) -> dict:
+        return {}
+
+    def query(self, since: str = None, until: str = None, platform: str = None,
+              role: str = None, convo: str = None, limit: int = 0) -> list:
+        scan_until = None
+        if until:
+            scan_until = datetime.fromtimestamp(datetime.fromisoformat(until).timestamp() +
+                                                self.retraction_slack).isoformat(timespec="seconds")
+        out = []
+        for record in resolve(list(self.records(since, scan_until))):
+            if ((until is None or record.get("ts", "") <= until) and
+                    (platform is None or record.get("platform") == platform) and
+                    (role is None or record.get("role") == role) and
+                    (convo is None or record.get("convo") == convo)):
+                out.append(record)
+                if limit > 0 and len(out) == limit:
+                    break
+        return out
+
+
+class SqliteStore(MessageStore):
+    """Records in one SQLite table (WAL mode) indexed by ts, platform, role, convo.
+
+    Each append_lines() call is one transaction with a single executemany
+    insert; retractions also flag their target row, so queries filter on a
+    column instead of resolving tombstones. Statement texts are constant
+    (one per filter combination), so sqlite3's per-connection statement
+    cache (`cached_statements`) reuses the prepared statements. The writer
+    thread has its own connection; readers get one per thread, which WAL
+    lets run alongside the writer.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            seq       INTEGER,
+            ts        TEXT NOT NULL,
+            type      TEXT NOT NULL DEFAULT 'message',
+            platform  TEXT,
+            role      TEXT,
+            convo     TEXT,
+            msg_id    TEXT,
+            retracts  INTEGER,
+            retracted INTEGER NOT NULL DEFAULT 0,
+            record    TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS records_ts       ON records(ts);
+        CREATE INDEX IF NOT EXISTS records_platform ON records(platform, ts);
+        CREATE INDEX IF NOT EXISTS records_role     ON records(role, ts);
+        CREATE INDEX IF NOT EXISTS records_convo    ON records(convo, ts);
+        CREATE INDEX IF NOT EXISTS records_seq      ON records(seq);
+    """
+    INSERT = ("INSERT INTO records (seq, ts, type, platform, role, convo, msg_id, retracts, record) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    RETRACT = "UPDATE records SET retracted = 1 WHERE seq = ? AND type = 'message'"
+    CACHED_STATEMENTS = 256
+
+    def __init__(self, path: Path, synchronous: str = "NORMAL"):
+        self.path = Path(path)
+        self.synchronous = synchronous
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._db = self._connect(check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=check_same_thread,
+                             cached_statements=self.CACHED_STATEMENTS)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(f"PRAGMA synchronous={self.synchronous}")
+        return db
+
+    def _reader(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    # -- write side --------------------------------------------------------
+
+    def append_lines(self, lines: list) -> int:
+        rows, retracted = [], []
+        stored = 0
+        for line in lines:
+            try:
+                record = parse(line)
+            except ValueError:
+                continue
+            stored += len(line.data) if isinstance(line, Line) else len(line.encode("utf-8", "replace")) + 1
+            kind = "retraction" if is_retraction(record) else "message"
+            if kind == "retraction":
+                retracted.append((record.get("retracts"),))
+            rows.append((record.get("seq"), record.get("ts") or "", kind, record.get("platform"),
+                         record.get("role"), record.get("convo"), record.get("id"),
+                         record.get("retracts"), line))
+        with self._write_lock, self._db:
+            self._db.executemany(self.INSERT, rows)
+            if retracted:
+                self._db.executemany(self.RETRACT, retracted)
+        return stored
+
+    def sync(self):
+        # Each batch is already a committed transaction; with
+        # synchronous=NORMAL a checkpoint is what makes it durable
+        with self._write_lock:
+            self._db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._write_lock:
+            self._db.close()
+
+    # -- read side ---------------------------------------------------------
+
+    @staticmethod
+    def _where(clauses: dict) -> tuple:
+        """WHERE text and params for the non-None clauses (fixed order)"""
+        parts, params = [], []
+        for sql, value in clauses.items():
+            if value is not None:
+                parts.append(sql)
+                params.append(value)
+        return (" WHERE " + " AND ".join(parts) if parts else ""), params
+
+    def records(self, since: str = None, until: str = None):
+        where, params = self._where({"ts >= ?": since, "ts <= ?": until})
+        for (line,) in self._reader().execute(f"SELECT record FROM records{where} ORDER BY rowid", params):
+            yield loads(line)
+
+    def query(self, since: str = None, until: str = None, platform: str = None,
+              role: str = None, convo: str = None, limit: int = 0) -> list:
+        where, params = self._where({"type = 'message' AND retracted = ?": 0, "ts >= ?": since,
+                                     "ts <= ?": until, "platform = ?": platform,
+                                     "role = ?": role, "convo = ?": convo})
+        sql = f"SELECT record FROM records{where} ORDER BY rowid"
+        if limit > 0:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [loads(line) for (line,) in self._reader().execute(sql, params)]
+
+    def tail(self, n: int) -> list:
+        rows = self._reader().execute(
+            "SELECT record FROM records WHERE type = 'message' AND retracted = 0 "
+            "ORDER BY rowid DESC LIMIT ?", (n,)).fetchall()
+        return [loads(line) for (line,) in reversed(rows)]
+
+    def page(self, since: str = None, until: str = None, cursor: str = None, before: str = None,
+             limit: int = 100) -> dict:
+        # Keyset pagination on rowid; cursor k is the position between rows
+        # k and k + 1, so a cursor reads the same forwards and backwards
+        forward = since is not None or cursor is not None
+        where, params = self._where({"type = 'message' AND retracted = ?": 0,
+                                     "rowid > ?": int(cursor) if cursor else None,
+                                     "rowid <= ?": int(before) if before and not forward else None,
+                                     "ts >= ?": since, "ts <= ?": until})
+        order = "ASC" if forward else "DESC"
+        rows = self._reader().execute(f"SELECT rowid, record FROM records{where} ORDER BY rowid {order} LIMIT ?",
+                                      params + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit] if forward else rows[:limit][::-1]
+        if rows:
+            first, last = rows[0][0], rows[-1][0]
+        else:
+            first = None
+            last = (int(cursor) if cursor else
+                    self._reader().execute("SELECT COALESCE(MAX(rowid), 0) FROM records").fetchone()[0])
+        return {"messages": [loads(line) for _, line in rows],
+                "prev_cursor": str(first - 1) if first is not None else None,
+                "next_cursor": str(last), "more": more}
+
+    def position(self) -> str:
+        return str(self._reader().execute("SELECT COALESCE(MAX(rowid), 0) FROM records").fetchone()[0])
+
+    def records_after(self, cursor: str):
+        for (line,) in self._reader().execute("SELECT record FROM records WHERE rowid > ? ORDER BY rowid",
+                                              (int(cursor),)):
+            yield loads(line)
+
+    def describe(self) -> dict:
+        count, first_ts, last_ts = self._reader().execute(
+            "SELECT COUNT(*), MIN(ts), MAX(ts) FROM records").fetchone()
+        return {"backend": "sqlite", "path": self.path.name, "count": count,
+                "first_ts": first_ts, "last_ts": last_ts}
+
+
+def open_store(backend: str, path: Path, **options) -> MessageStore:
+    """The configured backend: "ndjson" (a SegmentStore directory) or "sqlite" (a database file)"""
+    if backend == "ndjson":
+        from segments import SegmentStore   # segments imports this module
+        return SegmentStore(path, **options)
+    if backend == "sqlite":
+        return SqliteStore(path, **options)
+    raise ValueError(f"storage backend must be one of {BACKENDS}, got {backend!r}")
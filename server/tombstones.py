@@ -0,0 +1,68 @@
+# tombstones.py — append-only retraction records for chat.log, and readers that resolve them
+#
+# Instead of rewriting chat.log to take an entry back out, the server appends
+#   {"ts": ..., "seq": 42, "type": "retraction", "retracts": 17, "reason": "prefix_filter"}
+# which refers to the earlier entry whose "seq" is 17. Consumers that read
+# chat.log should go through resolve()/read_resolved() (or do the same
+# filtering themselves). The writer thread periodically compacts the file,
+# physically dropping retracted entries together with their tombstones.
+from pathlib import Path
+from records import parse
+
+RETRACTION = "retraction"
+
+
+def make_retraction(seq: int, target_seq: int, reason: str, ts: str) -> dict:
+    return {"ts": ts, "seq": seq, "type": RETRACTION, "retracts": target_seq, "reason": reason}
+
+
+def is_retraction(record: dict) -> bool:
+    return record.get("type") == RETRACTION
+
+
+def resolve(records: list) -> list:
+    """Drop retraction records and every entry they retract"""
+    retracted = {r.get("retracts") for r in records if is_retraction(r)}
+    return [r for r in records
+            if not is_retraction(r) and (r.get("seq") is None or r.get("seq") not in retracted)]
+
+
+def resolve_lines(lines) -> list:
+    """Parse NDJSON lines (skipping malformed ones) and resolve tombstones"""
+    records = []
+    for line in lines:
+        try:
+            records.append(parse(line))
+        except (ValueError, TypeError):
+            continue
+    return resolve(records)
+
+
+def read_resolved(path: Path) -> list:
+    """Entries of an NDJSON log as consumers should see them"""
+    path = Path(path)
+    if not path.exists():
+        return []
+    return resolve_lines(path.read_text(encoding="utf-8", errors="replace").splitlines())
+
+
+def compact_lines(lines: list) -> list:
+    """Physically drop retracted entries and their tombstones.
+
+    Tombstones whose target already rolled out of the file are dropped too.
+    Malformed lines are kept as they are.
+    """
+    parsed = []
+    retracted = set()
+    for line in lines:
+        try:
+            record = parse(line)
+        except (ValueError, TypeError):
+            record = None
+        if isinstance(record, dict) and is_retraction(record):
+            retracted.add(record.get("retracts"))
+            continue
+        parsed.append((line, record))
+    return [line for line, record in parsed
+            if not (isinstance(record, dict) and record.get("seq") is not None
+                    and record.get("seq") in retracted)]
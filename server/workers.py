@@ -0,0 +1,488 @@
+# workers.py — multi-process ingest: HTTP workers sharing the port in front of one core process
+#
+# With WORKERS > 1 the server process becomes the *core*: it still owns every
+# piece of state (dedup index, seq numbers, coalescer, writer thread, feed,
+# stores) but serves HTTP only on a private Unix socket. WORKERS worker
+# processes bind the public port together with SO_REUSEPORT, so the kernel
+# spreads connections across them, and do the per-request work that does not
+# need that state:
+#
+#   POST /log, POST /log/batch   decode and validate the body (codec.Message,
+#                                400 for a /log that is not one) and sketch
+#                                each text for the near-duplicate lookup
+#                                (near_dup.Sketch); a /log whose id and text
+#                                are already in the shared IdTable is answered
+#                                as a retransmission, everything else goes to
+#                                the core as one pickled frame over a Unix
+#                                socket and the core's verdict comes back the
+#                                same way
+#   anything else                proxied byte for byte to the core's socket
+#
+# Every message still reaches ingest() in the core, one at a time, in the
+# order its worker received it, so dedup decisions, seqs and log order are
+# the same as with one process. The IdTable is only a cache in front of the
+# core's SeenIds, keyed the same way (idempotency.message_key: id plus text
+# hash), and only holds keys the core has ruled on: a worker checks it before
+# forwarding a /log and adds the key once the core's verdict comes back
+# "accepted" or "duplicate". A retry of a message the core failed on (500)
+# or never got (503) is forwarded again, and a key the table has forgotten
+# just takes the longer way round.
+#
+# What the workers take off the core is the work that needs no state: HTTP,
+# JSON decoding and schema checks, and the SimHash of every text, which
+# alone was a third of the core's time per message. The duplicate rules
+# themselves, seqs and the writes stay in the core, so its remaining time
+# per message caps throughput however many workers there are.
+# bench/loadgen.py --compare-workers reports that time and the cap it sets
+# next to the req/s it measured.
+#
+# Linux and macOS only (SO_REUSEPORT, fcntl); WORKERS = 1 needs none of this.
+import argparse, asyncio, hashlib, itertools, json, logging, mmap, os, pickle, shutil
+import socket, struct, subprocess, sys, tempfile
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:   # Windows: single-process mode only
+    fcntl = None
+
+from logsetup import LOGGER_NAME, configure_logging
+from idempotency import message_key
+from near_dup import Sketch
+import codec
+
+log = logging.getLogger(LOGGER_NAME)
+
+LOCAL_ROUTES = {"/log": "log", "/log/batch": "batch"}
+REMEMBERED = ("accepted", "duplicate")   # ingest() verdicts after which the IdTable keeps a message's key
+REPORT_INTERVAL = 0.5   # seconds between a worker's reports of the retransmissions it answered
+_FRAME = struct.Struct("<I")
+
+
+class IdTable:
+    """Set of hashed message keys (see idempotency.message_key) in a file mapping shared by all workers.
+
+    The slots are split into `stripes` regions, each guarded by an fcntl
+    byte-range lock on its first byte, so two workers only wait for each
+    other when their ids hash to the same stripe. An id probes PROBE slots
+    of its stripe; when all of them are taken one is overwritten.
+    """
+
+    PROBE = 8
+
+    def __init__(self, path: Path, slots: int = 1 << 20, stripes: int = 64, create: bool = False):
+        self.path = Path(path)
+        self.stripes = stripes
+        self.region = max(self.PROBE, slots // stripes)
+        size = self.region * stripes * 8
+        self._fd = os.open(self.path, os.O_RDWR | (os.O_CREAT | os.O_TRUNC if create else 0), 0o600)
+        if create:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._slots = memoryview(self._map).cast("Q")
+
+    def _probe(self, key: str, add: bool) -> bool:
+        """True if key is in the table; with add, puts it there if it is not"""
+        digest = hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+        h = int.from_bytes(digest, "little") or 1   # 0 marks an empty slot
+        stripe, rest = h % self.stripes, h // self.stripes
+        base, region, slots = stripe * self.region, self.region, self._slots
+        start = rest % region
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, base * 8)
+        try:
+            for i in range(self.PROBE):
+                pos = base + (start + i) % region
+                value = slots[pos]
+                if value == h:
+                    return True
+                if value == 0:
+                    if add:
+                        slots[pos] = h
+                    return False
+            if add:
+                # Slots are never cleared, so a full probe run means evicting one
+                slots[base + (start + (rest >> 32) % self.PROBE) % region] = h
+            return False
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, base * 8)
+
+    def __contains__(self, key: str) -> bool:
+        return self._probe(key, False)
+
+    def add(self, key: str):
+        self._probe(key, True)
+
+    def close(self):
+        self._slots.release()
+        self._map.close()
+        os.close(self._fd)
+
+
+# -- frames: 4-byte little-endian length, then a pickle ----------------------
+
+def write_frame(writer: asyncio.StreamWriter, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(_FRAME.pack(len(data)) + data)
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """The next frame's object, or None at end of stream"""
+    try:
+        size, = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+        return pickle.loads(await reader.readexactly(size))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+# -- core side ----------------------------------------------------------------
+
+class WorkerPool:
+    """Starts the worker processes and answers their frames in the core.
+
+    handlers maps a frame kind ("log", "batch", "retransmissions") to a
+    coroutine function taking the payload (a codec.Message for "log", the
+    codec.decode_batch list or None for "batch", a count for
+    "retransmissions"); for requests it returns
+    (status_code, content), content being a str (text/plain) or JSON-able,
+    and for "log" optionally ingest()'s verdict as a third item: the worker
+    adds the message's key to the IdTable only once that is "accepted" or
+    "duplicate", so a message the core failed on is retried.
+    Each frame runs as its own task, created in arrival order, just as
+    uvicorn runs each request.
+    """
+
+    def __init__(self, count: int, host: str, port: int, handlers: dict,
+                 slots: int = 1 << 20, stripes: int = 64, log_level: str = "WARNING"):
+        if fcntl is None or not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("multiple workers need SO_REUSEPORT and fcntl (Linux or macOS)")
+        self.count = count
+        self.host = host
+        self.port = port
+        self.handlers = handlers
+        self.slots = slots
+        self.stripes = stripes
+        self.log_level = log_level
+        self.run_dir = Path(tempfile.mkdtemp(prefix="ai-live-logger-"))
+        self.http_path = str(self.run_dir / "core-http.sock")   # the core's uvicorn listens here
+        self.link_path = str(self.run_dir / "core-link.sock")
+        self.frames = {}
+        self._table = None
+        self._server = None
+        self._procs = []
+        self._tasks = set()
+
+    async def start(self):
+        self._table = IdTable(self.run_dir / "ids.table", self.slots, self.stripes, create=True)
+        self._server = await asyncio.start_unix_server(self._serve_link, self.link_path)
+        script = str(Path(__file__).resolve())
+        for index in range(self.count):
+            self._procs.append(subprocess.Popen([
+                sys.executable, script, "--index", str(index), "--host", self.host,
+                "--port", str(self.port), "--run-dir", str(self.run_dir), "--slots", str(self.slots),
+                "--stripes", str(self.stripes), "--log-level", self.log_level]))
+        log.info("Started %d ingest workers on %s:%d", self.count, self.host, self.port)
+
+    async def stop(self, grace: float = 2.0):
+        """Let the workers finish (they got the same Ctrl+C), then make sure they are gone"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + grace
+        for proc in self._procs:
+            try:
+                await asyncio.to_thread(proc.wait, max(0.0, deadline - loop.time()))
+            except subprocess.TimeoutExpired:
+                proc.terminate()
+        for proc in self._procs:
+            try:
+                await asyncio.to_thread(proc.wait, 10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._table is not None:
+            self._table.close()
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    async def _serve_link(self, reader, writer):
+        while (frame := await read_frame(reader)) is not None:
+            req_id, kind, payload = frame
+            self.frames[kind] = self.frames.get(kind, 0) + 1
+            task = asyncio.create_task(self._handle(req_id, kind, payload, writer))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        writer.close()
+
+    async def _handle(self, req_id, kind, payload, writer):
+        try:
+            result = await self.handlers[kind](payload)
+        except Exception as e:
+            log.error("WORKER FRAME ERROR: %s", e)
+            result = (500, "Internal Server Error")
+        if req_id is not None and not writer.is_closing():
+            write_frame(writer, (req_id, result))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    def stats(self) -> dict:
+        return {"workers": self.count, "alive": sum(p.poll() is None for p in self._procs),
+                "frames": dict(self.frames), "id_table": {"slots": self.slots, "stripes": self.stripes}}
+
+
+# -- worker side ----------------------------------------------------------------
+
+class Worker:
+    """ASGI app of one worker process (see the module comment)"""
+
+    def __init__(self, run_dir: Path, slots: int, stripes: int, log_level: str):
+        self.run_dir = Path(run_dir)
+        self.http_path = str(self.run_dir / "core-http.sock")
+        self.link_path = str(self.run_dir / "core-link.sock")
+        self.table = IdTable(self.run_dir / "ids.table", slots, stripes)
+        self.log_level = log_level
+        self.server = None      # the uvicorn.Server, stopped if the core goes away
+        self.retransmissions = 0
+        self._log_listener = None
+        self._writer = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self._tasks = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        kind = LOCAL_ROUTES.get(scope["path"]) if scope["method"] == "POST" else None
+        if kind is None:
+            await self._proxy(scope, body, receive, send)
+        else:
+            await self._ingest(kind, scope, body, send)
+
+    # -- ingest ------------------------------------------------------------
+
+    async def _ingest(self, kind: str, scope, body: bytes, send) -> bool:
+        """Answer a POST /log or /log/batch"""
+        key = None
+        if kind == "log":
+            try:
+                payload = codec.decode_message(body)
+            except ValueError as e:   # not JSON, or a SchemaError: 400, as the core answers it
+                await self._respond(scope, send, 400, {"error": str(e)})
+                return True
+            if payload.id:
+                key = message_key(payload.id, payload.text)
+                if key in self.table:
+                    self.retransmissions += 1
+                    await self._respond(scope, send, 200, "ok")
+                    return True
+            payload.sketch = Sketch(payload.text)
+        else:
+            try:
+                payload = codec.decode_batch(body)
+            except ValueError:
+                payload = None    # the core answers 400 (see worker_batch)
+            for message in payload or ():
+                if message is not None:
+                    message.sketch = Sketch(message.text)
+        try:
+            status, content, *verdict = await self._call(kind, payload)
+        except ConnectionError:
+            status, content, verdict = 503, "core process unavailable", ()
+        if kind == "log" and key is not None and status == 200 and verdict and verdict[0] in REMEMBERED:
+            self.table.add(key)
+        await self._respond(scope, send, status, content)
+        return True
+
+    async def _call(self, kind: str, payload):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError("no link to the core")
+        req_id = next(self._ids)
+        future = self._pending[req_id] = asyncio.get_running_loop().create_future()
+        write_frame(self._writer, (req_id, kind, payload))
+        await self._writer.drain()
+        return await future
+
+    @staticmethod
+    async def _respond(scope, send, status: int, content):
+        if isinstance(content, str):
+            body, media = content.encode("utf-8"), b"text/plain; charset=utf-8"
+        else:   # rendered like starlette's JSONResponse
+            body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+            media = b"application/json"
+        headers = [(b"content-type", media), (b"content-length", str(len(body)).encode())]
+        if any(name == b"origin" for name, _ in scope["headers"]):
+            headers.append((b"access-control-allow-origin", b"*"))   # what the core's CORSMiddleware adds
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    # -- proxy -------------------------------------------------------------
+
+    async def _proxy(self, scope, body: bytes, receive, send):
+        """Pass the request to the core's Unix socket and stream the response back"""
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.http_path)
+        except OSError:
+            await self._respond(scope, send, 503, "core process unavailable")
+            return
+        target = scope["raw_path"] + (b"?" + scope["query_string"] if scope["query_string"] else b"")
+        head = [scope["method"].encode("ascii") + b" " + target + b" HTTP/1.1"]
+        head += [name + b": " + value for name, value in scope["headers"]
+                 if name not in (b"connection", b"keep-alive", b"content-length", b"transfer-encoding")]
+        head += [b"content-length: " + str(len(body)).encode(), b"connection: close"]
+        # A client that hangs up (an idle /feed, say) closes the core connection too
+        watcher = asyncio.create_task(self._close_on_disconnect(receive, writer))
+        try:
+            writer.write(b"\r\n".join(head) + b"\r\n\r\n" + body)
+            status_line, *lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+            headers, length, chunked = [], None, False
+            for line in filter(None, lines):
+                name, _, value = line.partition(":")
+                name, value = name.strip().lower(), value.strip()
+                if name == "transfer-encoding":
+                    chunked = value.lower() == "chunked"
+                    continue
+                if name in ("connection", "keep-alive"):
+                    continue
+                if name == "content-length":
+                    length = int(value)
+                headers.append((name.encode("latin-1"), value.encode("latin-1")))
+            await send({"type": "http.response.start", "status": int(status_line.split()[1]), "headers": headers})
+            if chunked:
+                while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+                    chunk = await reader.readexactly(size + 2)
+                    await send({"type": "http.response.body", "body": chunk[:-2], "more_body": True})
+            else:
+                remaining = length
+                while remaining is None or remaining > 0:
+                    chunk = await reader.read(65536 if remaining is None else min(65536, remaining))
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass    # the core or the client went away mid-response; nothing more to send
+        finally:
+            watcher.cancel()
+            writer.close()
+
+    @staticmethod
+    async def _close_on_disconnect(receive, writer):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        writer.close()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self._startup()
+                except OSError as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _startup(self):
+        self._log_listener = configure_logging(self.log_level)
+        for attempt in range(100):   # the core starts us before its link socket may be ready
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.link_path)
+                break
+            except OSError:
+                if attempt == 99:
+                    raise
+                await asyncio.sleep(0.1)
+        self._tasks = [asyncio.create_task(self._read_replies(reader)),
+                       asyncio.create_task(self._report_periodically())]
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._report()
+        if self._writer is not None:
+            self._writer.close()
+        self.table.close()
+        if self._log_listener is not None:
+            self._log_listener.stop()
+
+    async def _read_replies(self, reader):
+        while (frame := await read_frame(reader)) is not None:
+            req_id, result = frame
+            future = self._pending.pop(req_id, None)
+            if future is not None and not future.done():
+                future.set_result(result)
+        # The core is gone: fail what is waiting and stop taking connections
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("core process went away"))
+        self._pending.clear()
+        if self.server is not None:
+            self.server.should_exit = True
+
+    def _report(self):
+        """Tell the core how many retransmissions were answered here, for its metrics"""
+        if self.retransmissions and self._writer is not None and not self._writer.is_closing():
+            write_frame(self._writer, (None, "retransmissions", self.retransmissions))
+            self.retransmissions = 0
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            self._report()
+
+
+def listen_socket(host: str, port: int) -> socket.socket:
+    """A listening TCP socket other workers can bind as well"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    # IPPROTO_TCP spelled out: asyncio only sets TCP_NODELAY on sockets that say so
+    sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="ai-live-logger ingest worker (started by the core process)")
+    parser.add_argument("--index", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8788)
+    parser.add_argument("--run-dir", type=Path, required=True)
+    parser.add_argument("--slots", type=int, default=1 << 20)
+    parser.add_argument("--stripes", type=int, default=64)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    worker = Worker(args.run_dir, args.slots, args.stripes, args.log_level)
+    server = worker.server = uvicorn.Server(uvicorn.Config(
+        worker, lifespan="on", access_log=False, log_level=args.log_level.lower()))
+    try:
+        server.run(sockets=[listen_socket(args.host, args.port)])
+    except KeyboardInterrupt:
+        pass    # uvicorn re-raises the Ctrl+C it already shut down for
+
+
+if __name__ == "__main__":
+    main()